@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import hmac
+import json
+import time
+import hashlib
+import logging
+import threading
+
+
+SIGNATURE_HEADER = "X-Nyzo-Signature"
+MAX_REPORT_SIZE = 65536  # bytes
+MAX_CLOCK_SKEW = 300  # seconds between the clocks of the agent and of the manager
+STAT_FIELDS = ("cpu", "version", "process", "nyzoVerifier", "listen", "solving")  # fields always set by verifier_report.build_report
+
+
+def sign(key, body):
+	"""HMAC-SHA256 of the report body with the agent key of the miner, hex encoded"""
+	return hmac.new(key.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+class AgentReports:
+	"""
+	Ingest of the reports pushed by the agents (nyzo_agent.py). A report is the JSON object
+	{"minerId", "timestamp", "interval", "duration", "stat"}, stat being built by verifier_report like a probe report,
+	signed with the agentKey of the miner. Reports older than the last accepted one are rejected, so a captured report
+	cannot be replayed.
+	"""
+
+	def __init__(self, farm, statistic_pool, log=None):
+
+		if log is None:
+			self.log = logging.getLogger("AgentReports")
+		else:
+			self.log = log
+
+		self.mining_farm = farm
+		self.statistic_pool = statistic_pool
+		self.last_timestamps = {}  # miner id -> timestamp of the last accepted report
+		self.accepted = 0
+		self.rejected = 0
+		self.lock = threading.Lock()
+
+	def ingest(self, body, signature):
+		"""Record the report and return None, or return (http status, error) if it is rejected"""
+		error = self.__ingest(body, signature)
+		self.lock.acquire()
+		try:
+			if error is None:
+				self.accepted += 1
+			else:
+				self.rejected += 1
+		finally:
+			self.lock.release()
+		return error
+
+	def get_counters(self):
+		self.lock.acquire()
+		try:
+			return {"accepted": self.accepted, "rejected": self.rejected}
+		finally:
+			self.lock.release()
+
+	def __ingest(self, body, signature):
+		if len(body) > MAX_REPORT_SIZE:
+			return 413, "Report too large"
+
+		try:
+			report = json.loads(body.decode("utf-8"))
+			miner_id = report["minerId"]
+			timestamp = float(report["timestamp"])
+			interval = float(report["interval"])
+			stat = report["stat"]
+			duration = report.get("duration")
+			if duration is not None:
+				duration = float(duration)
+			if not isinstance(miner_id, str) or not isinstance(stat, dict) or any(field not in stat for field in STAT_FIELDS) or not isinstance(stat["process"], list) or interval <= 0:
+				raise ValueError("missing fields")
+		except (ValueError, KeyError, TypeError):
+			return 400, "Invalid report"
+
+		miner = self.mining_farm.get_miner(miner_id)
+		if miner is None or miner.agent_key is None:
+			return 403, "Miner not found or agent disabled"
+		if signature is None or not hmac.compare_digest(sign(miner.agent_key, body).encode("ascii"), signature.encode("latin-1")):
+			self.log.warning("Invalid signature of the report of " + miner_id)
+			return 403, "Invalid signature"
+
+		if abs(time.time() - timestamp) > MAX_CLOCK_SKEW:
+			return 400, "Report timestamp too far from the manager clock"
+
+		self.lock.acquire()
+		try:
+			if timestamp <= self.last_timestamps.get(miner_id, 0):
+				return 400, "Report older than the last one"
+			self.last_timestamps[miner_id] = timestamp
+		finally:
+			self.lock.release()
+
+		self.statistic_pool.submit_report(miner, stat, interval, duration)
+		return None
@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import concurrent.futures
+import email.utils
+import http
+import http_cache
+import io
+import logging
+import queue
+import re
+import selectors
+import socket
+import time
+
+
+CONTENT_LENGTH = re.compile(rb"\r\ncontent-length[ \t]*:[ \t]*(\d+)", re.IGNORECASE)
+TRANSFER_ENCODING = re.compile(rb"\r\ntransfer-encoding[ \t]*:", re.IGNORECASE)
+
+
+class AsyncHttpConnection:
+
+	def __init__(self, connection, client_address):
+		self.connection = connection
+		self.client_address = client_address
+		self.input = bytearray()  # received bytes not handled yet (the next pipelined requests)
+		self.output = None  # memoryview of the response being sent
+		self.response_stream = None  # wfile of the request being handled by a worker
+		self.keep_alive = True
+		self.processing = False  # a worker is handling a request, the connection is not watched meanwhile
+		self.detached = False
+		self.events = 0  # events the connection is registered for
+		self.last_activity = time.time()
+		self.requests = 0
+
+
+class AsyncHttpServer:
+	"""
+	HTTP/1.1 server with persistent connections. A single thread accepts the connections and reads and writes all of
+	them with a selector, so idle keep-alive clients and slow readers cost no thread. Once a request is fully received,
+	it is handled by the HTTPHandler class (a BaseHTTPRequestHandler, as with MultiThreadHttpServer) on a pool of
+	parallelism worker threads, and the response is written back by the selector thread. The GET requests whose
+	response is already rendered (see cached_response_callback) are answered by the selector thread itself: handing a
+	request to a worker and back costs more than building such a response.
+	"""
+
+	KEEP_ALIVE_TIMEOUT = 30  # seconds before an idle persistent connection is closed
+	MAX_REQUESTS_PER_CONNECTION = 1000
+	MAX_HEADER_SIZE = 65536
+	MAX_BODY_SIZE = 1024 * 1024
+	RECV_SIZE = 65536
+
+	def __init__(self, host, parallelism, HTTPHandler, request_callback=None, cached_response_callback=None, max_connections=1000, log=None):
+		"""
+		:param host: host to bind. example: ('127.0.0.1', 80)
+		:param parallelism: number of worker threads running the handlers
+		:param HTTPHandler: the handler class
+		:param request_callback: callback on incoming request, accessed by the handler as self.server.request_callback
+		:param cached_response_callback: callable(request path) run by the selector thread for the GET requests. Returns
+		(http_cache.CachedResponse, Cache-Control) to answer the request with, or None to hand it to HTTPHandler. Must not
+		block
+		:param max_connections: connections above this number are closed right after being accepted
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("AsyncHttpServer")
+		else:
+			self.log = log
+
+		self.host = host
+		self.parallelism = parallelism
+		self.HTTPHandler = _adapt_handler(HTTPHandler)
+		self.request_callback = request_callback
+		self.cached_response_callback = cached_response_callback
+		self.max_connections = max_connections
+		self.server_header = (HTTPHandler.server_version + " " + HTTPHandler.sys_version).encode("latin-1")
+
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.selector = selectors.DefaultSelector()
+		self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+		self.wakeup_receiver.setblocking(False)
+		self.wakeup_sender.setblocking(False)
+		self.executor = None
+		self.connections = {}  # socket -> AsyncHttpConnection, only modified by the selector thread
+		self.completed = queue.Queue()  # (connection, response or None if detached, keep alive) sent back by the workers
+		self.selecting = False  # the selector thread is waiting in select, the workers must wake it up
+		self.stop_requested = False
+
+	def start(self):
+		"""Serve until stop is called"""
+		self.socket.bind(self.host)
+		self.socket.listen(max(128, self.parallelism))
+		self.socket.setblocking(False)
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="http")
+		self.selector.register(self.socket, selectors.EVENT_READ)
+		self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+
+		last_idle_check = time.time()
+		try:
+			while not self.stop_requested:
+				self.selecting = True
+				# a response completed before selecting was set did not wake the selector up
+				ready = self.selector.select(timeout=0 if not self.completed.empty() else 1)
+				self.selecting = False
+				for key, events in ready:
+					if key.fileobj is self.socket:
+						self.__accept()
+					elif key.fileobj is self.wakeup_receiver:
+						self.__drain_wakeup()
+					else:
+						if events & selectors.EVENT_READ:
+							self.__read(key.data)
+						if events & selectors.EVENT_WRITE:
+							self.__write(key.data)
+
+				self.__process_completed()
+
+				if time.time() - last_idle_check >= 1:
+					last_idle_check = time.time()
+					self.__close_idle()
+		finally:
+			for connection in list(self.connections.values()):
+				self.__close(connection)
+			self.selector.close()
+			self.socket.close()
+			self.executor.shutdown(wait=False, cancel_futures=True)
+
+	def stop(self):
+		self.stop_requested = True
+		self.__wakeup()
+
+	def detach_request(self, request):
+		"""
+		Called by a handler (from a worker thread) to take the connection away from the server: the response written so
+		far is sent right away and the connection is then neither read, written nor closed by the server
+		"""
+		connection = self.connections[request]
+		connection.detached = True
+		request.setblocking(True)
+		request.sendall(connection.response_stream.getvalue())
+		connection.response_stream.seek(0)
+		connection.response_stream.truncate()
+
+	def __accept(self):
+		while True:
+			try:
+				sock, client_address = self.socket.accept()
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError as e:
+				self.log.warning("Accept failed: " + str(e))
+				return
+
+			if len(self.connections) >= self.max_connections:
+				sock.close()
+				continue
+
+			sock.setblocking(False)
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			connection = AsyncHttpConnection(sock, client_address)
+			self.connections[sock] = connection
+			self.__register(connection, selectors.EVENT_READ)
+
+	def __read(self, connection):
+		try:
+			data = connection.connection.recv(AsyncHttpServer.RECV_SIZE)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError:
+			self.__close(connection)
+			return
+
+		if len(data) == 0:
+			self.__close(connection)
+			return
+
+		connection.input.extend(data)
+		connection.last_activity = time.time()
+		self.__dispatch(connection)
+
+	def __dispatch(self, connection):
+		"""Answer the complete requests of the connection having a cached response, then hand the next one to a worker"""
+		while self.__next_request(connection):
+			if not self.__send(connection):
+				return
+
+	def __next_request(self, connection):
+		"""Start the handling of the next complete request. Return True if its response is ready to be sent"""
+		if connection.processing:
+			return False
+
+		header_end = connection.input.find(b"\r\n\r\n")
+		if header_end < 0:
+			if len(connection.input) > AsyncHttpServer.MAX_HEADER_SIZE:
+				self.__reject(connection, 431, "Request Header Fields Too Large")
+			return False
+
+		request_end = header_end + 4
+		match = CONTENT_LENGTH.search(connection.input, 0, header_end + 2)
+		if match is not None:
+			content_length = int(match.group(1))
+			if content_length > AsyncHttpServer.MAX_BODY_SIZE:
+				self.__reject(connection, 413, "Payload Too Large")
+				return False
+			request_end += content_length
+			if len(connection.input) < request_end:
+				return False  # wait for the body
+
+		request = bytes(connection.input[:request_end])
+		del connection.input[:request_end]
+
+		connection.processing = True
+		if match is None and self.cached_response_callback is not None:
+			cached = self.__get_cached_response(connection, request, header_end)
+			if cached is not None:
+				connection.output = memoryview(cached[0])
+				connection.keep_alive = cached[1]
+				return True
+
+		connection.response_stream = io.BytesIO()
+		self.__register(connection, 0)
+		self.executor.submit(self.__handle, connection, request)
+		return False
+
+	def __get_cached_response(self, connection, request, header_end):
+		"""Return (response, keep alive) if the request is answered with a cached response, None otherwise"""
+		lines = request[:header_end].decode("latin-1").split("\r\n")
+		words = lines[0].split()
+		if len(words) != 3 or words[0] != "GET" or words[2] != "HTTP/1.1":
+			return None
+
+		try:
+			cached = self.cached_response_callback(words[1])
+		except Exception as e:
+			self.log.error("Error while getting the cached response of " + words[1] + ": " + str(e))
+			return None
+		if cached is None:
+			return None
+
+		request_headers = _RequestHeaders(lines[1:])
+		code, headers, body = http_cache.build_cached_response(request_headers, cached[0], cached[1])
+		keep_alive = request_headers.headers.get("Connection", "").lower() != "close" and connection.requests + 1 < AsyncHttpServer.MAX_REQUESTS_PER_CONNECTION
+
+		response = [b"HTTP/1.1 " + str(code).encode("ascii") + b" " + http.HTTPStatus(code).phrase.encode("latin-1"),
+					b"Server: " + self.server_header, b"Date: " + email.utils.formatdate(usegmt=True).encode("latin-1")]
+		response.extend((name + ": " + value).encode("latin-1") for name, value in headers)
+		if not keep_alive:
+			response.append(b"Connection: close")
+		response.append(b"")
+		response.append(body)
+		return b"\r\n".join(response), keep_alive
+
+	def __handle(self, connection, request):
+		"""Worker thread: run the handler and queue the response for the selector thread"""
+		keep_alive = False
+		try:
+			handler = self.HTTPHandler(connection, request, self)
+			keep_alive = not handler.close_connection
+			response = connection.response_stream.getvalue()
+		except Exception as e:
+			self.log.error("Error while handling request: " + str(e))
+			response = b""
+
+		if connection.detached:
+			self.completed.put((connection, None, False))
+		else:
+			response, complete = _complete_response(response)
+			keep_alive = keep_alive and complete
+			if keep_alive and connection.requests + 1 >= AsyncHttpServer.MAX_REQUESTS_PER_CONNECTION:
+				response = _close_response(response)
+				keep_alive = False
+			# the connection is not watched while processing: send what the socket takes now, the selector sends the rest
+			try:
+				response = response[connection.connection.send(response):]
+			except (BlockingIOError, InterruptedError):
+				pass
+			except OSError:
+				pass  # the selector thread gets the error again and closes the connection
+			self.completed.put((connection, response, keep_alive))
+		if self.selecting:
+			self.__wakeup()
+
+	def __process_completed(self):
+		while True:
+			try:
+				connection, response, keep_alive = self.completed.get_nowait()
+			except queue.Empty:
+				return
+
+			if response is None:
+				# detached, now owned by the handler
+				self.connections.pop(connection.connection, None)
+				continue
+
+			connection.output = memoryview(response)
+			connection.keep_alive = keep_alive
+			self.__write(connection)
+
+	def __write(self, connection):
+		if self.__send(connection):
+			self.__dispatch(connection)  # pipelined request already received
+
+	def __send(self, connection):
+		"""Send the pending output of the connection. Return True once the response is sent and the connection kept"""
+		try:
+			sent = connection.connection.send(connection.output)
+			connection.output = connection.output[sent:]
+		except (BlockingIOError, InterruptedError):
+			pass
+		except OSError:
+			self.__close(connection)
+			return False
+
+		if len(connection.output) > 0:
+			self.__register(connection, selectors.EVENT_WRITE)
+			return False
+
+		connection.output = None
+		connection.processing = False
+		connection.requests += 1
+		connection.last_activity = time.time()
+		if not connection.keep_alive:
+			self.__close(connection)
+			return False
+
+		self.__register(connection, selectors.EVENT_READ)
+		return True
+
+	def __reject(self, connection, code, message):
+		connection.processing = True
+		connection.input.clear()
+		connection.output = memoryview(("HTTP/1.1 " + str(code) + " " + message + "\r\nContent-Length: 0\r\nConnection: close\r\n\r\n").encode("latin-1"))
+		connection.keep_alive = False
+		self.__send(connection)
+
+	def __close_idle(self):
+		limit = time.time() - AsyncHttpServer.KEEP_ALIVE_TIMEOUT
+		for connection in list(self.connections.values()):
+			if not connection.processing and connection.last_activity < limit:
+				self.__close(connection)
+
+	def __close(self, connection):
+		if self.connections.pop(connection.connection, None) is None:
+			return
+		self.__register(connection, 0)
+		try:
+			connection.connection.close()
+		except OSError:
+			pass
+
+	def __register(self, connection, events):
+		if events == connection.events:
+			return
+		if connection.events == 0:
+			self.selector.register(connection.connection, events, connection)
+		elif events == 0:
+			self.selector.unregister(connection.connection)
+		else:
+			self.selector.modify(connection.connection, events, connection)
+		connection.events = events
+
+	def __wakeup(self):
+		try:
+			self.wakeup_sender.send(b"\0")
+		except (BlockingIOError, OSError):
+			pass  # already awake
+
+	def __drain_wakeup(self):
+		try:
+			while self.wakeup_receiver.recv(4096):
+				pass
+		except (BlockingIOError, OSError):
+			pass
+
+
+class _RequestHeaders:
+	"""Headers of a request parsed by the selector thread, as read by http_cache through http_request.headers"""
+
+	def __init__(self, lines):
+		self.headers = _CaseInsensitiveDict()
+		for line in lines:
+			name, separator, value = line.partition(":")
+			if separator:
+				self.headers.setdefault(name.strip().lower(), value.strip())
+
+
+class _CaseInsensitiveDict(dict):
+
+	def get(self, name, default=None):
+		return dict.get(self, name.lower(), default)
+
+
+def _close_response(response):
+	"""Add Connection: close to the headers of response"""
+	header_end = response.find(b"\r\n\r\n")
+	return response[:header_end] + b"\r\nConnection: close" + response[header_end:]
+
+
+def _adapt_handler(HTTPHandler):
+	"""
+	Subclass HTTPHandler to handle a single request already read in memory: rfile holds the request and wfile buffers
+	the response, so the handler code written for the blocking server runs unchanged
+	"""
+
+	class AsyncHTTPHandler(HTTPHandler):
+
+		protocol_version = "HTTP/1.1"
+
+		def __init__(self, connection, request, server):
+			self.async_connection = connection
+			self.async_request = request
+			HTTPHandler.__init__(self, connection.connection, connection.client_address, server)
+
+		def setup(self):
+			self.connection = self.request
+			self.rfile = io.BytesIO(self.async_request)
+			self.wfile = self.async_connection.response_stream
+
+		def handle(self):
+			self.handle_one_request()
+
+		def send_file(self, file, count):
+			# the response is buffered and written by the selector loop
+			self.wfile.write(file.read(count))
+
+		def finish(self):
+			# the handlers of the blocking server may return without calling end_headers
+			if len(getattr(self, '_headers_buffer', [])) > 0 and not self.async_connection.detached:
+				self.end_headers()
+
+	return AsyncHTTPHandler
+
+
+def _complete_response(response):
+	"""
+	Add the Content-Length header a persistent connection needs when the handler did not send it.
+	Return (response, True) or (response, False) if the end of the response can only be signaled by closing the connection
+	"""
+	header_end = response.find(b"\r\n\r\n")
+	if header_end < 0:
+		return b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n", False
+
+	status_line_end = response.find(b"\r\n")
+	status = response[:status_line_end].split(b" ", 2)
+	code = int(status[1]) if len(status) > 1 and status[1].isdigit() else 0
+	if code < 200 or code in (204, 304):
+		return response, True  # no body
+
+	if CONTENT_LENGTH.search(response, 0, header_end + 2) is not None:
+		return response, True
+	if TRANSFER_ENCODING.search(response, 0, header_end + 2) is not None:
+		return response, False
+
+	body_length = len(response) - header_end - 4
+	return response[:header_end] + b"\r\nContent-Length: " + str(body_length).encode("ascii") + response[header_end:], True
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import logging
+import tempfile
+import threading
+import multiprocessing
+import paramiko
+import ssh_connection_pool
+from mining_farm import MiningFarm
+from benchmark_log_parser import generate_log
+
+
+VERSION_COMMAND = "grep final /home/ubuntu/nyzoVerifier/src/main/java/co/nyzo/verifier/Version.java"
+LOG_COMMAND = "tail -c 2000 /var/log/nyzo-verifier-stdout.log"
+MIN_LATENCY = 0.005  # paramiko acknowledges the exec request after check_channel_exec_request returns, answering earlier closes the channel first
+BATCH_SECTION = re.compile(r"printf '\\n%s %s out\\n' '(\S+)' '(\w+)'\n\{ (.*?)\n\} </dev/null", re.S)
+
+
+class FakeVerifierServer(paramiko.ServerInterface):
+	"""
+	One ssh connection to a simulated verifier. The user name selects the verifier, and the commands of the probes
+	(load average, version, processes, log, batched script) are answered in memory after a simulated latency
+	"""
+
+	def __init__(self, settings, logs):
+		self.settings = settings
+		self.logs = logs
+		self.index = 0
+
+	def check_auth_password(self, username, password):
+		if not username.startswith("verifier"):
+			return paramiko.AUTH_FAILED
+		self.index = int(username[len("verifier"):])
+		return paramiko.AUTH_SUCCESSFUL
+
+	def get_allowed_auths(self, username):
+		return "password"
+
+	def check_channel_request(self, kind, chanid):
+		return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+	def check_channel_exec_request(self, channel, command):
+		threading.Thread(target=self.__answer, args=(channel, command.decode("utf-8")), daemon=True).start()
+		return True
+
+	def __answer(self, channel, command):
+		try:
+			if "/proc/loadavg" in command and random.random() < self.settings["failure_rate"]:
+				time.sleep(MIN_LATENCY)
+				channel.get_transport().close()  # the probe fails as on a network drop
+				return
+
+			if command.startswith("__nm_err="):
+				time.sleep(MIN_LATENCY)
+				stdout, stderr, status = self.__batch(command)
+			else:
+				stdout, stderr, status = self.__execute(command)
+
+			channel.sendall(stdout.encode("utf-8"))
+			channel.sendall_stderr(stderr.encode("utf-8"))
+			channel.send_exit_status(status)
+		except (EOFError, OSError, paramiko.SSHException):
+			pass
+		finally:
+			channel.close()
+
+	def __execute(self, command):
+		latency = self.settings["latency"]
+		time.sleep(max(MIN_LATENCY, random.uniform(latency - self.settings["jitter"], latency + self.settings["jitter"])))
+
+		running = random.Random(self.index).random() >= self.settings["stopped_ratio"]  # the same verifiers are always stopped
+		if "/proc/loadavg" in command:
+			load = random.uniform(0.05, 1.5)
+			return "%.2f %.2f %.2f 1/312 %d\n" % (load, load * 0.9, load * 0.8, 4000 + self.index), "", 0
+		if "Version.java" in command:
+			return "    public static final int version = 587;\n", "", 0
+		if "ps faux" in command:
+			stdout = "ubuntu    " + str(1000 + self.index) + "  0.0  0.0  14856  1004 ?        S    12:00   0:00 grep nyzoVerifier\n"
+			if running:
+				stdout = "root       " + str(900 + self.index) + " 42.1 61.3 5123456 2456788 ?     Sl   May20 812:03 java -jar -Xmx3G -Xss1024k nyzoVerifier.jar co.nyzo.verifier.Verifier\n" + stdout
+			return stdout, "", 0
+		if "nyzo-verifier-stdout.log" in command:
+			return self.logs[self.index % len(self.logs)] if running else "", "", 0
+		return "", "sh: 1: " + command.split(" ")[0] + ": not found\n", 127
+
+	def __batch(self, script):
+		"""Answer a Miner batched probe with the framed output of each of its sections"""
+		output = []
+		boundary = None
+		for boundary, section, command in BATCH_SECTION.findall(script):
+			stdout, stderr, status = self.__execute(command)
+			output.append("\n" + boundary + " " + section + " out\n" + stdout + "\n" + boundary + " " + section + " err\n" + stderr)
+		output.append("\n" + boundary + " end\n")
+		return "".join(output), "", 0
+
+
+def serve(port, settings, ready):
+	"""Server process: accept connections on port until terminated"""
+	logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+	host_key = paramiko.ECDSAKey.generate()
+	logs = [generate_log(4000, out_of_cycle_ratio=0.1, seed=seed)[-2000:] for seed in range(16)]
+
+	listener = socket.socket()
+	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listener.bind(("127.0.0.1", port))
+	listener.listen(1024)
+	ready.set()
+
+	def handshake(connection):
+		try:
+			transport = paramiko.Transport(connection)
+			transport.add_server_key(host_key)
+			transport.start_server(server=FakeVerifierServer(settings, logs))
+		except (EOFError, OSError, paramiko.SSHException):
+			connection.close()
+
+	while True:
+		connection, address = listener.accept()
+		threading.Thread(target=handshake, args=(connection,), daemon=True).start()
+
+
+def free_port():
+	s = socket.socket()
+	s.bind(("127.0.0.1", 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+
+def process_tree(pid):
+	"""pid and its descendants"""
+	children = {}
+	for entry in os.listdir("/proc"):
+		if entry.isdigit():
+			try:
+				with open("/proc/" + entry + "/stat") as f:
+					ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+				children.setdefault(ppid, []).append(int(entry))
+			except (OSError, IndexError, ValueError):
+				continue
+
+	pids = [pid]
+	for p in pids:
+		pids.extend(children.get(p, []))
+	return pids
+
+
+def resource_usage(pids):
+	"""(cpu seconds, resident bytes) of the processes pids"""
+	cpu = 0
+	rss = 0
+	for pid in pids:
+		try:
+			with open("/proc/" + str(pid) + "/stat") as f:
+				fields = f.read().rsplit(")", 1)[1].split()
+			cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+			with open("/proc/" + str(pid) + "/statm") as f:
+				rss += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+		except (OSError, IndexError, ValueError):
+			continue
+	return cpu, rss
+
+
+def build_farm(miner_count, ports, engine, args, directory):
+	miners = []
+	for i in range(miner_count):
+		miners.append({"id": "verifier" + str(i), "host": "127.0.0.1:" + str(ports[i % len(ports)]), "user": "verifier" + str(i), "password": "x",
+						"versionCommand": VERSION_COMMAND, "logCommand": LOG_COMMAND, "batchProbe": args.batch_probe})
+
+	farm_file = os.path.join(directory, "farm_" + str(miner_count) + ".json")
+	with open(farm_file, 'w') as f:
+		json.dump({"miners": miners}, f)
+
+	return MiningFarm(directory, farm_file, bind="127.0.0.1:0", stat_engine=engine, stat_parallelism=args.parallelism, stat_concurrency=args.concurrency,
+					stat_heartbeat=args.heartbeat, ssh_pool_size=args.ssh_pool_size, history_retention=0, log=logging.getLogger("benchmark"))
+
+
+def measure(miner_count, engine, ports, server_pids, args, directory):
+	farm = build_farm(miner_count, ports, engine, args, directory)
+	pool = farm.statistic_pool
+	pool.start()
+	try:
+		time.sleep(args.warmup if args.warmup is not None else args.heartbeat)
+
+		manager_pids = [pid for pid in process_tree(os.getpid()) if pid not in server_pids]
+		start = time.time()
+		counters = pool.get_probe_report()
+		manager_cpu, rss = resource_usage(manager_pids)
+		server_cpu, server_rss = resource_usage(server_pids)
+
+		time.sleep(args.duration)
+
+		manager_pids = [pid for pid in process_tree(os.getpid()) if pid not in server_pids]
+		elapsed = time.time() - start
+		report = pool.get_probe_report()
+		manager_cpu_end, rss = resource_usage(manager_pids)
+		server_cpu_end, server_rss = resource_usage(server_pids)
+	finally:
+		pool.stop()
+		ssh_connection_pool.get_default_pool().close()
+
+	probes = report["probes"] - counters["probes"]
+	failed = report["failedProbes"] - counters["failedProbes"]
+	total = report["phases"].get("total", {})
+	queue = report["phases"].get("queue", {})
+	return {"miners": miner_count, "engine": engine, "probesPerSec": probes / elapsed, "expectedPerSec": miner_count / args.heartbeat,
+			"failedPercent": 100 * failed / probes if probes > 0 else 0,
+			"averageLateness": report["scheduler"]["averageLateness"], "maxLateness": report["scheduler"]["maxLateness"],
+			"overdue": report["scheduler"]["overdue"], "probeP90": total.get("p90"), "queueP90": queue.get("p90"),
+			"managerCpuPercent": 100 * (manager_cpu_end - manager_cpu) / elapsed, "managerRssMB": rss / 1048576,
+			"serverCpuPercent": 100 * (server_cpu_end - server_cpu) / elapsed}
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Statistics collection benchmark against simulated verifiers')
+	parser.add_argument('-n', dest="miners", default="10,100,1000", help="Comma separated numbers of simulated miners")
+	parser.add_argument('-se', dest="engines", default="process,thread", help="Comma separated statistics engines (process, thread)")
+	parser.add_argument('-sp', dest="parallelism", type=int, default=3, help="Number of processes of the process engine")
+	parser.add_argument('-sc', dest="concurrency", type=int, default=32, help="Number of probe threads of the thread engine")
+	parser.add_argument('-sh', dest="heartbeat", type=int, default=10, help="Delay between two probes of a miner in seconds")
+	parser.add_argument('-pc', dest="ssh_pool_size", type=int, default=64, help="Maximum number of pooled ssh connections per process")
+	parser.add_argument('-bp', dest="batch_probe", action="store_true", help="Collect statistics with a single remote script per miner")
+	parser.add_argument('-d', dest="duration", type=float, default=30, help="Duration of each measure in seconds")
+	parser.add_argument('-w', dest="warmup", type=float, default=None, help="Seconds before measuring, while the first probes are spread (defaults to -sh)")
+	parser.add_argument('-l', dest="latency", type=float, default=20, help="Mean latency of a remote command in milliseconds")
+	parser.add_argument('-lj', dest="jitter", type=float, default=10, help="Latency jitter in milliseconds")
+	parser.add_argument('-f', dest="failure_rate", type=float, default=0, help="Fraction of the probes failing with a dropped connection")
+	parser.add_argument('-sr', dest="stopped_ratio", type=float, default=0.05, help="Fraction of the simulated verifiers not running")
+	parser.add_argument('-sw', dest="server_workers", type=int, default=max(1, os.cpu_count() // 2), help="Number of ssh server processes")
+	parser.add_argument('-o', dest="output", default=None, help="Write the results to this JSON file")
+
+	args = parser.parse_args(sys.argv[1:])
+	logging.basicConfig(level=logging.WARNING)
+	logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+	settings = {"latency": args.latency / 1000, "jitter": args.jitter / 1000, "failure_rate": args.failure_rate, "stopped_ratio": args.stopped_ratio}
+	ports = [free_port() for i in range(args.server_workers)]
+	servers = []
+	for port in ports:
+		ready = multiprocessing.Event()
+		server = multiprocessing.Process(target=serve, args=(port, settings, ready), daemon=True)
+		server.start()
+		ready.wait()
+		servers.append(server)
+	server_pids = set(server.pid for server in servers)
+
+	results = []
+	print("%6s %8s %10s %10s %8s %10s %10s %8s %8s %8s %8s %8s %8s" % ("miners", "engine", "probes/s", "expected/s", "failed%", "lateness", "max late", "overdue", "p90 (s)", "queue90", "cpu%", "rss MB", "srv cpu%"))
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			for miner_count in [int(n) for n in args.miners.split(',')]:
+				for engine in args.engines.split(','):
+					result = measure(miner_count, engine, ports, server_pids, args, directory)
+					results.append(result)
+					print("%6d %8s %10.1f %10.1f %8.1f %10.3f %10.3f %8d %8.3f %8.3f %8.1f %8.1f %8.1f" % (result["miners"], result["engine"], result["probesPerSec"], result["expectedPerSec"],
+								result["failedPercent"], result["averageLateness"], result["maxLateness"], result["overdue"], result["probeP90"] or 0, result["queueP90"] or 0,
+								result["managerCpuPercent"], result["managerRssMB"], result["serverCpuPercent"]))
+	finally:
+		for server in servers:
+			server.terminate()
+
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump({"settings": vars(args), "results": results}, f, indent=4)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import sys
+import os
+import time
+import json
+import random
+import socket
+import argparse
+import tempfile
+import logging
+import threading
+import subprocess
+import http.client
+import multiprocessing
+import mining_farm
+from benchmark_status import synthetic_statistic
+
+
+def free_port():
+	s = socket.socket()
+	s.bind(("127.0.0.1", 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+
+def serve(http_server, parallelism, miner_count, port, directory):
+	"""Child process: a farm with synthetic statistics served by http_server"""
+	logging.basicConfig(level=logging.WARNING)
+	miners = [{"id": "miner" + str(i), "host": "10.0.0." + str(i % 250) + ":22", "user": "root", "password": "x"} for i in range(miner_count)]
+	farm_file = os.path.join(directory, "farm_" + str(port) + ".json")
+	with open(farm_file, 'w') as f:
+		json.dump({"miners": miners}, f)
+
+	farm = mining_farm.MiningFarm(mining_farm_html(), farm_file, bind="127.0.0.1:" + str(port), http_parallelism=parallelism, http_server=http_server, history_retention=0)
+	now = time.time()
+	for miner in farm.get_miners():
+		farm.statistic_pool.set_statistics(synthetic_statistic(miner.miner_id, now))
+	farm.start_server()
+
+
+def mining_farm_html():
+	return os.path.join(os.path.dirname(os.path.abspath(__file__)), "html")
+
+
+def expand_path(path, miner_count):
+	"""/miner without id requests a random miner"""
+	if path == "/miner":
+		return "/miner?id=miner" + str(random.randrange(miner_count))
+	return path
+
+
+def load(port, path, miner_count, threads, duration, headers, results):
+	"""Client process: threads sending requests for duration seconds, reusing their connection when the server allows it"""
+	samples = []
+
+	def client():
+		latencies = []
+		size = 0
+		errors = 0
+		connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+		deadline = time.time() + duration
+		while time.time() < deadline:
+			start = time.perf_counter()
+			try:
+				connection.request("GET", expand_path(path, miner_count), headers=headers)
+				response = connection.getresponse()
+				body = response.read()
+				if response.status < 400:
+					latencies.append(time.perf_counter() - start)
+					size += len(body)
+				else:
+					errors += 1
+			except (OSError, http.client.HTTPException):
+				errors += 1
+				connection.close()
+		connection.close()
+		samples.append((latencies, size, errors))
+
+	workers = [threading.Thread(target=client) for i in range(threads)]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+
+	results.put(([latency for sample in samples for latency in sample[0]], sum(sample[1] for sample in samples), sum(sample[2] for sample in samples)))
+
+
+def open_streams(port, count):
+	"""Idle /stream connections, as kept open by dashboards"""
+	streams = []
+	for i in range(count):
+		connection = socket.create_connection(("127.0.0.1", port), timeout=10)
+		connection.sendall(b"GET /stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n")
+		streams.append(connection)
+	return streams
+
+
+def wait_listening(port, timeout=30):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		try:
+			socket.create_connection(("127.0.0.1", port), timeout=1).close()
+			return
+		except OSError:
+			time.sleep(0.1)
+	raise Exception("Server not listening on port " + str(port))
+
+
+def percentile(values, q):
+	if len(values) == 0:
+		return None
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(port, path, args):
+	headers = {"Accept-Encoding": "gzip"} if args.gzip else {}
+	results = multiprocessing.Queue()
+	clients = [multiprocessing.Process(target=load, args=(port, path, args.miners, args.threads, args.duration, headers, results)) for i in range(args.processes)]
+	for client in clients:
+		client.start()
+	latencies = []
+	size = 0
+	errors = 0
+	for client in clients:
+		client_latencies, client_size, client_errors = results.get()
+		latencies.extend(client_latencies)
+		size += client_size
+		errors += client_errors
+	for client in clients:
+		client.join()
+
+	latencies.sort()
+	return {"path": path, "requests": len(latencies), "errors": errors, "requestsPerSec": len(latencies) / args.duration,
+			"p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99), "max": latencies[-1] if len(latencies) > 0 else None,
+			"bytesPerResponse": size / len(latencies) if len(latencies) > 0 else 0, "megabytesPerSec": size / args.duration / 1048576}
+
+
+def run(http_server, args, directory):
+	port = free_port()
+	server = multiprocessing.Process(target=serve, args=(http_server, args.parallelism, args.miners, port, directory), daemon=True)
+	server.start()
+	streams = []
+	try:
+		wait_listening(port)
+		streams = open_streams(port, args.streams)
+		results = []
+		for path in args.paths.split(','):
+			result = measure(port, path, args)
+			result["server"] = http_server
+			results.append(result)
+		return results
+	finally:
+		for stream in streams:
+			stream.close()
+		server.terminate()
+		server.join()
+
+
+def compare(results, baseline_file, threshold):
+	"""Print the change of each result against the baseline and return the number of regressions"""
+	with open(baseline_file) as f:
+		baseline = {(result["server"], result["path"]): result for result in json.load(f)["results"]}
+
+	regressions = 0
+	print("")
+	print("%8s %-16s %12s %12s %12s %12s" % ("server", "path", "requests/s", "change", "p99 (ms)", "change"))
+	for result in results:
+		reference = baseline.get((result["server"], result["path"]))
+		if reference is None:
+			continue
+		rate_change = 100 * (result["requestsPerSec"] / reference["requestsPerSec"] - 1) if reference["requestsPerSec"] > 0 else 0
+		p99_change = 100 * (result["p99"] / reference["p99"] - 1) if reference["p99"] and result["p99"] is not None else 0
+		regression = rate_change < -threshold or p99_change > threshold
+		regressions += regression
+		print("%8s %-16s %12.0f %11.1f%% %12.2f %11.1f%%%s" % (result["server"], result["path"], result["requestsPerSec"], rate_change,
+															1000 * (result["p99"] or 0), p99_change, "  REGRESSION" if regression else ""))
+	return regressions
+
+
+def git_revision():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		return None
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Load test of the HTTP servers')
+	parser.add_argument('-s', dest="servers", default="thread,async", help="Comma separated servers to measure (thread, async)")
+	parser.add_argument('-u', dest="paths", default="/status,/miner,/dashboard.html", help="Comma separated paths, measured one after the other. /miner requests random miners")
+	parser.add_argument('-n', dest="miners", type=int, default=100, help="Number of miners of the farm")
+	parser.add_argument('-hp', dest="parallelism", type=int, default=5, help="Number of http handlers of the server")
+	parser.add_argument('-p', dest="processes", type=int, default=2, help="Number of client processes")
+	parser.add_argument('-t', dest="threads", type=int, default=8, help="Number of client connections per process")
+	parser.add_argument('-e', dest="streams", type=int, default=0, help="Number of idle /stream connections kept open, as by open dashboards")
+	parser.add_argument('-d', dest="duration", type=float, default=5, help="Duration of each measure in seconds")
+	parser.add_argument('-z', dest="gzip", action="store_true", help="Accept gzip responses")
+	parser.add_argument('-o', dest="output", default=None, help="Write the results to this JSON file")
+	parser.add_argument('-c', dest="baseline", default=None, help="Compare with the results of a previous run (JSON file written with -o)")
+	parser.add_argument('-r', dest="threshold", type=float, default=10, help="Change in percent of requests/s or p99 reported as a regression")
+
+	args = parser.parse_args(sys.argv[1:])
+	logging.basicConfig(level=logging.WARNING)
+
+	results = []
+	print("%8s %-16s %8s %8s %12s %10s %10s %10s %8s" % ("server", "path", "miners", "clients", "requests/s", "p50 (ms)", "p99 (ms)", "bytes", "errors"))
+	with tempfile.TemporaryDirectory() as directory:
+		for http_server in args.servers.split(','):
+			for result in run(http_server, args, directory):
+				results.append(result)
+				print("%8s %-16s %8d %8d %12.0f %10.2f %10.2f %10.0f %8d" % (http_server, result["path"], args.miners, args.processes * args.threads, result["requestsPerSec"],
+																		1000 * (result["p50"] or 0), 1000 * (result["p99"] or 0), result["bytesPerResponse"], result["errors"]))
+
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump({"revision": git_revision(), "time": time.time(), "settings": vars(args), "results": results}, f, indent=4)
+
+	if args.baseline is not None and compare(results, args.baseline, args.threshold) > 0:
+		sys.exit(1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import io
+import re
+import sys
+import time
+import random
+import argparse
+import contextlib
+import verifier_log_parser
+
+
+MESSAGES = [
+	"requesting block with votes for height {height}",
+	"trying to fetch BlockWithVotesRequest37 for height {height}",
+	"top verifier {verifier} has {votes} votes with a cycle length of {cycle} (89.2%)",
+	"added new out-of-cycle node to queue: {verifier}",
+	"cleaning up because block {height} was frozen",
+	"sending verifier-removal vote to node at IP: 10.{a}.{b}.{c}",
+	"unfrozen block heights: {height}, {next_height}",
+	"maximum cycle transactions: 10, transactions in block: {votes}",
+	"nodes in cycle: {cycle}, in queue: {votes}",
+	"ConsensusTracker: threshold for height {height} is {votes}",
+]
+
+
+def generate_log(size, out_of_cycle_ratio=0.3, seed=7):
+	"""Return a synthetic nyzoVerifier stdout log of about size bytes"""
+
+	rng = random.Random(seed)
+	lines = []
+	length = 0
+	height = 8000000
+	while length < size:
+		height += 1
+		first = len(lines)
+		for i in range(rng.randint(5, 30)):
+			message = rng.choice(MESSAGES).format(height=height, next_height=height + 1, verifier=format(rng.getrandbits(64), '016x'),
+												votes=rng.randint(1, 2500), cycle=rng.randint(2000, 2600), a=rng.randint(0, 255), b=rng.randint(0, 255), c=rng.randint(0, 255))
+			lines.append("[" + str(1590000000 + height) + ".123 (2020-05-20 19:44:44.123 UTC)]: " + message)
+
+		block_hash = format(rng.getrandbits(64), '016x')
+		if rng.random() < out_of_cycle_ratio:
+			lines.append("freezing block [Block:v=0,height=" + str(height) + ",hash=" + block_hash + ",id=" + block_hash + "] with standard mechanism")
+		else:
+			lines.append("freezing block [Block: height=" + str(height) + ",  hash=" + block_hash + ", id=" + block_hash + "] with standard mechanism")
+
+		length += sum(len(line) + 1 for line in lines[first:])
+
+	return "\n".join(lines) + "\n"
+
+
+def legacy_parse(text, report):
+	"""Log parsing of Miner.statistics() before verifier_log_parser"""
+	for log in text.splitlines():
+		print('::',log)
+		log = re.sub(' +', ' ', log)  # remove consecutive space
+		if "freezing block [" in log:
+			pos = 3
+			posx = 1
+			posy = 1
+			if "v=0" in log:
+				pos = 2
+				posx = 2
+				posy = 5
+
+			buffer = log.split(" ")
+			ibuffer = buffer[pos].split('=')
+			frozen_block = ibuffer[posx][:-posy]
+			report["frozenblock"] = frozen_block
+
+			if "v=0" in log:
+				report["in_cycle"] = 'False'
+			else:
+				report["in_cycle"] = 'True'
+
+
+def chunks(text, chunk_size):
+	"""Split text in chunks of complete lines, as fed by the incremental log tail"""
+	position = 0
+	while position < len(text):
+		end = text.rfind("\n", position, position + chunk_size) + 1
+		if end <= position:
+			end = min(len(text), position + chunk_size)
+		yield text[position:end]
+		position = end
+
+
+def measure(function, repeat):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, result
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Benchmark of the verifier log parser')
+	parser.add_argument('-s', dest="sizes", default="0.5,2,8", help="Comma separated log sizes in MB")
+	parser.add_argument('-c', dest="chunk_size", type=int, default=65536, help="Chunk size in bytes of the incremental measure")
+	parser.add_argument('-r', dest="repeat", type=int, default=3, help="Number of runs per measure (best is kept)")
+	parser.add_argument('--print', dest="with_print", action="store_true", help="Keep the print of every line in the legacy measure (sent to a buffer)")
+
+	args = parser.parse_args(sys.argv[1:])
+
+	print("%8s %10s %16s %16s %16s %9s %6s" % ("MB", "lines", "legacy lines/s", "parser lines/s", "chunked lines/s", "speedup", "match"))
+	for size in [float(s) for s in args.sizes.split(',')]:
+		text = generate_log(int(size * 1024 * 1024))
+		line_count = text.count("\n")
+
+		def legacy():
+			report = {}
+			if args.with_print:
+				with contextlib.redirect_stdout(io.StringIO()):
+					legacy_parse(text, report)
+			else:
+				with contextlib.redirect_stdout(None):
+					legacy_parse(text, report)
+			return report
+
+		def parse():
+			report = {}
+			verifier_log_parser.parse_log(text, report)
+			return report
+
+		def parse_chunks():
+			report = {}
+			log_parser = verifier_log_parser.VerifierLogParser()
+			for chunk in chunks(text, args.chunk_size):
+				log_parser.feed(chunk)
+			log_parser.update_report(report)
+			return report
+
+		legacy_time, legacy_report = measure(legacy, args.repeat)
+		parse_time, parse_report = measure(parse, args.repeat)
+		chunk_time, chunk_report = measure(parse_chunks, args.repeat)
+
+		# the legacy fields must match the former parsing, the parser events must not depend on the chunking
+		legacy_fields = {field: parse_report[field] for field in ("frozenblock", "in_cycle") if field in parse_report}
+		match = legacy_report == legacy_fields and parse_report == chunk_report
+		print("%8.1f %10d %16.0f %16.0f %16.0f %8.0fx %6s" % (size, line_count, line_count / legacy_time, line_count / parse_time, line_count / chunk_time, legacy_time / parse_time, match))
+		if not match:
+			print("legacy " + str(legacy_report) + " parser " + str(parse_report) + " chunked " + str(chunk_report))
+			sys.exit(1)
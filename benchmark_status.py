@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import sys
+import os
+import time
+import json
+import argparse
+import tempfile
+import logging
+from mining_farm import MiningFarm
+
+
+def build_farm(miner_count, directory):
+	miners = []
+	for i in range(miner_count):
+		miners.append({"id": "miner" + str(i), "host": "10.0.0." + str(i % 250) + ":22", "user": "root", "password": "x"})
+
+	farm_file = os.path.join(directory, "farm_" + str(miner_count) + ".json")
+	with open(farm_file, 'w') as f:
+		json.dump({"miners": miners}, f)
+
+	farm = MiningFarm(directory, farm_file, bind="127.0.0.1:0", log=logging.getLogger("benchmark"))
+	now = time.time()
+	for miner in farm.get_miners():
+		farm.statistic_pool.set_statistics(synthetic_statistic(miner.miner_id, now))
+
+	return farm
+
+
+def synthetic_statistic(miner_id, timestamp):
+	return {"minerId": miner_id, "host": "10.0.0.1:22", "user": "root", "timestamp": timestamp, "datetime": "2020-01-01 00:00:00 UTC",
+			"cpu": 12.5, "version": "587", "process": ["nyzoVerifier"], "nyzoVerifier": "True", "listen": False, "solving": False,
+			"block": None, "hps": "4567890", "in_cycle": "True", "difficulty": None}
+
+
+def legacy_status(farm, statistics):
+	"""/status assembly with the former list store: one linear scan per miner"""
+	statuses = []
+	for miner in farm.get_miners():
+		for stat in statistics:
+			if stat["minerId"] == miner.miner_id:
+				statuses.append(stat)
+				break
+	return statuses
+
+
+def measure(function, repeat):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Benchmark of the /status assembly')
+	parser.add_argument('-n', dest="sizes", default="100,1000,2000,5000,10000", help="Comma separated farm sizes")
+	parser.add_argument('-r', dest="repeat", type=int, default=5, help="Number of runs per measure (best is kept)")
+	parser.add_argument('-l', dest="legacy_limit", type=int, default=2000, help="Largest farm size measured with the legacy list store")
+
+	args = parser.parse_args(sys.argv[1:])
+	logging.basicConfig(level=logging.WARNING)
+
+	print("%8s %14s %14s %14s %14s" % ("miners", "status (ms)", "us/miner", "json (ms)", "legacy (ms)"))
+	with tempfile.TemporaryDirectory() as directory:
+		for size in [int(s) for s in args.sizes.split(',')]:
+			farm = build_farm(size, directory)
+
+			def status():
+				farm.statistic_pool.set_statistics(synthetic_statistic("miner0", time.time()))  # invalidate the snapshot
+				return farm.get_statistics()
+
+			status_time = measure(status, args.repeat)
+			farm_statistics = farm.get_statistics()
+			json_time = measure(lambda: json.dumps(farm_statistics, indent=4), args.repeat)
+
+			legacy = "-"
+			if size <= args.legacy_limit:
+				statistics = list(farm.statistic_pool.get_statistics_snapshot().values())
+				legacy = "%.2f" % (measure(lambda: legacy_status(farm, statistics), args.repeat) * 1e3)
+
+			print("%8d %14.2f %14.3f %14.2f %14s" % (size, status_time * 1e3, status_time * 1e6 / size, json_time * 1e3, legacy))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import collections
+import concurrent.futures
+import datetime
+import logging
+import threading
+import time
+import uuid
+
+
+COMMANDS = ("start", "stop", "restart", "reboot")
+
+
+def _format_time(t):
+	if t is None:
+		return None
+	return datetime.datetime.utcfromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S UTC')
+
+
+class MinerProgress:
+
+	QUEUED = "queued"
+	RUNNING = "running"
+	WAITING = "waitingInCycle"  # command done, waiting for the verifier to be back in cycle (rolling mode)
+	DONE = "done"
+	FAILED = "failed"
+	SKIPPED = "skipped"
+
+	def __init__(self, miner_id):
+		self.miner_id = miner_id
+		self.state = MinerProgress.QUEUED
+		self.error = None
+		self.start = None
+		self.end = None
+
+	def to_json(self):
+		return {"minerId": self.miner_id, "state": self.state, "error": self.error, "start": _format_time(self.start), "end": _format_time(self.end)}
+
+
+class CommandJob:
+
+	RUNNING = "running"
+	DONE = "done"
+	FAILED = "failed"  # some commands failed, or rolling mode gave up waiting
+
+	def __init__(self, command, miner_ids, concurrency, rolling=0, rolling_timeout=900):
+		"""
+		:param command: one of COMMANDS
+		:param miner_ids: miners to run the command on, in order
+		:param concurrency: maximum number of miners running the command at the same time
+		:param rolling: if > 0, the miners are processed in waves of concurrency miners and the next wave only starts
+		once rolling miners of the current wave are back in cycle
+		:param rolling_timeout: seconds to wait for a wave to be back in cycle before giving up the job
+		"""
+		self.job_id = uuid.uuid4().hex[:12]
+		self.command = command
+		self.concurrency = max(1, concurrency)
+		self.rolling = max(0, rolling)
+		self.rolling_timeout = rolling_timeout
+		self.progress = collections.OrderedDict((miner_id, MinerProgress(miner_id)) for miner_id in miner_ids)
+		self.state = CommandJob.RUNNING
+		self.error = None
+		self.created = time.time()
+		self.finished = None
+
+		self.queue = collections.deque()  # miner ids of the current wave not submitted yet
+		self.running = 0  # miners of the job running the command
+		self.wave_done = threading.Event()
+
+	def is_finished(self):
+		return self.state != CommandJob.RUNNING
+
+	def to_json(self):
+		counts = collections.Counter(progress.state for progress in self.progress.values())
+		return {"jobId": self.job_id, "command": self.command, "state": self.state, "error": self.error,
+				"concurrency": self.concurrency, "rolling": self.rolling,
+				"created": _format_time(self.created), "finished": _format_time(self.finished),
+				"total": len(self.progress), "counts": dict(counts),
+				"miners": [progress.to_json() for progress in self.progress.values()]}
+
+
+class CommandJobManager:
+	"""
+	Run a command on many miners on a dedicated executor, so the HTTP handlers only queue the work, and keep the
+	progress of each miner so it can be polled. A job has at most concurrency miners on the executor: the completion of
+	a miner submits the next one. Listeners, callable(job, miner_progress), are notified whenever the progress of a
+	miner changes, and with miner_progress None when the job finishes.
+	"""
+
+	MAX_JOBS = 100  # finished jobs kept for polling
+
+	def __init__(self, farm, parallelism=16, log=None):
+		"""
+		:param parallelism: maximum number of commands running at the same time, all jobs included
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("CommandJobManager")
+		else:
+			self.log = log
+
+		self.mining_farm = farm
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="command")
+		self.jobs = collections.OrderedDict()  # job id -> CommandJob, oldest first
+		self.lock = threading.RLock()
+		self.listeners = []
+		self.statistics_condition = threading.Condition()  # notified on every statistics update (rolling mode)
+
+	def submit(self, command, miner_ids, concurrency=10, rolling=0, rolling_timeout=900):
+		if command not in COMMANDS:
+			raise ValueError("Unknown command " + str(command))
+
+		job = CommandJob(command, miner_ids, concurrency, rolling, rolling_timeout)
+
+		self.lock.acquire()
+		try:
+			self.jobs[job.job_id] = job
+			self.__evict_finished()
+		finally:
+			self.lock.release()
+
+		self.log.info("Job " + job.job_id + ": " + command + " on " + str(len(job.progress)) + " miners (concurrency " + str(job.concurrency) + ", rolling " + str(job.rolling) + ")")
+		if len(job.progress) == 0:
+			self.__finish(job)
+		elif job.rolling > 0:
+			# waiting for the verifiers to be back in cycle takes minutes, don't hold an executor thread meanwhile
+			threading.Thread(target=self.__run_rolling, args=(job,), name="job-" + job.job_id, daemon=True).start()
+		else:
+			self.__start_wave(job, list(job.progress))
+		return job
+
+	def stop(self):
+		self.executor.shutdown(wait=False, cancel_futures=True)
+
+	def get_job(self, job_id):
+		self.lock.acquire()
+		try:
+			job = self.jobs.get(job_id)
+			return None if job is None else job.to_json()
+		finally:
+			self.lock.release()
+
+	def get_jobs(self):
+		"""Summaries of the jobs, most recent first"""
+		self.lock.acquire()
+		try:
+			summaries = []
+			for job in reversed(self.jobs.values()):
+				summary = job.to_json()
+				del summary["miners"]
+				summaries.append(summary)
+			return summaries
+		finally:
+			self.lock.release()
+
+	def add_listener(self, listener):
+		self.listeners.append(listener)
+
+	def statistics_updated(self, previous_stat, stat):
+		"""StatisticsProcessingPool listener, wakes up the rolling jobs waiting for verifiers to be back in cycle"""
+		self.statistics_condition.acquire()
+		try:
+			self.statistics_condition.notify_all()
+		finally:
+			self.statistics_condition.release()
+
+	def __run_rolling(self, job):
+		try:
+			miner_ids = list(job.progress)
+			for i in range(0, len(miner_ids), job.concurrency):
+				wave = miner_ids[i:i + job.concurrency]
+				self.__start_wave(job, wave)
+				job.wave_done.wait()
+				if not self.__wait_in_cycle(job, wave):
+					for miner_id in miner_ids[i + job.concurrency:]:
+						self.__update(job, miner_id, MinerProgress.SKIPPED)
+					break
+
+			self.__finish(job)
+		except Exception as e:
+			self.log.error("Job " + job.job_id + " failed: " + str(e))
+			job.error = str(e)
+			self.__finish(job)
+
+	def __start_wave(self, job, miner_ids):
+		self.lock.acquire()
+		try:
+			job.wave_done.clear()
+			job.queue.extend(miner_ids)
+			self.__submit_next(job)
+		finally:
+			self.lock.release()
+
+	def __submit_next(self, job):
+		"""Submit queued miners of the job up to its concurrency, must hold the lock"""
+		while job.running < job.concurrency and len(job.queue) > 0:
+			job.running += 1
+			self.executor.submit(self.__execute, job, job.queue.popleft())
+
+	def __execute(self, job, miner_id):
+		self.__update(job, miner_id, MinerProgress.RUNNING)
+		try:
+			miner = self.mining_farm.get_miner(miner_id)
+			if miner is None:
+				self.__update(job, miner_id, MinerProgress.FAILED, "Miner not found")
+			elif self.mining_farm.execute_command(miner, job.command):
+				self.__update(job, miner_id, MinerProgress.WAITING if job.rolling > 0 else MinerProgress.DONE)
+			else:
+				self.__update(job, miner_id, MinerProgress.FAILED, "Command failed")
+		except Exception as e:
+			self.log.error("Job " + job.job_id + ": " + job.command + " failed on " + miner_id + ": " + str(e))
+			self.__update(job, miner_id, MinerProgress.FAILED, str(e))
+		finally:
+			self.lock.acquire()
+			try:
+				job.running -= 1
+				self.__submit_next(job)
+				wave_done = job.running == 0 and len(job.queue) == 0
+			finally:
+				self.lock.release()
+
+			if wave_done:
+				if job.rolling > 0:
+					job.wave_done.set()
+				else:
+					self.__finish(job)
+
+	def __wait_in_cycle(self, job, miner_ids):
+		"""
+		Wait until job.rolling miners of the wave report in cycle in a statistic collected after their command. The miners
+		whose command failed count as not back in cycle: return False once the wave cannot recover or on timeout
+		"""
+		waiting = [miner_id for miner_id in miner_ids if job.progress[miner_id].state == MinerProgress.WAITING]
+		expected = min(job.rolling, len(miner_ids))
+		deadline = time.time() + job.rolling_timeout
+
+		while True:
+			in_cycle = 0
+			pending = 0
+			for miner_id in waiting:
+				progress = job.progress[miner_id]
+				if progress.state == MinerProgress.WAITING:
+					stat = self.mining_farm.get_statistics(miner_id)
+					if stat is not None and stat.get("timestamp", 0) > progress.end and stat.get("in_cycle") == 'True':
+						self.__update(job, miner_id, MinerProgress.DONE)
+				if progress.state == MinerProgress.DONE:
+					in_cycle += 1
+				elif progress.state == MinerProgress.WAITING:
+					pending += 1
+
+			if in_cycle >= expected:
+				return True
+
+			if in_cycle + pending < expected:
+				job.error = str(len(miner_ids) - len(waiting)) + "/" + str(len(miner_ids)) + " commands of the wave failed, " + str(expected) + " verifiers cannot be back in cycle"
+				self.log.warning("Job " + job.job_id + ": " + job.error + ", stopping")
+				for miner_id in waiting:
+					if job.progress[miner_id].state == MinerProgress.WAITING:
+						self.__update(job, miner_id, MinerProgress.SKIPPED, "Wave failed")
+				return False
+
+			if time.time() >= deadline:
+				job.error = str(in_cycle) + "/" + str(expected) + " verifiers back in cycle after " + str(job.rolling_timeout) + " sec"
+				self.log.warning("Job " + job.job_id + ": " + job.error + ", stopping")
+				for miner_id in waiting:
+					if job.progress[miner_id].state == MinerProgress.WAITING:
+						self.__update(job, miner_id, MinerProgress.FAILED, "Not back in cycle")
+				return False
+
+			self.statistics_condition.acquire()
+			try:
+				self.statistics_condition.wait(min(5, max(0, deadline - time.time())))
+			finally:
+				self.statistics_condition.release()
+
+	def __update(self, job, miner_id, state, error=None):
+		self.lock.acquire()
+		try:
+			progress = job.progress[miner_id]
+			if state == MinerProgress.RUNNING:
+				progress.start = time.time()
+			elif progress.state == MinerProgress.RUNNING:
+				progress.end = time.time()
+			progress.state = state
+			progress.error = error
+			progress_json = progress.to_json()
+		finally:
+			self.lock.release()
+		self.__notify(job, progress_json)
+
+	def __finish(self, job):
+		self.lock.acquire()
+		try:
+			failed = any(progress.state in (MinerProgress.FAILED, MinerProgress.SKIPPED) for progress in job.progress.values())
+			job.state = CommandJob.FAILED if failed or job.error is not None else CommandJob.DONE
+			job.finished = time.time()
+		finally:
+			self.lock.release()
+		self.log.info("Job " + job.job_id + " " + job.state)
+		self.__notify(job, None)
+
+	def __notify(self, job, miner_progress):
+		for listener in self.listeners:
+			try:
+				listener(job, miner_progress)
+			except Exception as e:
+				self.log.error("Job listener failed: " + str(e))
+
+	def __evict_finished(self):
+		while len(self.jobs) > CommandJobManager.MAX_JOBS:
+			for job_id, job in self.jobs.items():
+				if job.is_finished():
+					del self.jobs[job_id]
+					break
+			else:
+				return  # only running jobs
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import json
+import time
+import queue
+import socket
+import logging
+import selectors
+import threading
+
+
+def format_event(event, data, event_id=None):
+	"""Encode a Server-Sent Event. data is serialized as compact JSON (no new line)"""
+	message = "event: " + event + "\n"
+	if event_id is not None:
+		message += "id: " + str(event_id) + "\n"
+	message += "data: " + json.dumps(data, separators=(',', ':')) + "\n\n"
+	return message.encode("utf-8")
+
+
+class EventStreamClient:
+
+	def __init__(self, connection, miner_id=None):
+		self.connection = connection
+		self.miner_id = miner_id  # only receive the events of this miner if not None
+		self.buffer = bytearray()
+		self.writing = False  # registered for EVENT_WRITE
+
+
+class EventStreamBroadcaster:
+	"""
+	Push Server-Sent Events to the connections detached from the HTTP handlers. A single thread multiplexes all the
+	connections with a selector so an idle client costs a socket and a buffer rather than a handler thread.
+	"""
+
+	KEEPALIVE_INTERVAL = 15  # seconds between keepalive comments
+	MAX_BUFFER_SIZE = 1024 * 1024  # clients lagging behind more than this are disconnected
+
+	def __init__(self, max_clients=1000, log=None):
+
+		if log is None:
+			self.log = logging.getLogger("EventStreamBroadcaster")
+		else:
+			self.log = log
+
+		self.max_clients = max_clients
+		self.clients = {}  # connection -> EventStreamClient, only accessed by the broadcast thread
+		self.client_count = 0
+		self.client_count_lock = threading.Lock()
+		self.pending = queue.Queue()  # (connection, initial data) to add, or (miner id, encoded event) to broadcast
+		self.selector = selectors.DefaultSelector()
+		self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+		self.wakeup_receiver.setblocking(False)
+		self.wakeup_sender.setblocking(False)
+		self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+		self.stop_requested = False
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self.__run, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.stop_requested = True
+		self.__wakeup()
+
+	def is_full(self):
+		return self.client_count >= self.max_clients
+
+	def add_client(self, connection, initial_data=b"", miner_id=None):
+		"""
+		Take ownership of a connection whose response headers were already sent.
+		initial_data can be a callable, called from the broadcast thread so the client misses no event published after it
+		"""
+		self.client_count_lock.acquire()
+		try:
+			self.client_count += 1
+		finally:
+			self.client_count_lock.release()
+		self.pending.put(("client", EventStreamClient(connection, miner_id), initial_data))
+		self.__wakeup()
+
+	def publish(self, event, data, miner_id=None, event_id=None):
+		"""Queue an event for the clients subscribed to all miners or to miner_id. Does not block"""
+		self.pending.put(("event", miner_id, format_event(event, data, event_id)))
+		self.__wakeup()
+
+	def statistics_updated(self, previous_stat, stat):
+		"""StatisticsProcessingPool listener"""
+		if self.client_count > 0:
+			if stat is None:
+				self.publish("removed", {"minerId": previous_stat["minerId"]}, miner_id=previous_stat["minerId"])
+			else:
+				self.publish("miner", stat, miner_id=stat["minerId"], event_id=stat.get("seq"))
+
+	def __wakeup(self):
+		try:
+			self.wakeup_sender.send(b"\0")
+		except (BlockingIOError, OSError):
+			pass  # already awake
+
+	def __run(self):
+		last_keepalive = time.time()
+		while not self.stop_requested:
+			for key, events in self.selector.select(timeout=EventStreamBroadcaster.KEEPALIVE_INTERVAL):
+				if key.fileobj is self.wakeup_receiver:
+					try:
+						while self.wakeup_receiver.recv(4096):
+							pass
+					except (BlockingIOError, OSError):
+						pass
+					continue
+
+				client = key.data
+				if events & selectors.EVENT_READ:
+					# clients do not send anything after the request: data or EOF means the connection is closing
+					try:
+						if len(client.connection.recv(4096)) == 0:
+							self.__remove(client)
+							continue
+					except BlockingIOError:
+						pass
+					except OSError:
+						self.__remove(client)
+						continue
+				if events & selectors.EVENT_WRITE:
+					self.__flush(client)
+
+			self.__process_pending()
+
+			if time.time() - last_keepalive >= EventStreamBroadcaster.KEEPALIVE_INTERVAL:
+				last_keepalive = time.time()
+				for client in list(self.clients.values()):
+					self.__send(client, b": keepalive\n\n")
+
+		for client in list(self.clients.values()):
+			self.__remove(client)
+
+	def __process_pending(self):
+		while True:
+			try:
+				item = self.pending.get_nowait()
+			except queue.Empty:
+				return
+
+			if item[0] == "client":
+				client, initial_data = item[1], item[2]
+				client.connection.setblocking(False)
+				self.clients[client.connection] = client
+				self.selector.register(client.connection, selectors.EVENT_READ, client)
+				self.log.debug("Event stream client added (" + str(len(self.clients)) + ")")
+				if callable(initial_data):
+					try:
+						initial_data = initial_data()
+					except Exception as e:
+						self.log.error("Error while building the initial event: " + str(e))
+						self.__remove(client)
+						continue
+				self.__send(client, initial_data)
+			else:
+				miner_id, message = item[1], item[2]
+				for client in list(self.clients.values()):
+					if client.miner_id is None or miner_id is None or client.miner_id == miner_id:
+						self.__send(client, message)
+
+	def __send(self, client, message):
+		client.buffer.extend(message)
+		if len(client.buffer) > EventStreamBroadcaster.MAX_BUFFER_SIZE:
+			self.log.warning("Disconnecting slow event stream client")
+			self.__remove(client)
+			return
+		self.__flush(client)
+
+	def __flush(self, client):
+		if client.connection not in self.clients:
+			return
+
+		try:
+			sent = client.connection.send(client.buffer)
+			del client.buffer[:sent]
+		except BlockingIOError:
+			pass
+		except OSError:
+			self.__remove(client)
+			return
+
+		writing = len(client.buffer) > 0
+		if writing != client.writing:
+			client.writing = writing
+			self.selector.modify(client.connection, selectors.EVENT_READ | selectors.EVENT_WRITE if writing else selectors.EVENT_READ, client)
+
+	def __remove(self, client):
+		if self.clients.pop(client.connection, None) is None:
+			return
+
+		self.client_count_lock.acquire()
+		try:
+			self.client_count -= 1
+		finally:
+			self.client_count_lock.release()
+
+		try:
+			self.selector.unregister(client.connection)
+		except (KeyError, ValueError):
+			pass
+		try:
+			client.connection.close()
+		except OSError:
+			pass
+		self.log.debug("Event stream client removed (" + str(len(self.clients)) + ")")
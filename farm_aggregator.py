@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+import http.client
+import concurrent.futures
+import http_cache
+import static_assets
+
+from multithread_http_server import MultiThreadHttpServer
+from async_http_server import AsyncHttpServer
+from mining_farm_http_handler import MiningFarmHTTPHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class ShardClient:
+	"""
+	A manager instance owning a shard of the farm. Its last /status is cached and revalidated with its ETag. The refresh
+	runs on its own thread: a slow shard delays the readers by at most timeout seconds, after which they get the cached
+	status while the refresh goes on for up to fetch_timeout seconds.
+	"""
+
+	def __init__(self, url, timeout=2, max_age=1, fetch_timeout=10, log=None):
+		"""
+		:param timeout: seconds a reader waits for a refresh before using the cached status
+		:param max_age: seconds the cached status is used without asking the shard
+		:param fetch_timeout: timeout in seconds of the requests to the shard
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("ShardClient")
+		else:
+			self.log = log
+
+		parsed_url = urlparse(url if "://" in url else "http://" + url)
+		self.url = parsed_url.scheme + "://" + parsed_url.netloc
+		self.host = parsed_url.hostname
+		self.port = parsed_url.port or 80
+		self.timeout = timeout
+		self.max_age = max_age
+		self.fetch_timeout = fetch_timeout
+
+		self.status = None  # last /status of the shard, None until it answered once
+		self.etag = None
+		self.version = 0  # incremented when the status changes
+		self.updated = 0  # time of the last successful refresh
+		self.error = None  # reason of the last refresh if it failed
+		self.refresh_started = None  # None if no refresh is running
+		self.condition = threading.Condition()
+
+	def refresh_if_stale(self):
+		"""Start a refresh of the status if it is older than max_age. Does not block"""
+		self.condition.acquire()
+		try:
+			if self.refresh_started is None and time.time() - self.updated >= self.max_age:
+				self.refresh_started = time.time()
+				threading.Thread(target=self.__refresh, daemon=True).start()
+		finally:
+			self.condition.release()
+
+	def get_status(self):
+		"""Return (status, version, time of the last refresh, error), waiting at most timeout seconds for a running refresh"""
+		self.condition.acquire()
+		try:
+			while self.refresh_started is not None:
+				remaining = self.refresh_started + self.timeout - time.time()
+				if remaining <= 0:
+					break
+				self.condition.wait(remaining)
+			return self.status, self.version, self.updated, self.error
+		finally:
+			self.condition.release()
+
+	def request(self, path, headers=None):
+		"""GET path on the shard and return (status code, response headers, decoded body)"""
+		connection = http.client.HTTPConnection(self.host, self.port, timeout=self.fetch_timeout)
+		try:
+			request_headers = {"Accept-Encoding": "gzip"}
+			if headers is not None:
+				request_headers.update(headers)
+			connection.request("GET", path, headers=request_headers)
+			response = connection.getresponse()
+			body = response.read()
+			if response.getheader("Content-Encoding") == "gzip":
+				body = gzip.decompress(body)
+			return response.status, response.msg, body
+		finally:
+			connection.close()
+
+	def __refresh(self):
+		status = None
+		etag = None
+		error = None
+		try:
+			code, headers, body = self.request("/status", None if self.etag is None else {"If-None-Match": self.etag})
+			if code == 200:
+				status = json.loads(body.decode("utf-8"))
+				etag = headers.get("ETag")
+			elif code != 304:
+				error = "HTTP " + str(code)
+		except (OSError, http.client.HTTPException, ValueError) as e:
+			error = type(e).__name__ + ": " + str(e)
+
+		self.condition.acquire()
+		try:
+			self.refresh_started = None
+			if error is None:
+				if self.error is not None:
+					self.log.info("Shard " + self.url + " is back")
+				self.updated = time.time()
+				self.error = None
+				if status is not None:
+					self.status = status
+					self.etag = etag
+					self.version += 1
+			else:
+				if self.error is None:
+					self.log.warning("Shard " + self.url + " failed: " + error)
+				self.error = error
+			self.condition.notify_all()
+		finally:
+			self.condition.release()
+
+
+class FarmAggregator:
+	"""
+	Front end of a farm split between manager instances started with -sd index/count. /status merges the statuses of
+	the shards, the requests about a miner are forwarded to the shard owning it and the dashboard is served from the
+	HTML directory. A shard not answering within the timeout contributes its last status, flagged in the shards list.
+	"""
+
+	def __init__(self, html_repository, shard_urls, bind="127.0.0.1:80", http_parallelism=5, http_server="thread", timeout=2, max_age=1, fetch_timeout=10, log=None):
+
+		if log is None:
+			self.log = logging.getLogger("aggregator")
+		else:
+			self.log = log
+
+		self.static_assets = static_assets.StaticAssetCache(html_repository)
+		self.shards = [ShardClient(url, timeout, max_age, fetch_timeout) for url in shard_urls]
+		self.owners = {}  # miner id -> ShardClient, from the last merged status
+		self.owners_lock = threading.Lock()  # the merge replaces owners while the forwarding threads read and update it
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(4, 2 * len(self.shards)), thread_name_prefix="shard")
+		self.status_lock = threading.Lock()
+		self.status_response = (None, None)  # (versions and errors of the shards, rendered /status response)
+
+		buffer = bind.split(':')
+		self.host = buffer[0].strip()
+		self.port = int(buffer[1].strip())
+		self.http_parallelism = http_parallelism
+		if http_server not in ("thread", "async"):
+			raise Exception("Unknown http server " + http_server)
+		self.http_server = http_server
+
+	def start(self):
+		self.log.info("Aggregating " + str(len(self.shards)) + " shards: " + ", ".join(shard.url for shard in self.shards))
+		self.log.info("Binding " + self.http_server + " server to " + self.host + ":" + str(self.port))
+		if self.http_server == "async":
+			server = AsyncHttpServer((self.host, self.port), self.http_parallelism, MiningFarmHTTPHandler, request_callback=self.http_handler)
+		else:
+			server = MultiThreadHttpServer((self.host, self.port), self.http_parallelism, MiningFarmHTTPHandler, request_callback=self.http_handler)
+		server.start()
+
+	def get_status_response(self):
+		"""Return the merged /status response, rendered again only when the status of a shard changed"""
+		for shard in self.shards:
+			shard.refresh_if_stale()
+		statuses = [shard.get_status() for shard in self.shards]
+		key = tuple((version, error) for status, version, updated, error in statuses)
+
+		self.status_lock.acquire()
+		try:
+			if self.status_response[0] != key:
+				body = bytes(json.dumps(self.__merge(statuses), indent=4), "utf-8")
+				self.status_response = (key, http_cache.CachedResponse(body, 'application/json'))
+			return self.status_response[1]
+		finally:
+			self.status_lock.release()
+
+	def __merge(self, statuses):
+		"""
+		Same fields as the /status of a farm, plus the state of each shard. The totals are computed from the merged
+		statistics, like MiningFarm does, so a miner assigned to several shards is only counted once
+		"""
+		merged = {"totalHPS": 0, "totalSolved": 0, "solvingRate": 0, "farm": [], "shards": []}
+		owners = {}
+		solving_count = 0
+
+		for shard, (status, version, updated, error) in zip(self.shards, statuses):
+			shard_state = {"url": shard.url, "miners": 0, "updated": updated if updated > 0 else None, "error": error}
+			merged["shards"].append(shard_state)
+			if status is None:
+				continue
+
+			for stat in status.get("farm", []):
+				if stat["minerId"] in owners:
+					continue  # assigned to several shards, the first one wins
+				owners[stat["minerId"]] = shard
+				merged["farm"].append(stat)
+				shard_state["miners"] += 1
+
+				if "hps" in stat:
+					merged["totalHPS"] += float(stat["hps"])
+				if "solved" in stat:
+					merged["totalSolved"] += int(stat["solved"])
+				if stat.get("solving"):
+					solving_count += 1
+
+		if len(merged["farm"]) > 0:
+			merged["solvingRate"] = 100 * float(solving_count / len(merged["farm"]))
+
+		self.owners_lock.acquire()
+		try:
+			self.owners = owners
+		finally:
+			self.owners_lock.release()
+		return merged
+
+	def forward(self, http_request, miner_id=None):
+		"""
+		Send the response of the shard owning miner_id to the request. When the owner is unknown, the request is sent
+		to every shard and the first successful response is used
+		"""
+		self.owners_lock.acquire()
+		try:
+			shard = self.owners.get(miner_id)
+		finally:
+			self.owners_lock.release()
+		shards = self.shards if shard is None else [shard]
+
+		responses = [self.executor.submit(FarmAggregator.__request, shard, http_request.path) for shard in shards]
+		response = None
+		for future in concurrent.futures.as_completed(responses):
+			shard, code, headers, body = future.result()
+			if response is None or (code is not None and code < 300):
+				response = (code, headers, body)
+			if code is not None and code < 300:
+				if miner_id is not None:
+					self.owners_lock.acquire()
+					try:
+						self.owners[miner_id] = shard
+					finally:
+						self.owners_lock.release()
+				break
+
+		code, headers, body = response
+		if code is None:
+			http_request.send_response(502)
+			http_request.send_header('Content-type', 'application/json')
+			http_request.end_headers()
+			http_request.wfile.write(bytes(json.dumps({"error": "Shard unavailable: " + body}), "utf-8"))
+			return
+
+		http_request.send_response(code)
+		http_request.send_header('Content-type', headers.get('Content-type', 'application/json'))
+		if headers.get('Location') is not None:
+			http_request.send_header('Location', headers.get('Location'))
+		http_request.end_headers()
+		http_request.wfile.write(body)
+
+	def get_jobs(self):
+		"""Recent jobs of every shard, most recent first"""
+		jobs = []
+		for future in [self.executor.submit(FarmAggregator.__request, shard, "/job") for shard in self.shards]:
+			shard, code, headers, body = future.result()
+			if code == 200:
+				jobs.extend(json.loads(body.decode("utf-8")))
+		jobs.sort(key=lambda job: job["created"], reverse=True)
+		return jobs
+
+	@staticmethod
+	def __request(shard, path):
+		"""Return (shard, status code, response headers, body), or (shard, None, None, reason) if the shard did not answer"""
+		try:
+			code, headers, body = shard.request(path)
+			return shard, code, headers, body
+		except (OSError, http.client.HTTPException) as e:
+			return shard, None, None, shard.url + " " + type(e).__name__ + ": " + str(e)
+
+	def http_handler(self, http_request):
+
+		url = urlparse(http_request.path)
+
+		if http_request.command != "GET":
+			http_request.send_response(405)  # the agents report to the instance managing their miner
+			http_request.end_headers()
+		elif len(url.path) <= 1:
+			http_request.send_response(301)
+			http_request.send_header('Location', "/dashboard.html?refresh=10000")
+			http_request.end_headers()
+		elif static_assets.StaticAssetCache.is_static(url.path):
+			asset = self.static_assets.get(url.path)
+			if asset is not None:
+				self.static_assets.send(http_request, asset)
+			else:
+				http_request.send_response(404)
+				http_request.end_headers()
+		elif url.path.upper() == "/STATUS":
+			http_cache.send_cached_response(http_request, self.get_status_response())
+		elif url.path.upper() in ("/MINER", "/HISTORY", "/COMMAND"):
+			miner_id = FarmAggregator.__get_parameter(url.query, 'id')
+			if miner_id is None:
+				http_request.send_response(400)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes("{\"error\": \"Miner not found\"}", "utf-8"))
+			else:
+				self.forward(http_request, miner_id)
+		elif url.path.upper() == "/JOB":
+			if FarmAggregator.__get_parameter(url.query, 'id') is None:
+				http_request.send_response(200)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.send_header('Cache-Control', 'no-cache')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps(self.get_jobs(), indent=4), "utf-8"))
+			else:
+				self.forward(http_request)
+		else:
+			http_request.send_response(404)
+			http_request.end_headers()
+
+	@staticmethod
+	def __get_parameter(query, parameter_id):
+		params = parse_qs(query).get(parameter_id, [])
+
+		if len(params) != 1:  # params is a list
+			return None
+		else:
+			return params[0]
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Nyzo manager aggregating the shards of a farm')
+	parser.add_argument('html_repository', default="html", help="The HTML directory")
+	parser.add_argument('shards', help="Comma separated urls of the manager instances (example: http://127.0.0.1:8001,http://127.0.0.1:8002)")
+	parser.add_argument('-b', dest="bind", default="127.0.0.1:80", help="Host to bind")
+	parser.add_argument('-hp', dest="http_parallelism", type=int, default=5, help="Number of http handlers")
+	parser.add_argument('-hs', dest="http_server", default="thread", choices=["thread", "async"], help="HTTP server: one blocking thread per connection, or a selector with HTTP/1.1 keep-alive and -hp worker threads")
+	parser.add_argument('-t', dest="timeout", type=float, default=2, help="Seconds to wait for a shard before using its last status")
+	parser.add_argument('-ma', dest="max_age", type=float, default=1, help="Seconds the status of a shard is cached")
+	parser.add_argument('-ft', dest="fetch_timeout", type=float, default=10, help="Timeout in seconds of the requests to the shards")
+	parser.add_argument('-ll', dest="log_level", type=str, default="INFO", help="Log level (DEBUG, INFO, WARNING, WARN, ERROR)")
+
+	args = parser.parse_args(sys.argv[1:])
+	logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO))
+
+	log = logging.getLogger("aggregator")
+	try:
+		aggregator = FarmAggregator(args.html_repository, args.shards.split(','), args.bind, http_parallelism=args.http_parallelism, http_server=args.http_server, timeout=args.timeout, max_age=args.max_age, fetch_timeout=args.fetch_timeout, log=log)
+		aggregator.start()
+	except KeyboardInterrupt:
+		log.info("HTTP server stopped")
+	except Exception as e:
+		log.error(str(e))
+		sys.exit(-1)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import json
+import time
+import threading
+import http_cache
+
+
+# group dimensions of the /groups response
+DIMENSIONS = ("tags", "versions", "inCycle", "states")
+
+# running sums of a group, in the order of get_contribution
+MINERS, HPS, SOLVED, SOLVING, IN_CYCLE, RUNNING, FAILING = range(7)
+
+# the hashrate is summed in millionths of hash per second: integer sums are exact, so adding then subtracting the
+# contribution of a miner does not drift and an empty group is back to 0
+HPS_SCALE = 1000000
+
+
+def get_state(stat):
+	"""Process state of a miner: failing (last probe failed), unknown (never probed), running or stopped"""
+	if "error" in stat:
+		return "failing"
+	if "nyzoVerifier" not in stat:
+		return "unknown"
+	return "running" if stat["nyzoVerifier"] == 'True' else "stopped"
+
+
+def get_contribution(stat):
+	"""Values a statistic adds to the sums of its groups, same totals as MiningFarm.get_statistics. hps is in HPS_SCALE units"""
+	try:
+		hps = int(round(float(stat.get("hps", 0)) * HPS_SCALE))
+	except (TypeError, ValueError, OverflowError):
+		hps = 0
+	try:
+		solved = int(stat.get("solved", 0))
+	except (TypeError, ValueError):
+		solved = 0
+	return (1, hps, solved, 1 if stat.get("solving") else 0, 1 if stat.get("in_cycle") == 'True' else 0,
+			1 if stat.get("nyzoVerifier") == 'True' else 0, 1 if "error" in stat else 0)
+
+
+class GroupAggregates:
+	"""
+	Farm totals broken down by tag, verifier version, in cycle and process state, maintained by a statistics listener.
+	The contribution of each miner is kept so an update only subtracts it from its previous groups and adds the new one:
+	the cost of an update does not depend on the size of the farm, and /groups is rendered at most once per update.
+	"""
+
+	def __init__(self, farm):
+		self.mining_farm = farm
+		self.groups = {dimension: {} for dimension in DIMENSIONS}  # dimension -> group name -> list of sums
+		self.farm = [0] * 7
+		self.contributions = {}  # miner id -> (groups as (dimension, name), contribution)
+		self.seq = 0  # seq of the last statistic applied
+		self.generation = 0
+		self.instance = format(int(time.time() * 1000), 'x')  # keeps the etags of a restarted farm distinct
+		self.response = (-1, None)
+		self.lock = threading.Lock()
+
+	def statistics_updated(self, previous_stat, stat):
+		"""StatisticsProcessingPool listener. stat is None when the miner is removed"""
+		self.lock.acquire()
+		try:
+			if stat is None:
+				self.__remove(previous_stat["minerId"])
+			else:
+				miner_id = stat["minerId"]
+				self.__remove(miner_id)
+				self.__add(miner_id, self.__get_groups(miner_id, stat.get("version"), stat.get("in_cycle"), get_state(stat)), get_contribution(stat))
+				self.seq = stat.get("seq", self.seq)
+			self.generation += 1
+		finally:
+			self.lock.release()
+
+	def update_tags(self, miner_id):
+		"""Move a miner whose tags changed in the farm file to its new tag groups"""
+		self.lock.acquire()
+		try:
+			previous = self.contributions.get(miner_id)
+			if previous is None:
+				return
+			groups, contribution = previous
+			self.__remove(miner_id)
+			self.__add(miner_id, [group for group in groups if group[0] != "tags"] + self.__get_tag_groups(miner_id), contribution)
+			self.generation += 1
+		finally:
+			self.lock.release()
+
+	def get_response(self):
+		"""Return the /groups response as an http_cache.CachedResponse"""
+		self.lock.acquire()
+		try:
+			if self.response[0] == self.generation:
+				return self.response[1]
+
+			groups = {"seq": self.seq, "farm": GroupAggregates.__summary(self.farm)}
+			for dimension in DIMENSIONS:
+				groups[dimension] = {name: GroupAggregates.__summary(sums) for name, sums in sorted(self.groups[dimension].items())}
+
+			etag = '"' + self.instance + "-" + str(self.generation) + '"'
+			response = http_cache.CachedResponse(bytes(json.dumps(groups, indent=4), "utf-8"), 'application/json', etag=etag)
+			self.response = (self.generation, response)
+			return response
+		finally:
+			self.lock.release()
+
+	def __get_groups(self, miner_id, version, in_cycle, state):
+		return self.__get_tag_groups(miner_id) + [("versions", str(version)), ("inCycle", str(in_cycle)), ("states", state)]
+
+	def __get_tag_groups(self, miner_id):
+		miner = self.mining_farm.get_miner(miner_id)
+		return [] if miner is None else [("tags", tag) for tag in miner.tags]
+
+	def __add(self, miner_id, groups, contribution):
+		self.contributions[miner_id] = (groups, contribution)
+		for i, value in enumerate(contribution):
+			self.farm[i] += value
+		for dimension, name in groups:
+			sums = self.groups[dimension].get(name)
+			if sums is None:
+				sums = [0] * 7
+				self.groups[dimension][name] = sums
+			for i, value in enumerate(contribution):
+				sums[i] += value
+
+	def __remove(self, miner_id):
+		previous = self.contributions.pop(miner_id, None)
+		if previous is None:
+			return
+		groups, contribution = previous
+		for i, value in enumerate(contribution):
+			self.farm[i] -= value
+		for dimension, name in groups:
+			sums = self.groups[dimension][name]
+			for i, value in enumerate(contribution):
+				sums[i] -= value
+			if sums[MINERS] == 0:
+				del self.groups[dimension][name]
+
+	@staticmethod
+	def __summary(sums):
+		return {"miners": sums[MINERS], "totalHPS": sums[HPS] / HPS_SCALE, "totalSolved": sums[SOLVED],
+				"solvingRate": 100 * float(sums[SOLVING] / sums[MINERS]) if sums[MINERS] > 0 else 0,
+				"inCycle": sums[IN_CYCLE], "running": sums[RUNNING], "failing": sums[FAILING]}
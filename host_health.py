@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import logging
+import random
+import threading
+import time
+
+
+class HostHealth:
+
+	CLOSED = "closed"  # probed normally
+	OPEN = "open"  # not probed until retry_time
+	HALF_OPEN = "halfOpen"  # a single trial probe is running, until retry_time at most
+
+	def __init__(self):
+		self.state = HostHealth.CLOSED
+		self.failures = 0  # consecutive failures
+		self.reason = None  # reason of the last failure
+		self.retry_time = 0  # no probe before this time
+
+
+class HostHealthTracker:
+	"""
+	Track the consecutive probe failures of each host. The delay before the next probe doubles on every failure, and
+	after failure_threshold failures the circuit opens: the host is skipped until a single trial probe is allowed
+	every max_delay seconds. The first success closes the circuit.
+	"""
+
+	def __init__(self, max_delay=600, failure_threshold=5, jitter=0.1, log=None):
+		"""
+		:param max_delay: longest delay in seconds between two probes of a failing host
+		:param failure_threshold: number of consecutive failures opening the circuit
+		:param jitter: fraction of the delay randomly added so hosts failing together are not retried together
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("HostHealthTracker")
+		else:
+			self.log = log
+
+		self.max_delay = max_delay
+		self.failure_threshold = failure_threshold
+		self.jitter = jitter
+		self.hosts = {}  # host -> HostHealth, only failing hosts are tracked
+		self.lock = threading.Lock()
+
+		self.failures = 0
+		self.skipped = 0
+		self.circuits_opened = 0
+
+	def allow_probe(self, host):
+		"""Return None if host can be probed now, else its HostHealth (the probe must wait for retry_time)"""
+		self.lock.acquire()
+		try:
+			health = self.hosts.get(host)
+			if health is None:
+				return None
+
+			if time.time() < health.retry_time:
+				self.skipped += 1
+				return health
+
+			if health.state != HostHealth.CLOSED:
+				if health.state == HostHealth.HALF_OPEN:
+					# the result of the trial probe never came (miner removed, worker lost): the lease expired
+					self.log.debug("Trial probe of " + host + " timed out, allowing another one")
+				health.state = HostHealth.HALF_OPEN
+				health.retry_time = time.time() + self.max_delay  # other miners of the host wait for the trial probe
+			return None
+		finally:
+			self.lock.release()
+
+	def record_success(self, host):
+		self.lock.acquire()
+		try:
+			health = self.hosts.pop(host, None)
+			if health is not None and health.state != HostHealth.CLOSED:
+				self.log.info("Host " + host + " is reachable again, closing circuit")
+		finally:
+			self.lock.release()
+
+	def record_failure(self, host, reason, base_delay):
+		"""Record a failed probe of host and return its HostHealth. base_delay is the delay before the first retry"""
+		self.lock.acquire()
+		try:
+			health = self.hosts.get(host)
+			if health is None:
+				health = HostHealth()
+				self.hosts[host] = health
+
+			self.failures += 1
+			health.failures += 1
+			health.reason = reason
+
+			if health.failures >= self.failure_threshold:
+				if health.state == HostHealth.CLOSED:
+					self.circuits_opened += 1
+					self.log.warning("Host " + host + " failed " + str(health.failures) + " times in a row, opening circuit: " + reason)
+				health.state = HostHealth.OPEN
+				delay = self.max_delay
+			else:
+				delay = min(self.max_delay, base_delay * 2 ** (health.failures - 1))
+
+			health.retry_time = time.time() + delay * (1 + random.uniform(0, self.jitter))
+			return health
+		finally:
+			self.lock.release()
+
+	def get_counters(self):
+		self.lock.acquire()
+		try:
+			open_circuits = sum(1 for health in self.hosts.values() if health.state != HostHealth.CLOSED)
+			return {"failingHosts": len(self.hosts), "openCircuits": open_circuits, "failures": self.failures,
+					"skipped": self.skipped, "circuitsOpened": self.circuits_opened}
+		finally:
+			self.lock.release()
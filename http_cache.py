@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import gzip
+import hashlib
+import email.utils
+
+
+class CachedResponse:
+
+	GZIP_MIN_SIZE = 512  # smaller bodies are not worth compressing
+
+	def __init__(self, body, content_type, etag=None, last_modified=None, compress=True, compresslevel=6):
+		"""
+		:param body: response body (bytes)
+		:param content_type: value of the Content-type header
+		:param etag: entity tag including the quotes. Derived from the body if None
+		:param last_modified: modification time as a timestamp, sent as Last-Modified if not None
+		:param compress: store a gzip variant of the body for the clients that accept it
+		:param compresslevel: gzip level, lower is faster for large bodies rendered often
+		"""
+
+		self.body = body
+		self.content_type = content_type
+		self.last_modified = last_modified
+
+		if etag is None:
+			etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+		self.etag = etag
+
+		self.gzip_body = None
+		if compress and len(body) >= CachedResponse.GZIP_MIN_SIZE:
+			self.gzip_body = gzip.compress(body, compresslevel=compresslevel, mtime=0)
+
+
+def accepts_gzip(http_request):
+	accept_encoding = http_request.headers.get('Accept-Encoding')
+	if accept_encoding is None:
+		return False
+
+	for encoding in accept_encoding.split(','):
+		buffer = encoding.strip().split(';')
+		if buffer[0].strip().lower() == "gzip":
+			return len(buffer) == 1 or buffer[1].strip().replace(' ', '') not in ("q=0", "q=0.0")
+
+	return False
+
+
+def is_not_modified(http_request, cached):
+	if_none_match = http_request.headers.get('If-None-Match')
+	if if_none_match is not None:
+		for etag in if_none_match.split(','):
+			etag = etag.strip()
+			if etag == "*" or etag == cached.etag or etag == "W/" + cached.etag:
+				return True
+		return False  # If-None-Match takes precedence over If-Modified-Since
+
+	if_modified_since = http_request.headers.get('If-Modified-Since')
+	if if_modified_since is not None and cached.last_modified is not None:
+		try:
+			since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+		except (TypeError, ValueError):
+			return False
+		return int(cached.last_modified) <= since
+
+	return False
+
+
+def build_cached_response(http_request, cached, cache_control="no-cache"):
+	"""
+	Return (status code, headers as (name, value) list, body) of the cached response, or of a 304 if the client copy is
+	still valid. Only http_request.headers is used
+	"""
+
+	if is_not_modified(http_request, cached):
+		return 304, get_validators(cached, cache_control), b""
+
+	body = cached.body
+	headers = [('Content-type', cached.content_type)] + get_validators(cached, cache_control)
+	if cached.gzip_body is not None:
+		headers.append(('Vary', 'Accept-Encoding'))
+		if accepts_gzip(http_request):
+			body = cached.gzip_body
+			headers.append(('Content-Encoding', 'gzip'))
+	headers.append(('Content-Length', str(len(body))))
+	return 200, headers, body
+
+
+def send_cached_response(http_request, cached, cache_control="no-cache"):
+	"""Send the cached response, or 304 if the client copy is still valid"""
+
+	code, headers, body = build_cached_response(http_request, cached, cache_control)
+	http_request.send_response(code)
+	for name, value in headers:
+		http_request.send_header(name, value)
+	http_request.end_headers()
+	if len(body) > 0:
+		http_request.wfile.write(body)
+
+
+def get_validators(cached, cache_control):
+	headers = [('ETag', cached.etag)]
+	if cached.last_modified is not None:
+		headers.append(('Last-Modified', email.utils.formatdate(cached.last_modified, usegmt=True)))
+	if cache_control is not None:
+		headers.append(('Cache-Control', cache_control))
+	return headers
+
+
+def send_validators(http_request, cached, cache_control):
+	for name, value in get_validators(cached, cache_control):
+		http_request.send_header(name, value)
@@ -24,14 +24,16 @@ SOFTWARE.
 """
 
 
-import paramiko
 import re
 import logging
 import time
+import uuid
+import ssh_connection_pool
+import verifier_report
 
 
 class MinerConfig:
-	def __init__(self, miner_id, host, user, password=None, private_key_path=None, start_command=None, stop_command=None, log_command=None, reboot_command=None):
+	def __init__(self, miner_id, host, user, password=None, private_key_path=None, start_command=None, stop_command=None, log_command=None, reboot_command=None, version_command=None, batch_probe=False, log_file=None, heartbeat=None, tags=None, agent_key=None):
 		self.miner_id = miner_id
 		self.host = host
 		self.user = user
@@ -41,6 +43,12 @@ class MinerConfig:
 		self.stop_command = stop_command
 		self.log_command = log_command
 		self.reboot_command = reboot_command
+		self.version_command = version_command
+		self.batch_probe = batch_probe  # run the statistics probe as a single remote script
+		self.log_file = log_file  # verifier log tailed incrementally instead of running log_command
+		self.heartbeat = heartbeat  # seconds between probes of this miner, overrides the farm heartbeats if not None
+		self.tags = [] if tags is None else tags  # labels used to select miners in bulk commands
+		self.agent_key = agent_key  # key signing the reports pushed by nyzo_agent.py, None to refuse them
 
 	def build(self):
 		return Miner(self)
@@ -50,8 +58,12 @@ class Miner:
 
 	TOP_CPU_LOAD_SEPARATOR = re.compile("%|( )")
 	CMD_TIMEOUT = 20  # timeout in seconds
+	PROCESS_TIMEOUT = 30  # seconds to wait for the verifier process to spawn or vanish after start/stop
+	PROCESS_POLL_INTERVAL = 1  # seconds between two checks of the verifier process
+	BATCH_BOUNDARY_PREFIX = "@@nyzo-manager-"
+	LOG_TAIL_MAX_BYTES = verifier_report.LOG_TAIL_MAX_BYTES  # maximum number of log bytes fetched per probe
 
-	def __init__(self, config, log=None):
+	def __init__(self, config, log=None, connection_pool=None):
 
 		self.config = config
 		self.miner_id = config.miner_id
@@ -64,167 +76,211 @@ class Miner:
 		self.version_command = config.version_command
 		self.log_command = config.log_command
 		self.reboot_command = config.reboot_command
+		self.batch_probe = config.batch_probe
+		self.log_file = getattr(config, "log_file", None)
+		self.heartbeat = getattr(config, "heartbeat", None)
+		self.tags = getattr(config, "tags", [])
+		self.agent_key = getattr(config, "agent_key", None)
+		self.log_cursor = None  # position in log_file after the last probe, see verifier_report.parse_log_tail
+		self.probe_timings = {}  # phase -> seconds spent in the last probe, see probe_instrumentation.PHASES
 
 		if log is None:
 			self.log = logging.getLogger(self.miner_id)
 		else:
 			self.log = log
 
+		if connection_pool is None:
+			self.connection_pool = ssh_connection_pool.get_default_pool()
+		else:
+			self.connection_pool = connection_pool
+
 	def start(self):
-		ssh_session = Miner.__ssh_connect(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log)
+		with self.__ssh_connect() as ssh_session:
 
-		# don't start multiple instance
-		if len(self.__parse_pids(ssh_session)) > 0:
-			return True
+			# don't start multiple instance
+			if len(self.__parse_pids(ssh_session)) > 0:
+				return True
 
-		self.log.info("Starting")
-		ssh_session.exec_command(self.start_command, timeout=Miner.CMD_TIMEOUT)
-		time.sleep(3)  # let the process spawn
-		success = len(self.__parse_pids(ssh_session)) > 0
-		ssh_session.close()
-		return success
+			self.log.info("Starting")
+			ssh_session.exec_command(self.start_command, timeout=Miner.CMD_TIMEOUT)
+			return self.__wait_for_process(ssh_session, running=True)
 
 	def stop(self):
-		ssh_session = Miner.__ssh_connect(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log)
-
-		self.log.info("Stopping")
-		ssh_session.exec_command(self.stop_command)
-
-		time.sleep(3)  # let the process vanish
-		success = len(self.__parse_pids(ssh_session)) == 0
-		ssh_session.close()
-		return success
+		with self.__ssh_connect() as ssh_session:
+
+			self.log.info("Stopping")
+			ssh_session.exec_command(self.stop_command, timeout=Miner.CMD_TIMEOUT)
+			return self.__wait_for_process(ssh_session, running=False)
+
+	def __wait_for_process(self, ssh_session, running, timeout=None):
+		"""Poll the verifier process until it is running (or stopped) and return False if it is not before the timeout"""
+		deadline = time.time() + (Miner.PROCESS_TIMEOUT if timeout is None else timeout)
+		while True:
+			if (len(self.__parse_pids(ssh_session)) > 0) == running:
+				return True
+			if time.time() + Miner.PROCESS_POLL_INTERVAL > deadline:
+				self.log.warning("Verifier process still " + ("stopped" if running else "running") + " after " + str(Miner.PROCESS_TIMEOUT if timeout is None else timeout) + " sec")
+				return False
+			time.sleep(Miner.PROCESS_POLL_INTERVAL)
 
 	def reboot(self):
-		ssh_session = Miner.__ssh_connect(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log)
-		self.log.info("Rebooting")
-		ssh_session.exec_command(self.reboot_command)
-		ssh_session.close()
+		ssh_session = self.connection_pool.lease(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log)
+		try:
+			self.log.info("Rebooting")
+			ssh_session.exec_command(self.reboot_command, timeout=Miner.CMD_TIMEOUT)
+		finally:
+			self.connection_pool.release(ssh_session, discard=True)  # the host is going down, don't keep the transport
 		return True
 
 	def state(self):
-		ssh_session = Miner.__ssh_connect(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log)
-		stdin, stdout, stderr = ssh_session.exec_command("ps faux | grep nyzoVerifier", timeout=Miner.CMD_TIMEOUT)
-		stderr_str = stderr.read().decode("utf-8")
-		state = "Unknown"
-
-		if len(stderr_str) > 0:
-			self.log.warning("Error while parsing processes: " + stderr_str)
-		else:
-			stdout_str = stdout.read().decode("utf-8")
+		with self.__ssh_connect() as ssh_session:
+			stdin, stdout, stderr = ssh_session.exec_command(verifier_report.PROCESSES_COMMAND, timeout=Miner.CMD_TIMEOUT)
+			stderr_str = stderr.read().decode("utf-8")
+			state = "Unknown"
 
-			if len(stdout_str.splitlines()) > 2:
-				state = "Running"
+			if len(stderr_str) > 0:
+				self.log.warning("Error while parsing processes: " + stderr_str)
 			else:
-				state = "Stopped"
+				stdout_str = stdout.read().decode("utf-8")
 
-		ssh_session.close()
-		return state
+				if len(stdout_str.splitlines()) > 2:
+					state = "Running"
+				else:
+					state = "Stopped"
+
+			return state
+
+	def get_state(self):
+		"""State kept between two probes, to carry over when the miner is rebuilt from its config"""
+		return {"log_cursor": self.log_cursor}
+
+	def set_state(self, state):
+		if state is not None:
+			self.log_cursor = state.get("log_cursor")
 
 	def statistics(self):
-		ssh_session = Miner.__ssh_connect(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log)
-		report = {}
+		self.probe_timings = {}
+		with self.__ssh_connect(self.probe_timings) as ssh_session:
+			return self.__statistics(ssh_session)
 
-		# parse cpu load
-		stdin, stdout, stderr = ssh_session.exec_command("cat /proc/loadavg", timeout=Miner.CMD_TIMEOUT)
-		# stdin, stdout, stderr = ssh_session.exec_command("top -c -b -n 1")
-		stderr_str = stderr.read().decode("utf-8")
+	def __statistics(self, ssh_session):
+		commands = self.__statistics_commands()
 
-		if len(stderr_str) > 0:
-			report["error_cpu_load"] = stderr_str
-			self.log.warning("Error while parsing cpu load: " + report["error_cpu_load"])
+		if self.batch_probe:
+			start = time.time()
+			outputs = self.__exec_batch(ssh_session, commands)
+			self.probe_timings["batch"] = time.time() - start
 		else:
-			stdout_list = stdout.read().decode("utf-8").split(' ')
-			print(stdout_list)
-			report["cpu"] = float(stdout_list[1])*100
+			outputs = {}
+			for section, command, timeout in commands:
+				start = time.time()
+				stdin, stdout, stderr = ssh_session.exec_command(command, timeout=timeout)
+				stderr_str = stderr.read().decode("utf-8")
+				stdout_str = stdout.read().decode("utf-8", errors="replace")
+				outputs[section] = (stdout_str, stderr_str)
+				self.probe_timings["logTail" if section == "log_tail" else section] = time.time() - start
+
+		start = time.time()
+		report = self.__build_report(outputs)
+		self.probe_timings["parse"] = time.time() - start
+		return report
 
-		stdin, stdout, stderr = ssh_session.exec_command(self.version_command, timeout=Miner.CMD_TIMEOUT)
+	def __statistics_commands(self):
+		"""Sections of the statistics probe as (section, command, timeout)"""
+		commands = [("cpu", verifier_report.CPU_COMMAND, Miner.CMD_TIMEOUT),
+					("version", self.version_command, Miner.CMD_TIMEOUT),
+					("processes", verifier_report.PROCESSES_COMMAND, Miner.CMD_TIMEOUT)]
+
+		if self.log_file is not None:
+			commands.append(("log_tail", self.__log_tail_command(), Miner.CMD_TIMEOUT))
+		elif self.log_command is not None:
+			commands.append(("log", self.log_command, Miner.CMD_TIMEOUT))
+
+		return commands
+
+	def __exec_batch(self, ssh_session, commands):
+		"""Run all the commands in a single remote script and split the framed output by section"""
+
+		boundary = Miner.BATCH_BOUNDARY_PREFIX + uuid.uuid4().hex
+		script = ['__nm_err=$(mktemp 2>/dev/null || echo /tmp/nyzo_manager_probe.$$)']
+		for section, command, timeout in commands:
+			script.append("printf '\\n%s %s out\\n' '" + boundary + "' '" + section + "'")
+			script.append("{ " + command + "\n} </dev/null 2>\"$__nm_err\"")
+			script.append("printf '\\n%s %s err\\n' '" + boundary + "' '" + section + "'")
+			script.append('cat "$__nm_err"')
+		script.append("printf '\\n%s end\\n' '" + boundary + "'")
+		script.append('rm -f "$__nm_err"')
+
+		stdin, stdout, stderr = ssh_session.exec_command("\n".join(script), timeout=Miner.CMD_TIMEOUT)
+		stdout_str = stdout.read().decode("utf-8", errors="replace")
 		stderr_str = stderr.read().decode("utf-8")
 		if len(stderr_str) > 0:
-			report["version"] = 'Unknown'
-			self.log.warning("Error while fetching version: " + report["version"])
-		else:
-			stdout_list = stdout.read().decode("utf-8").split(' ')
-			print(stdout_list)
-			version = stdout_list[len(stdout_list)-1].rstrip()[:-1]
-			print(version)
-			report["version"] = version
-
-		# parse process with ps faux because top have different behavior across plateform
-		stdin, stdout, stderr = ssh_session.exec_command("ps faux | grep nyzoVerifier")
-		stderr_str = stderr.read().decode("utf-8")
+			self.log.warning("Error while running batched probe: " + stderr_str)
 
-		if len(stderr_str) > 0:
-			report["error_processes"] = stderr_str
-			self.log.warning("Error while parsing processes: " + report["error_processes"])
-		else:
-			stdout_str = stdout.read().decode("utf-8")
-			report["process"] = []
-			for process in stdout_str.splitlines():
-				if " grep " in process:
-					continue
-				elif "nyzoVerifier" in process:
-					report["process"].append("nyzoVerifier")
-				else:
-					buffer = process.split("nyzoVerifier ")
-					if len(buffer) > 1:
-						report["process"].append(str(buffer[1]).strip())
-
-		report["process"].sort()
-		report["nyzoVerifier"] = False
-		report["listen"] = False
-		report["solving"] = False
-
-		for process in report["process"]:
-			print(process)
-			if process == "nyzoVerifier":
-				report["nyzoVerifier"] = 'True'
-			elif "listen" in process:
-				report["listen"] = True
-			elif "solving" in process:
-				report["solving"] = True
-
-		if self.log_command is not None:
-			# parse log
-			stdin, stdout, stderr = ssh_session.exec_command(self.log_command, timeout=Miner.CMD_TIMEOUT)
-			# print(stdout.read().decode("utf-8"))
-			stderr_str = stderr.read().decode("utf-8")
+		return Miner.parse_batch_output(stdout_str, boundary)
+
+	@staticmethod
+	def parse_batch_output(stdout_str, boundary):
+		"""Return a dict section -> (stdout, stderr) from the output of a batched probe"""
+
+		outputs = {}
+		frames = stdout_str.split("\n" + boundary + " ")
+		if len(frames[0]) > 0:
+			raise Exception("Unexpected batched probe output: " + frames[0][:200])
+
+		for frame in frames[1:]:
+			header, separator, content = frame.partition("\n")
+			buffer = header.split(" ")
+
+			if len(buffer) == 1 and buffer[0] == "end":
+				return outputs
+			if len(buffer) != 2:
+				raise Exception("Invalid batched probe frame header: " + header)
+
+			section, stream = buffer
+			stdout_content, stderr_content = outputs.get(section, ("", ""))
+			if stream == "out":
+				outputs[section] = (content, stderr_content)
+			else:
+				outputs[section] = (stdout_content, content)
+
+		raise Exception("Truncated batched probe output")
+
+	def __build_report(self, outputs):
+		report = verifier_report.build_report(outputs, self.log)
+
+		if "log_tail" in outputs:
+			stdout_str, stderr_str = outputs["log_tail"]
 			if len(stderr_str) > 0:
 				report["error_logs"] = stderr_str
 				self.log.warning("Error while parsing logs: " + report["error_logs"])
 			else:
-				stdout_str = stdout.read().decode("utf-8")
-				for log in stdout_str.splitlines():
-					print('::',log)
-					log = re.sub(' +', ' ', log)  # remove consecutive space
-					if "freezing block [" in log:
-						pos = 3
-						posx = 1
-						posy = 1
-						if "v=0" in log:
-							pos = 2
-							posx = 2
-							posy = 5
-
-						buffer = log.split(" ")
-						ibuffer = buffer[pos].split('=')
-						frozen_block = ibuffer[posx][:-posy]
-						report["frozenblock"] = frozen_block
-
-						if "v=0" in log:
-							report["in_cycle"] = 'False'
-						else:
-							report["in_cycle"] = 'True'
-
-		ssh_session.close()
-		return report
-
-	def __parse_pids(self, ssh_session=None):
+				self.log_cursor = verifier_report.parse_log_tail(stdout_str, self.log_cursor, report, self.log)
 
-		if ssh_session is None:
-			ssh_session = Miner.__ssh_connect(host=self.host, username=self.user, password=self.password,  prv_key_file=self.private_key_path, log=self.log)
+		return report
 
-		stdin, stdout, stderr = ssh_session.exec_command("ps faux | grep nyzoVerifier")
+	def __log_tail_command(self):
+		"""
+		Remote script printing "inode start size" followed by the bytes of log_file in [start, size).
+		start is the cursor offset, or 0 if the file was rotated (new inode) or truncated (smaller than the offset),
+		capped so that at most LOG_TAIL_MAX_BYTES are sent.
+		"""
+		inode = "-"
+		offset = 0
+		if self.log_cursor is not None:
+			inode = self.log_cursor["inode"]
+			offset = self.log_cursor["offset"]
+
+		return ("(f='" + self.log_file.replace("'", "'\\''") + "'; i='" + inode + "'; o=" + str(int(offset)) + "; m=" + str(Miner.LOG_TAIL_MAX_BYTES) + "\n"
+				"s=$(stat -L -c '%i %s' \"$f\") || exit 1\n"
+				"set -- $s\n"
+				"if [ \"$1\" != \"$i\" ] || [ \"$2\" -lt \"$o\" ]; then o=0; fi\n"
+				"if [ $(($2 - o)) -gt \"$m\" ]; then o=$(($2 - m)); fi\n"
+				"echo \"$1 $o $2\"\n"
+				"tail -c +$((o + 1)) \"$f\" | head -c $(($2 - o)))")
+
+	def __parse_pids(self, ssh_session):
+		stdin, stdout, stderr = ssh_session.exec_command(verifier_report.PROCESSES_COMMAND, timeout=Miner.CMD_TIMEOUT)
 		stderr_str = stderr.read().decode("utf-8")
 		if len(stderr_str) > 0:
 			raise Exception(stderr_str)
@@ -239,32 +295,5 @@ class Miner:
 
 		return pids
 
-	@staticmethod
-	def __ssh_connect(host, username, password=None, prv_key_file=None, log=None):
-
-		ssh_session = paramiko.SSHClient()
-		ssh_session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-		if prv_key_file is None:
-			if log is not None:
-				log.debug("Connecting to " + host + " using password...")
-
-			port = 22
-			if ":" in host:
-				buffer = host.split(':')
-				host = buffer[0]
-				port = int(buffer[1])
-
-			ssh_session.connect(hostname=host, port=port, username=username, password=password)
-
-		else:
-			if log is not None:
-				log.debug("Connecting to " + host + " using private key...")
-			pk = paramiko.RSAKey.from_private_key_file(prv_key_file)
-			ssh_session.connect(hostname=host, username=username, pkey=pk)
-
-		if log is not None:
-			log.debug("Connected")
-
-		return ssh_session
-
+	def __ssh_connect(self, timings=None):
+		return self.connection_pool.connection(host=self.host, username=self.user, password=self.password, prv_key_file=self.private_key_path, log=self.log, timings=timings)
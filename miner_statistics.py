@@ -29,17 +29,32 @@ import time
 import datetime
 import threading
 import multiprocessing
+import concurrent.futures
+import types
+import socket
+import paramiko
 import mining_farm
+import ssh_connection_pool
+import probe_scheduler
+import host_health
+import probe_instrumentation
 
 
 def get_statistics(miner):
+	start = time.time()
+	stat = miner.statistics()
+	t = time.time()
+	return build_statistics(miner, stat, t, t - start)
+
+
+def build_statistics(miner, stat, t, probe_duration):
+	"""Statistics of miner from the report of a probe (Miner.statistics) or of its agent, collected at t"""
 	statistics = {}
 	statistics["minerId"] = miner.miner_id
 	statistics["host"] = miner.host
 	statistics["user"] = miner.user
-	stat = miner.statistics()
-	t = time.time()
 	statistics["timestamp"] = t
+	statistics["probeDuration"] = probe_duration
 	statistics["datetime"] = datetime.datetime.utcfromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S UTC')
 	statistics["cpu"] = stat["cpu"]
 	statistics["version"] = stat["version"]
@@ -68,28 +83,82 @@ def get_statistics(miner):
 	else:
 		statistics["difficulty"] = None
 
+	# log events, None when the log is not collected. The counts cover the log read by this probe
+	statistics["forHeight"] = stat.get("for_height")
+	statistics["frozenBlocks"] = stat.get("frozen_blocks")
+	statistics["logLines"] = stat.get("log_lines")
+
 	return statistics
 
 
-def _get_statistics_child_process(miner_config):
+def _get_statistics_child_process(miner_config, miner_state=None):
+	start = time.time()
 	try:
 		mining_farm.set_log_level()
 		# rebuild the miner from the config (intra process communication only support serializable object)
 		miner = miner_config.build()
+		miner.set_state(miner_state)
+	except Exception as e:
+		reason = get_failure_reason(e)
+		logging.getLogger("child_process").error(miner_config.miner_id + ": " + reason)
+		return miner_config.miner_id, None, None, reason, {"total": time.time() - start, "started": start}
+
+	return _get_statistics_task(miner)
+
+
+def _get_statistics_task(miner):
+	"""Return (miner id, statistics or None, miner state, failure reason or None, timings of the probe phases)"""
+	start = time.time()
+	try:
+		miner.probe_timings = {}
 		miner.log.debug("Computing statistics")
 		status = get_statistics(miner)
+		miner.log.debug("Connection pool counters: " + str(miner.connection_pool.get_counters()))
 
-		return miner.miner_id, status
+		return miner.miner_id, status, miner.get_state(), None, _get_timings(miner, start)
 
 	except Exception as e:
+		reason = get_failure_reason(e)
 		plog = logging.getLogger("child_process")
 		plog.setLevel(logging.INFO)
-		plog.error(str(e))
+		plog.error(miner.miner_id + ": " + reason)
+		try:
+			state = miner.get_state()
+		except Exception:
+			state = None  # the previous state is kept
+		return miner.miner_id, None, state, reason, _get_timings(miner, start)
+
+
+def _get_timings(miner, start):
+	timings = dict(getattr(miner, "probe_timings", {}))
+	timings["total"] = time.time() - start
+	timings["started"] = start  # turned into the queue time by the pool
+	return timings
+
+
+def get_failure_reason(e):
+	"""Short description of a probe failure, shown in the statistics of the miner"""
+	if isinstance(e, paramiko.AuthenticationException):
+		return "Authentication failed: " + str(e)
+	if isinstance(e, socket.timeout):
+		return "Timed out"
+	if isinstance(e, paramiko.ssh_exception.NoValidConnectionsError) or isinstance(e, ConnectionError):
+		return "Connection failed: " + str(e)
+	if isinstance(e, paramiko.SSHException):
+		return "SSH error: " + str(e)
+	if isinstance(e, OSError):
+		return "Network error: " + str(e)
+	return type(e).__name__ + ": " + str(e)
 
 
 class StatisticsProcessingPool:
 
-	def __init__(self, farm, parallelism, heartbeat=30, log=None):
+	def __init__(self, farm, parallelism, heartbeat=30, healthy_heartbeat=None, unhealthy_heartbeat=None, log=None):
+		"""
+		:param heartbeat: seconds between two probes of a miner
+		:param healthy_heartbeat: heartbeat of the miners running in cycle (heartbeat if None)
+		:param unhealthy_heartbeat: heartbeat of the miners stopped or out of cycle (heartbeat if None)
+		"""
 
 		if log is None:
 			self.log = logging.getLogger("StatisticsProcessingPool")
@@ -99,107 +168,273 @@ class StatisticsProcessingPool:
 		self.mining_farm = farm
 		self.parallelism = parallelism
 		self.heartbeat = heartbeat
+		self.healthy_heartbeat = heartbeat if healthy_heartbeat is None else healthy_heartbeat
+		self.unhealthy_heartbeat = heartbeat if unhealthy_heartbeat is None else unhealthy_heartbeat
+		self.scheduler = probe_scheduler.ProbeScheduler()
+		self.host_health = host_health.HostHealthTracker(max_delay=max(600, 10 * heartbeat))
+
+		self.instrumentation = probe_instrumentation.ProbeInstrumentation()
+		self.submit_times = {}  # miner id -> submission time of its pending probe
 
-		self.pending_statistics_ids = []
+		self.pending_statistics_ids = set()
 		self.pending_statistics_ids_lock = threading.RLock()
 
-		self.statistics = []
+		self.statistics = {}  # miner id -> latest statistic
+		self.statistics_generation = 0  # incremented on every update
+		self.statistics_snapshot = (0, types.MappingProxyType({}))  # (generation, read-only copy), replaced atomically
+		self.removed_statistics = {}  # miner id -> generation of the removal, so delta readers learn about removed miners
+		self.removed_statistics_floor = 0  # removals older than this generation were forgotten
 		self.statistics_lock = threading.RLock()
+		self.listeners = []
+		self.miner_states = {}  # miner id -> Miner state returned by the last probe (process engine)
 
 		self.process_pool = None
 		self.stop_requested = False
+		self.reconciliation_requested = False
 
 		global STATISTICS_PROCESSING_POOL
 		STATISTICS_PROCESSING_POOL = self
 
 	def start(self):
-		self.log.info("Creating process pool (" + str(self.parallelism) + ")")
-		self.process_pool = multiprocessing.Pool(self.parallelism)
+		self._start_executor()
 		self.log.info("Starting update thread")
 		thread = threading.Thread(target=self.__statistic_monitor)
 		thread.start()
 
 	def stop(self):
 		self.stop_requested = True  # supposedly thread safe
+		self.scheduler.wakeup()
+		self._stop_executor()
+
+	def _start_executor(self):
+		self.log.info("Creating process pool (" + str(self.parallelism) + ")")
+		# each worker keeps its own ssh connections alive between tasks
+		pool_settings = dict(ssh_connection_pool.DEFAULT_POOL_SETTINGS)
+		self.process_pool = multiprocessing.Pool(self.parallelism, initializer=ssh_connection_pool.configure_default_pool, initargs=(pool_settings,))
+
+	def _stop_executor(self):
 		self.process_pool.terminate()
 		self.process_pool.join()
 		self.log.info("Process pool stopped")
 
+	def _submit_statistics_task(self, miner):
+		self.process_pool.apply_async(_get_statistics_child_process, (miner.config, self.miner_states.get(miner.miner_id)), callback=self.callback,
+									  error_callback=lambda e, miner_id=miner.miner_id: self.error_callback(miner_id, e))
+
+	def error_callback(self, miner_id, e):
+		"""The probe task raised instead of returning its result (result not serializable, worker lost...)"""
+		self.log.error("Probe task of " + miner_id + " failed: " + type(e).__name__ + ": " + str(e))
+		self.callback((miner_id, None, None, get_failure_reason(e)))
+
+	MAX_REMOVED_STATISTICS = 10000  # removals remembered for the delta readers
+
 	def set_statistics(self, stat):
+		"""Record stat and notify the listeners. Return False if it was discarded"""
 		if stat is None:
 			self.log.warning("Discarding None statistic")
 			return False
 
 		self.statistics_lock.acquire()
 		try:
-			new_statistic = []
-			for s in self.statistics:
-				if stat is not None and s["minerId"] == stat["minerId"]:
-					new_statistic.append(stat)
-					stat = None
-				else:
-					new_statistic.append(s)
+			# checked under the lock: a reload removes the miner from the farm before calling remove_statistics
+			if self.mining_farm.get_miner(stat["minerId"]) is None:
+				self.log.debug("Discarding statistics of " + stat["minerId"] + ", removed from the farm")
+				return False
+
+			previous_stat = self.statistics.get(stat["minerId"])
+			self.statistics_generation += 1
+			stat["seq"] = self.statistics_generation  # generation of the last change of this statistic
+			self.statistics[stat["minerId"]] = stat
+			self.removed_statistics.pop(stat["minerId"], None)
+
+			for listener in self.listeners:
+				try:
+					listener(previous_stat, stat)
+				except Exception as e:
+					self.log.error("Statistics listener failed: " + str(e))
 
-			if stat is not None:  # if the stat was not there before
-				new_statistic.append(stat)
-
-			self.statistics.clear()
-			self.statistics.extend(new_statistic)
+			return True
+		finally:
+			self.statistics_lock.release()
 
+	def remove_statistics(self, miner_id):
+		"""Forget the statistic of a miner that left the farm. The removal is recorded so delta readers can drop it too"""
+		self.statistics_lock.acquire()
+		try:
+			previous_stat = self.statistics.pop(miner_id, None)
+			if previous_stat is None:
+				return False
+			self.instrumentation.remove(miner_id)
+			self.miner_states.pop(miner_id, None)
+
+			self.statistics_generation += 1
+			self.removed_statistics[miner_id] = self.statistics_generation
+			if len(self.removed_statistics) > StatisticsProcessingPool.MAX_REMOVED_STATISTICS:
+				oldest = min(self.removed_statistics, key=self.removed_statistics.get)
+				self.removed_statistics_floor = self.removed_statistics.pop(oldest)
+
+			for listener in self.listeners:
+				try:
+					listener(previous_stat, None)
+				except Exception as e:
+					self.log.error("Statistics listener failed: " + str(e))
 			return True
 		finally:
 			self.statistics_lock.release()
 
+	def add_listener(self, listener):
+		"""
+		Register a callable listener(previous_stat, new_stat) invoked on every update, in update order. new_stat is None
+		when the miner is removed.
+		Listeners are called while holding the statistics lock and must not block.
+		"""
+		self.statistics_lock.acquire()
+		try:
+			self.listeners.append(listener)
+		finally:
+			self.statistics_lock.release()
+
 	def get_statistics(self, miner_id):
 		self.statistics_lock.acquire()
 		try:
-			for stat in self.statistics:
-				if stat["minerId"] == miner_id:
-					return stat
+			return self.statistics.get(miner_id)
+		finally:
+			self.statistics_lock.release()
+
+	def get_statistics_snapshot(self):
+		"""
+		Return a read-only mapping miner id -> statistic that can be iterated without holding any lock.
+		The mapping is copied at most once per generation and shared by all readers until the next update.
+		"""
+		return self.get_versioned_statistics_snapshot()[1]
+
+	def get_versioned_statistics_snapshot(self):
+		"""Return (generation, snapshot), the snapshot holding exactly the updates up to generation"""
+		versioned_snapshot = self.statistics_snapshot
+		if versioned_snapshot[0] == self.statistics_generation:
+			return versioned_snapshot
+
+		self.statistics_lock.acquire()
+		try:
+			if self.statistics_snapshot[0] != self.statistics_generation:
+				self.statistics_snapshot = (self.statistics_generation, types.MappingProxyType(dict(self.statistics)))
+			return self.statistics_snapshot
+		finally:
+			self.statistics_lock.release()
 
-			return None
+	def get_removed_statistics(self, since, generation):
+		"""
+		Return the ids of the miners removed after since and up to generation,
+		or None if removals that old were forgotten (the reader must start over from a full status)
+		"""
+		self.statistics_lock.acquire()
+		try:
+			if since < self.removed_statistics_floor:
+				return None
+			return [miner_id for miner_id, removal in self.removed_statistics.items() if since < removal <= generation]
 		finally:
 			self.statistics_lock.release()
 
+	def get_statistics_generation(self):
+		return self.statistics_generation
+
 	def init_statistics(self, miner_id):
 		stat = StatisticsProcessingPool.__get_default_statistic(miner_id)
 		self.set_statistics(stat)
 		return stat
 
+	def request_probe(self, miner_id):
+		"""Probe the miner as soon as possible instead of waiting for its next heartbeat"""
+		self.scheduler.schedule(miner_id, 0, jitter=False)
+
+	AGENT_MISSED_REPORTS = 3  # reports an agent can miss before its miner is probed over ssh again
+
+	def submit_report(self, miner, stat, interval, duration=None):
+		"""
+		Record the statistics pushed by the agent of miner, sending a report every interval seconds. Its ssh probe is
+		postponed so it only runs once the agent missed AGENT_MISSED_REPORTS reports.
+		"""
+		statistics = build_statistics(miner, stat, time.time(), duration)
+		statistics["agent"] = True
+		if self.set_statistics(statistics):
+			self.scheduler.schedule(miner.miner_id, StatisticsProcessingPool.AGENT_MISSED_REPORTS * interval, jitter=False)
+
+	def forget_miner_state(self, miner_id):
+		"""Drop the state carried between the probes of a miner (log cursor), once its log is no longer the same"""
+		self.miner_states.pop(miner_id, None)
+
+	def reconcile(self):
+		"""Schedule the miners added to the farm and forget the removed ones now instead of at the next heartbeat"""
+		self.reconciliation_requested = True
+		self.scheduler.wakeup()
+
+	def get_probe_interval(self, miner, stat):
+		"""Delay before the next probe of miner: shorter while the verifier is down or out of cycle, longer when it is healthy"""
+		if miner.heartbeat is not None:
+			return miner.heartbeat
+
+		if stat is None or "nyzoVerifier" not in stat:
+			return self.heartbeat
+
+		if stat["nyzoVerifier"] == 'True' and stat.get("in_cycle") == 'True':
+			return self.healthy_heartbeat
+
+		if stat["nyzoVerifier"] != 'True' or stat.get("in_cycle") == 'False':
+			return self.unhealthy_heartbeat
+
+		return self.heartbeat
+
+	def get_scheduler_counters(self):
+		counters = self.scheduler.get_counters()
+		counters["pending"] = len(self.pending_statistics_ids)
+		counters.update(self.host_health.get_counters())
+		return counters
+
+	def get_probe_report(self, miner_id=None):
+		"""
+		Load of the statistics engine and latency histograms of the probe phases, farm-wide, or of a single miner if
+		miner_id is set (None if the miner was never probed)
+		"""
+		if miner_id is not None:
+			phases = self.instrumentation.get_miner_phases(miner_id)
+			if phases is None:
+				return None
+			return {"minerId": miner_id, "phases": phases}
+
+		in_flight = len(self.pending_statistics_ids)
+		report = {"engine": type(self).__name__, "parallelism": self.parallelism, "heartbeat": self.heartbeat,
+				"healthyHeartbeat": self.healthy_heartbeat, "unhealthyHeartbeat": self.unhealthy_heartbeat,
+				"inFlight": in_flight, "queued": max(0, in_flight - self.parallelism),
+				"scheduler": self.scheduler.get_counters(), "hosts": self.host_health.get_counters(),
+				"phases": self.instrumentation.get_phases(),
+				"slowestMiners": [dict(summary, minerId=miner_id) for miner_id, summary in self.instrumentation.get_slowest_miners()]}
+		report.update(self.instrumentation.get_counters())
+		return report
+
 	def get_pending_ids(self):
 		self.pending_statistics_ids_lock.acquire()
 		try:
-			copy = []
-			copy.extend(self.pending_statistics_ids)
-			return copy
+			return list(self.pending_statistics_ids)
 		finally:
 			self.pending_statistics_ids_lock.release()
 
 	def __set_computation_pending(self, miner_id):
 		self.pending_statistics_ids_lock.acquire()
 		try:
-				if self.__is_computation_pending(miner_id):
-					return False
+			if miner_id in self.pending_statistics_ids:
+				return False
 
-				self.pending_statistics_ids.append(miner_id)
-				self.log.debug("Statistics job queue size -> " + str(len(self.get_pending_ids())))
-				return True
+			self.pending_statistics_ids.add(miner_id)
+			self.log.debug("Statistics job queue size -> " + str(len(self.pending_statistics_ids)))
+			return True
 		finally:
 			self.pending_statistics_ids_lock.release()
 
 	def __remove_computation_pending(self, miner_id):
 		self.pending_statistics_ids_lock.acquire()
 		try:
-			new_pending_statistics = []
-
-			for id in self.pending_statistics_ids:
-				if id == miner_id:
-					continue
-				new_pending_statistics.append(id)
-
-			self.pending_statistics_ids.clear()
-			self.pending_statistics_ids.extend(new_pending_statistics)
-			self.log.debug("Statistics job queue size -> " + str(len(self.get_pending_ids())))
+			self.pending_statistics_ids.discard(miner_id)
+			self.log.debug("Statistics job queue size -> " + str(len(self.pending_statistics_ids)))
 		finally:
 			self.pending_statistics_ids_lock.release()
 
@@ -207,21 +442,17 @@ class StatisticsProcessingPool:
 		self.pending_statistics_ids_lock.acquire()
 		try:
 			self.pending_statistics_ids.clear()
-			self.log.debug("Statistics job queue size -> " + str(len(self.get_pending_ids())))
+			self.log.debug("Statistics job queue size -> " + str(len(self.pending_statistics_ids)))
 		finally:
 			self.pending_statistics_ids_lock.release()
 
 	def __is_computation_pending(self, miner_id):
 		self.pending_statistics_ids_lock.acquire()
 		try:
-			for id in self.pending_statistics_ids:
-				if id == miner_id:
-					return True
+			return miner_id in self.pending_statistics_ids
 		finally:
 			self.pending_statistics_ids_lock.release()
 
-		return False
-
 	def callback(self, tuple):
 		if tuple is None:
 			self.log.error("Tuple is None. Clearing all pending statistics")
@@ -230,46 +461,169 @@ class StatisticsProcessingPool:
 
 		miner_id = tuple[0]
 		stat = tuple[1]
+		miner = self.mining_farm.get_miner(miner_id)
+		if miner is None:
+			self.log.debug("Discarding statistics of " + miner_id + ", removed from the farm")
+			self.submit_times.pop(miner_id, None)
+			self.__remove_computation_pending(miner_id)
+			return
+
+		if len(tuple) > 2 and tuple[2] is not None:
+			self.miner_states[miner_id] = tuple[2]
+
+		self.__record_timings(miner_id, tuple[4] if len(tuple) > 4 else None, stat is None)
+
 		if stat is None:
-			self.log.error("New stat of " + miner_id + " is None")
+			reason = tuple[3] if len(tuple) > 3 and tuple[3] is not None else "Unknown error"
+			self.log.error("New stat of " + miner_id + " is None: " + reason)
+			self.__remove_computation_pending(miner_id)
+			self.__probe_failed(miner, reason)
 		else:
 			self.log.debug("New stat received for " + miner_id + ": " + str(stat))
-			self.set_statistics(stat)
+			accepted = self.set_statistics(stat)
 			self.__remove_computation_pending(miner_id)
+			self.host_health.record_success(miner.host)
+			if accepted:
+				self.scheduler.schedule(miner_id, self.get_probe_interval(miner, stat))
+
+	def __record_timings(self, miner_id, timings, failed):
+		submitted = self.submit_times.pop(miner_id, None)
+		if timings is None:
+			return
+
+		started = timings.pop("started", None)
+		if submitted is not None and started is not None:
+			timings["queue"] = max(0, started - submitted)
+		self.instrumentation.record(miner_id, timings, failed)
+
+	def __probe_failed(self, miner, reason):
+		"""Keep the last statistics of the miner, flagged with the failure, and postpone its next probe"""
+		health = self.host_health.record_failure(miner.host, reason, self.get_probe_interval(miner, self.get_statistics(miner.miner_id)))
+		self.__set_failure(miner, health)
+
+	def __set_failure(self, miner, health):
+		"""Flag the statistics of the miner with the failure of its host and schedule its next probe at the retry time"""
+		retry_time = max(health.retry_time, time.time() + 1)
+		previous_stat = self.get_statistics(miner.miner_id)
+		if previous_stat is not None and previous_stat.get("error") == health.reason and previous_stat.get("nextRetry") == health.retry_time:
+			self.scheduler.schedule_at(miner.miner_id, retry_time)
+			return
+
+		if previous_stat is None:
+			stat = StatisticsProcessingPool.__get_default_statistic(miner.miner_id)
+		else:
+			stat = dict(previous_stat)
+		stat["error"] = health.reason
+		stat["failures"] = health.failures
+		stat["nextRetry"] = health.retry_time
+		stat["nextRetryDatetime"] = datetime.datetime.utcfromtimestamp(health.retry_time).strftime('%Y-%m-%d %H:%M:%S UTC')
+		if self.set_statistics(stat):
+			self.scheduler.schedule_at(miner.miner_id, retry_time)
 
 	def __statistic_monitor(self):
 
+		self.__schedule_new_miners()
+		next_reconciliation = time.time() + self.heartbeat
+
 		while not self.stop_requested:
 
-			for miner in self.mining_farm.get_miners():
+			for miner_id in self.scheduler.wait_due(max(0, next_reconciliation - time.time())):
 
 				if self.stop_requested:
 					break
 
-				if self.__is_computation_pending(miner.miner_id):
-					continue
+				miner = self.mining_farm.get_miner(miner_id)
+				if miner is None:
+					continue  # left the farm
 
-				stat = self.get_statistics(miner.miner_id)
+				health = self.host_health.allow_probe(miner.host)
+				if health is not None:
+					self.log.debug("Skipping probe of miner " + miner_id + ", host is backing off")
+					self.__set_failure(miner, health)
+					continue
 
-				if stat is None:
-					"""Adding stat"""
-					stat = self.init_statistics(miner.miner_id)
+				# rescheduled when the probe completes, this one only fires if the probe is lost
+				stat = self.get_statistics(miner_id)
+				self.scheduler.schedule(miner_id, self.get_probe_interval(miner, stat))
 
-				elapsed = time.time() - stat["timestamp"]
-				if elapsed > self.heartbeat:
-					self.__set_computation_pending(miner.miner_id)
-					self.log.debug("Submitting statistics task for miner " + miner.miner_id+" (last update was "+str(elapsed)+" sec ago)")
-					self.process_pool.apply_async(_get_statistics_child_process, (miner.config,), callback=self.callback)
-					#ret= self.process_pool.apply(_get_statistics_child_process, (miner.config,))
+				if not self.__set_computation_pending(miner_id):
+					continue
 
-			time.sleep(max(1, self.heartbeat / 10))
-
-		self.process_pool.terminate()
-		self.process_pool.join()
-		self.log.info("Processing pool stopped")
+				elapsed = time.time() - stat["timestamp"] if stat is not None else None
+				self.log.debug("Submitting statistics task for miner " + miner_id + " (last update was " + str(elapsed) + " sec ago)")
+				self.submit_times[miner_id] = time.time()
+				self._submit_statistics_task(miner)
+
+			if time.time() >= next_reconciliation or self.reconciliation_requested:
+				self.reconciliation_requested = False
+				self.__schedule_new_miners()
+				self.log.debug("Probe scheduler counters: " + str(self.get_scheduler_counters()))
+				next_reconciliation = time.time() + self.heartbeat
+
+		self._stop_executor()
+
+	def __schedule_new_miners(self):
+		"""Schedule the miners added to the farm, spread over a heartbeat, and forget the removed ones"""
+		new_miner_ids = []
+		miner_ids = set()
+		for miner in self.mining_farm.get_miners():
+			miner_ids.add(miner.miner_id)
+			if not self.scheduler.is_scheduled(miner.miner_id):
+				if self.get_statistics(miner.miner_id) is None:
+					self.init_statistics(miner.miner_id)
+				new_miner_ids.append(miner.miner_id)
+
+		for miner_id in self.scheduler.get_scheduled_ids():
+			if miner_id not in miner_ids:
+				self.scheduler.remove(miner_id)
+
+		if len(new_miner_ids) > 0:
+			self.log.info("Scheduling " + str(len(new_miner_ids)) + " miners over " + str(self.heartbeat) + " sec")
+			self.scheduler.stagger(new_miner_ids, self.heartbeat)
 
 	@staticmethod
 	def __get_default_statistic(miner_id):
 
 		return {'minerId': miner_id, 'timestamp': 0,
 				'datetime': datetime.datetime.utcfromtimestamp(0).strftime('%Y-%m-%d %H:%M:%S UTC')}
+
+
+class ThreadStatisticsProcessingPool(StatisticsProcessingPool):
+	"""
+	Collect the statistics from a thread pool in the current process instead of a process pool. Miners and their pooled
+	ssh connections are reused across heartbeats. paramiko being blocking, each probe holds a thread for its whole ssh
+	I/O: the number of threads bounds the number of concurrent probes, the others wait in the queue of the executor.
+	"""
+
+	def __init__(self, farm, concurrency, heartbeat=30, healthy_heartbeat=None, unhealthy_heartbeat=None, log=None):
+		if log is None:
+			log = logging.getLogger("ThreadStatisticsProcessingPool")
+
+		StatisticsProcessingPool.__init__(self, farm, concurrency, heartbeat, healthy_heartbeat, unhealthy_heartbeat, log)
+		self.executor = None
+
+	def _start_executor(self):
+		self.log.info("Creating thread pool (" + str(self.parallelism) + ")")
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="statistics")
+
+	def _stop_executor(self):
+		if self.executor is None:
+			return
+
+		# probes still waiting for a thread are abandoned
+		self.executor.shutdown(wait=False, cancel_futures=True)
+		self.log.info("Thread pool stopped")
+
+	def _submit_statistics_task(self, miner):
+		future = self.executor.submit(_get_statistics_task, miner)
+		future.add_done_callback(lambda done, miner_id=miner.miner_id: self.__probe_done(miner_id, done))
+
+	def __probe_done(self, miner_id, future):
+		if future.cancelled():
+			return
+
+		e = future.exception()
+		if e is not None:
+			self.error_callback(miner_id, e)
+		else:
+			self.callback(future.result())
@@ -25,17 +25,31 @@ SOFTWARE.
 
 
 import sys
+import os
+import signal
 import argparse
 import getpass
 import logging
 import json
+import zlib
 import threading
 import miner_statistics
+import ssh_connection_pool
+import http_cache
+import statistics_history
+import statistics_history_file
+import event_stream
+import command_jobs
+import agent_reports
+import static_assets
+import prometheus_metrics
+import group_aggregates
+import time
 
 from multithread_http_server import MultiThreadHttpServer
+from async_http_server import AsyncHttpServer
 from mining_farm_http_handler import MiningFarmHTTPHandler
 from urllib.parse import urlparse, parse_qs
-from pathlib import Path
 from miner import MinerConfig
 from encryption import AESCipher
 
@@ -51,9 +65,33 @@ def set_log_level(log_level=None):
 	logging.getLogger("paramiko").setLevel(logging.WARNING)
 
 
+def get_shard(miner_config, shard_count):
+	"""Shard owning a miner of the farm file: its shard field if set, otherwise a stable hash of its id"""
+	shard = miner_config.get("shard")
+	if shard is None:
+		return zlib.crc32(miner_config["id"].encode("utf-8")) % shard_count
+	if not isinstance(shard, int) or shard < 0 or shard >= shard_count:
+		raise Exception("Invalid shard " + str(shard) + " for miner " + miner_config["id"] + " (" + str(shard_count) + " shards)")
+	return shard
+
+
+def parse_shard(shard):
+	"""Parse index/count, for example 0/3 for the first of 3 shards"""
+	try:
+		index, count = (int(value) for value in shard.split('/'))
+	except ValueError:
+		raise Exception("Invalid shard " + shard + ", expected index/count")
+	if count < 1 or index < 0 or index >= count:
+		raise Exception("Invalid shard " + shard + ", expected index/count")
+	return index, count
+
+
 class MiningFarm:
 
-	def __init__(self, html_repository, farm_config_path, password=None, bind="127.0.0.1:80", http_parallelism=5, stat_parallelism=2, stat_heartbeat=30, log=None):
+	def __init__(self, html_repository, farm_config_path, password=None, bind="127.0.0.1:80", http_parallelism=5, http_server="thread", stat_parallelism=2, stat_heartbeat=30, stat_healthy_heartbeat=None, stat_unhealthy_heartbeat=None, ssh_pool_size=64, ssh_idle_timeout=300, ssh_timeout=10, batch_probe=False, stat_engine="process", stat_concurrency=32, history_retention=86400, history_file=None, history_file_retention=30, command_parallelism=16, config_watch_interval=10, shard=None, log=None):
+		"""
+		:param shard: (index, count) to only manage the miners of one shard of the farm file, see get_shard. None for all
+		"""
 
 		self.stop_requested = False
 
@@ -63,77 +101,206 @@ class MiningFarm:
 			self.log = log
 
 		self.html_repository = html_repository
-		config_file = open(farm_config_path, 'r')
-		config = json.load(config_file)
-		config_file.close()
+		self.static_assets = static_assets.StaticAssetCache(html_repository)
+
+		if stat_engine == "asyncio":
+			self.log.warning("The asyncio statistics engine is now named thread")
+			stat_engine = "thread"
+		if stat_engine == "thread" and ssh_pool_size < stat_concurrency:
+			self.log.info("Raising ssh connection pool size to the statistics concurrency (" + str(stat_concurrency) + ")")
+			ssh_pool_size = stat_concurrency
+
+		# must be configured before building the miners as they lease their connections from the default pool
+		ssh_connection_pool.configure_default_pool({"max_connections": ssh_pool_size, "idle_timeout": ssh_idle_timeout, "connect_timeout": ssh_timeout})
+
+		self.farm_config_path = farm_config_path
+		self.batch_probe = batch_probe
+		self.shard = shard
+		self.config_watch_interval = config_watch_interval
+		self.config_lock = threading.Lock()
+		self.config_signature = MiningFarm.__get_config_signature(farm_config_path)
 		self.miners = []
+		self.miners_by_id = {}
 		self.stat_lock = threading.Lock()
-		self.cipher = None
-
-		miner_ids = []
-		for miner_config in config["miners"]:
-			config = MinerConfig(miner_id=miner_config["id"], host=self.__parse_sensitive_field(miner_config, "host", password), user=self.__parse_sensitive_field(miner_config, "user", password))
-
-			if config.miner_id in miner_ids:
-				raise Exception("Miner id "+config.miner_id+" already exists")
-			else:
-				miner_ids.append(config.miner_id)
-
-			config.password = self.__parse_sensitive_field(miner_config, "password", password)
-			config.private_key_path = self.__parse_sensitive_field(miner_config, "privateKeyPath", password)
-			config.start_command = self.__parse_sensitive_field(miner_config, "startCommand", password)
-			config.stop_command = self.__parse_sensitive_field(miner_config, "stopCommand", password)
-			config.version_command = self.__parse_sensitive_field(miner_config, "versionCommand", password)
-			config.reboot_command = self.__parse_sensitive_field(miner_config, "rebootCommand", password)
-			config.log_command = self.__parse_sensitive_field(miner_config, "logCommand", password)
+		self.status_response = (-1, None)  # (statistics generation, rendered /status response)
+		self.status_delta_responses = (-1, {})  # (statistics generation, since -> rendered /status?since= response)
+		self.instance = format(int(time.time() * 1000), 'x')  # seq restarts at 0 with the process, a delta needs the same instance
+		self.cipher = None  # kept to decrypt the farm file again on reload without asking for the password
 
+		for config in self.__load_miner_configs(password):
 			miner = config.build()
 			self.miners.append(miner)
+			self.miners_by_id[miner.miner_id] = miner
+		if shard is not None:
+			self.log.info("Managing " + str(len(self.miners)) + " miners of shard " + str(shard[0]) + "/" + str(shard[1]))
 
 		buffer = bind.split(':')
 		self.host = buffer[0].strip()
 		self.port = int(buffer[1].strip())
 		self.http_parallelism = http_parallelism
+		if http_server not in ("thread", "async"):
+			raise Exception("Unknown http server " + http_server)
+		self.http_server = http_server
+
+		if stat_engine == "thread":
+			self.statistic_pool = miner_statistics.ThreadStatisticsProcessingPool(self, stat_concurrency, stat_heartbeat, stat_healthy_heartbeat, stat_unhealthy_heartbeat)
+		elif stat_engine == "process":
+			self.statistic_pool = miner_statistics.StatisticsProcessingPool(self, stat_parallelism, stat_heartbeat, stat_healthy_heartbeat, stat_unhealthy_heartbeat)
+		else:
+			raise Exception("Unknown statistics engine " + stat_engine)
+
+		self.history = None
+		if history_retention > 0:
+			shortest_heartbeat = min([stat_heartbeat, self.statistic_pool.healthy_heartbeat, self.statistic_pool.unhealthy_heartbeat] + [miner.heartbeat for miner in self.miners if miner.heartbeat is not None])
+			capacity = int(history_retention / max(1, shortest_heartbeat)) + 1
+			self.log.info("Keeping " + str(capacity) + " samples of history per miner")
+			self.history = statistics_history.StatisticsHistory(capacity)
+			self.statistic_pool.add_listener(self.history.statistics_updated)
+
+		self.metrics = prometheus_metrics.PrometheusMetrics()
+		self.statistic_pool.add_listener(self.metrics.statistics_updated)
+
+		self.groups = group_aggregates.GroupAggregates(self)
+		self.statistic_pool.add_listener(self.groups.statistics_updated)
 
-		self.statistic_pool = miner_statistics.StatisticsProcessingPool(self, stat_parallelism, stat_heartbeat)
+		self.event_stream = event_stream.EventStreamBroadcaster()
+		self.statistic_pool.add_listener(self.event_stream.statistics_updated)
+
+		self.agent_reports = agent_reports.AgentReports(self, self.statistic_pool)
+
+		self.command_jobs = command_jobs.CommandJobManager(self, command_parallelism)
+		self.statistic_pool.add_listener(self.command_jobs.statistics_updated)
+		self.command_jobs.add_listener(self.__job_updated)
+
+		self.history_file = None
+		if history_file is not None:
+			self.history_file = statistics_history_file.StatisticsHistoryFile(history_file, retention=history_file_retention * 86400)
+			self.statistic_pool.add_listener(self.history_file.statistics_updated)
 
 	def start(self):
+		if self.history_file is not None:
+			self.history_file.start()
+		self.event_stream.start()
 		self.statistic_pool.start()
+		if self.config_watch_interval > 0:
+			threading.Thread(target=self.__watch_config, daemon=True).start()
 		self.start_server()
 
 	def stop(self):
 		self.stop_requested = True
 		self.statistic_pool.stop()
+		self.command_jobs.stop()
+		self.event_stream.stop()
+		if self.history_file is not None:
+			self.history_file.stop()
 
 	def start_server(self):
-		self.log.info("Binding server to "+self.host+":"+str(self.port))
-		server = MultiThreadHttpServer((self.host, self.port), self.http_parallelism, MiningFarmHTTPHandler, request_callback=self.http_handler)
+		self.log.info("Binding " + self.http_server + " server to "+self.host+":"+str(self.port))
+		if self.http_server == "async":
+			server = AsyncHttpServer((self.host, self.port), self.http_parallelism, MiningFarmHTTPHandler, request_callback=self.http_handler, cached_response_callback=self.get_cached_response)
+		else:
+			server = MultiThreadHttpServer((self.host, self.port), self.http_parallelism, MiningFarmHTTPHandler, request_callback=self.http_handler)
 		server.start()
 
-	def get_miner(self, miner_id):
-		for miner in self.miners:
-			if miner.miner_id == miner_id:
-				return miner
+	def get_cached_response(self, path):
+		"""
+		AsyncHttpServer cached_response_callback: (response, Cache-Control) of /status and of the static assets when
+		they are rendered and up to date, None otherwise. Does not block
+		"""
+		url = urlparse(path)
+		if url.path.upper() == "/STATUS" and len(url.query) == 0:
+			generation, response = self.status_response
+			if generation == self.statistic_pool.get_statistics_generation():
+				return response, "no-cache"
+		elif static_assets.StaticAssetCache.is_static(url.path):
+			asset = self.static_assets.get_cached(url.path)
+			if asset is not None:
+				return asset, self.static_assets.get_cache_control(asset)
 		return None
 
+	def get_miner(self, miner_id):
+		return self.miners_by_id.get(miner_id)
+
 	def get_miners(self):
 		copy = []
 		copy.extend(self.miners)
 		return copy
 
+	def select_miners(self, ids=None, tag=None):
+		"""Return the miners whose id is in ids (in that order) or tagged with tag, all the miners if both are None"""
+		if ids is not None:
+			return [self.miners_by_id[miner_id] for miner_id in ids if miner_id in self.miners_by_id]
+		if tag is not None:
+			return [miner for miner in self.miners if tag in miner.tags]
+		return self.get_miners()
+
+	def execute_command(self, miner, command):
+		"""Run start, stop, restart or reboot on the miner and return True on success"""
+		command = command.lower()
+		if command == "start":
+			success = miner.start()
+		elif command == "stop":
+			success = miner.stop()
+		elif command == "restart":
+			success = miner.stop() and miner.start()
+		elif command == "reboot":
+			success = miner.reboot()
+		else:
+			raise ValueError("Unknown command " + command)
+
+		if success:
+			self.clear_statistics(miner.miner_id)
+		return success
+
 	def get_statistics(self, *args):
 		if len(args) >= 1:
 			return self.statistic_pool.get_statistics(args[0])
 
+		generation, snapshot = self.statistic_pool.get_versioned_statistics_snapshot()
+		return self.__get_farm_statistics(generation, snapshot)
+
+	def get_statistics_delta(self, since, instance):
+		"""
+		Return the statistics updated after the sequence number since, the ids of the miners removed since then and
+		the new sequence number. The totals are only included if they may have changed.
+		Return None if the delta cannot be computed (since comes from another instance, is unknown or too old): the
+		client must reload the full status
+		"""
+		if instance != self.instance:
+			return None
+
+		generation, snapshot = self.statistic_pool.get_versioned_statistics_snapshot()
+		if since < 0 or since > generation:
+			return None
+
+		removed = self.statistic_pool.get_removed_statistics(since, generation)
+		if removed is None:
+			return None
+
+		farm_statistics = self.__get_farm_statistics(generation, snapshot, since)
+		farm_statistics["since"] = since
+		farm_statistics["removed"] = removed
+
+		if len(farm_statistics["farm"]) == 0 and len(removed) == 0:
+			for field in ("totalHPS", "totalSolved", "solvingRate"):
+				del farm_statistics[field]
+
+		return farm_statistics
+
+	def __get_farm_statistics(self, generation, snapshot, since=None):
+		"""Compute the farm totals from snapshot, listing the statuses updated after since (all of them if None)"""
 		farm_statistics = {}
+		farm_statistics["instance"] = self.instance
+		farm_statistics["seq"] = generation
 		farm_statistics["totalHPS"] = 0
 		farm_statistics["totalSolved"] = 0
 		solving_count = 0
+		status_count = 0
 		statuses = []
 		farm_statistics["farm"] = statuses
 
 		for miner in self.miners:
-			status = self.get_statistics(miner.miner_id)
+			status = snapshot.get(miner.miner_id)
 			if status is None:
 				continue
 
@@ -146,43 +313,258 @@ class MiningFarm:
 			if "solving" in status and status["solving"]:
 				solving_count += 1
 
-			statuses.append(status)
+			status_count += 1
+			if since is None or status.get("seq", 0) > since:
+				statuses.append(status)
 
-		if len(statuses) > 0:
-			farm_statistics["solvingRate"] = 100 * float(solving_count / len(statuses))
+		if status_count > 0:
+			farm_statistics["solvingRate"] = 100 * float(solving_count / status_count)
 		else:
 			farm_statistics["solvingRate"] = 0
 
 		return farm_statistics
 
+	def get_status_response(self):
+		"""Return the /status response, rendered once per statistics generation"""
+		generation, response = self.status_response
+		current_generation = self.statistic_pool.get_statistics_generation()
+		if generation == current_generation:
+			return response
+
+		self.stat_lock.acquire()
+		try:
+			generation, response = self.status_response
+			if generation != current_generation:
+				body = bytes(json.dumps(self.get_statistics(), indent=4), "utf-8")
+				response = http_cache.CachedResponse(body, 'application/json')
+				self.status_response = (current_generation, response)
+			return response
+		finally:
+			self.stat_lock.release()
+
+	MAX_STATUS_DELTA_RESPONSES = 64  # /status?since= responses cached per generation
+
+	def get_status_delta_response(self, since, instance):
+		"""Return the /status?since= response, rendered once per statistics generation and since. None if unavailable"""
+		if instance != self.instance:
+			return None
+
+		generation, responses = self.status_delta_responses
+		current_generation = self.statistic_pool.get_statistics_generation()
+		if generation == current_generation and since in responses:
+			return responses[since]
+
+		delta = self.get_statistics_delta(since, instance)
+		if delta is None:
+			return None
+
+		response = http_cache.CachedResponse(bytes(json.dumps(delta, separators=(',', ':')), "utf-8"), 'application/json')
+
+		self.stat_lock.acquire()
+		try:
+			generation, responses = self.status_delta_responses
+			if generation != delta["seq"]:
+				generation, responses = delta["seq"], {}
+			if len(responses) < MiningFarm.MAX_STATUS_DELTA_RESPONSES:
+				responses[since] = response
+			self.status_delta_responses = (generation, responses)
+		finally:
+			self.stat_lock.release()
+
+		return response
+
+	def get_history(self, miner_id, start, end, step=None):
+		"""Read the history from memory, or from the history file when the memory does not go back to start"""
+		if self.history is not None and (self.history_file is None or self.history.covers(miner_id, start)):
+			return self.history.query(miner_id, start, end, step)
+		if self.history_file is not None:
+			return self.history_file.query(miner_id, start, end, step)
+		return None
+
+	# fields of MinerConfig used to open the ssh connections
+	CONNECTION_FIELDS = ("host", "user", "password", "private_key_path")
+	# fields of MinerConfig changing the statistics collected by a probe
+	PROBE_FIELDS = CONNECTION_FIELDS + ("version_command", "log_command", "log_file", "batch_probe", "heartbeat")
+
+	def reload_config(self):
+		"""
+		Apply the changes of the farm file without restarting: added miners are scheduled over a heartbeat, removed
+		miners are forgotten and changed miners are rebuilt. The statistics, history, pooled connections and schedule of
+		the miners left unchanged are kept. Return the ids of the added, removed and changed miners
+		"""
+		self.config_lock.acquire()
+		try:
+			self.config_signature = MiningFarm.__get_config_signature(self.farm_config_path)
+			configs = self.__load_miner_configs(interactive=False)
+
+			added = []
+			changed = []
+			miners = []
+			miners_by_id = {}
+			for config in configs:
+				previous_miner = self.miners_by_id.get(config.miner_id)
+				if previous_miner is not None and vars(previous_miner.config) == vars(config):
+					miner = previous_miner
+				else:
+					miner = config.build()
+					if previous_miner is None:
+						added.append(miner)
+					else:
+						changed.append((previous_miner, miner))
+				miners.append(miner)
+				miners_by_id[miner.miner_id] = miner
+			removed = [miner for miner in self.miners if miner.miner_id not in miners_by_id]
+
+			self.miners_by_id = miners_by_id
+			self.miners = miners
+
+			for miner in removed:
+				self.statistic_pool.remove_statistics(miner.miner_id)
+				self.__close_unused_connections(miner)
+
+			for previous_miner, miner in changed:
+				previous_config = vars(previous_miner.config)
+				new_config = vars(miner.config)
+				if previous_config["host"] == new_config["host"] and previous_config["log_file"] == new_config["log_file"]:
+					miner.set_state(previous_miner.get_state())
+				else:
+					self.statistic_pool.forget_miner_state(miner.miner_id)
+				if any(previous_config[field] != new_config[field] for field in MiningFarm.CONNECTION_FIELDS):
+					self.__close_unused_connections(previous_miner)
+				if any(previous_config[field] != new_config[field] for field in MiningFarm.PROBE_FIELDS):
+					self.statistic_pool.request_probe(miner.miner_id)
+				if previous_config["tags"] != new_config["tags"]:
+					self.groups.update_tags(miner.miner_id)
+
+			if len(added) > 0 or len(removed) > 0:
+				self.statistic_pool.reconcile()
+
+			self.log.info("Farm file reloaded: " + str(len(added)) + " miners added, " + str(len(removed)) + " removed, " + str(len(changed)) + " changed")
+			return {"added": [miner.miner_id for miner in added], "removed": [miner.miner_id for miner in removed],
+					"changed": [miner.miner_id for previous_miner, miner in changed], "miners": len(miners)}
+		finally:
+			self.config_lock.release()
+
+	def request_reload(self):
+		"""Reload the farm file from another thread, for the signal handlers"""
+		threading.Thread(target=self.__try_reload_config, daemon=True).start()
+
+	def __try_reload_config(self):
+		try:
+			self.reload_config()
+		except Exception as e:
+			self.log.error("Farm file not reloaded, keeping the current miners: " + str(e))
+
+	def __watch_config(self):
+		"""Reload the farm file when its modification time or size changes"""
+		while not self.stop_requested:
+			time.sleep(self.config_watch_interval)
+			if MiningFarm.__get_config_signature(self.farm_config_path) != self.config_signature:
+				self.log.info("Farm file " + self.farm_config_path + " modified")
+				self.__try_reload_config()
+
+	@staticmethod
+	def __get_config_signature(farm_config_path):
+		try:
+			stat = os.stat(farm_config_path)
+			return stat.st_mtime_ns, stat.st_size
+		except OSError:
+			return None
+
+	def __close_unused_connections(self, miner):
+		"""Close the idle ssh connections of a miner that left or changed, unless another miner uses them"""
+		if any(other.host == miner.host and other.user == miner.user for other in self.miners):
+			return
+		ssh_connection_pool.get_default_pool().close(miner.host, miner.user)
+
 	def clear_statistics(self, miner_id):
 		self.statistic_pool.init_statistics(miner_id)
+		self.statistic_pool.request_probe(miner_id)
 
 	def http_handler(self, http_request):
 
 		url = urlparse(http_request.path)
 
-		if len(url.path) <= 1:
+		if http_request.command != "GET" and url.path.upper() != "/REPORT":
+			http_request.send_response(405)
+			http_request.end_headers()
+		elif len(url.path) <= 1:
 			http_request.send_response(301)
 			http_request.send_header('Location', "/dashboard.html?refresh=10000")
 			http_request.end_headers()
-		elif url.path.upper().endswith(".HTML"):
-			html_page = Path(MINING_FARM.html_repository + url.path)
-			if html_page.is_file():
-				self.log.info("Serving HTML page " + str(html_page.absolute()))
-				http_request.send_response(200)
-				http_request.send_header('Content-type', 'text/html')
-				http_request.end_headers()
-				http_request.wfile.write(html_page.absolute().read_bytes())
+		elif static_assets.StaticAssetCache.is_static(url.path):
+			asset = self.static_assets.get(url.path)
+			if asset is not None:
+				self.static_assets.send(http_request, asset)
 			else:
-				self.log.info("HTML file " + url.path + " not found")
+				self.log.debug("Static file " + url.path + " not found")
 				http_request.send_response(404)
+				http_request.end_headers()
 		elif url.path.upper() == "/STATUS":
+			since = MiningFarm.__get_parameter(url.query, 'since')
+			response = None
+			if since is not None:
+				try:
+					response = self.get_status_delta_response(int(since), MiningFarm.__get_parameter(url.query, 'instance'))
+				except ValueError:
+					http_request.send_response(400)
+					http_request.send_header('Content-type', 'application/json')
+					http_request.end_headers()
+					http_request.wfile.write(bytes("{\"error\": \"Invalid parameter\"}", "utf-8"))
+					return
+
+			if response is None:
+				response = self.get_status_response()
+			http_cache.send_cached_response(http_request, response)
+		elif url.path.upper() == "/REPORT":
+			error = (405, "Reports must be sent with POST")
+			if http_request.command == "POST":
+				body, error = http_request.read_body(agent_reports.MAX_REPORT_SIZE)
+				if error is None:
+					error = self.agent_reports.ingest(body, http_request.headers.get(agent_reports.SIGNATURE_HEADER))
+
+			if error is None:
+				http_request.send_response(204)
+				http_request.end_headers()
+			else:
+				http_request.send_response(error[0])
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps({"error": error[1]}), "utf-8"))
+		elif url.path.upper() == "/GROUPS":
+			http_cache.send_cached_response(http_request, self.groups.get_response())
+		elif url.path.upper() == "/METRICS":
+			http_cache.send_cached_response(http_request, self.metrics.get_response())
+		elif url.path.upper() == "/INTERNAL/PROBES":
+			miner_id = MiningFarm.__get_parameter(url.query, 'id')
+			report = self.statistic_pool.get_probe_report(miner_id)
+			if report is not None and miner_id is None:
+				report["agentReports"] = self.agent_reports.get_counters()
+
+			if report is None:
+				http_request.send_response(400)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes("{\"error\": \"Miner not probed\"}", "utf-8"))
+			else:
+				http_request.send_response(200)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps(report, indent=4), "utf-8"))
+		elif url.path.upper() == "/RELOAD":
+			try:
+				changes = self.reload_config()
+			except Exception as e:
+				http_request.send_response(400)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps({"error": "Farm file not reloaded: " + str(e)}), "utf-8"))
+				return
+
 			http_request.send_response(200)
 			http_request.send_header('Content-type', 'application/json')
 			http_request.end_headers()
-			farm_statistics = self.get_statistics()
-			http_request.wfile.write(bytes(json.dumps(farm_statistics, indent=4), "utf-8"))
+			http_request.wfile.write(bytes(json.dumps(changes, indent=4), "utf-8"))
 		elif url.path.upper() == "/MINER":
 			miner_id = MiningFarm.__get_parameter(url.query, 'id')
 			miner = self.get_miner(miner_id)
@@ -198,6 +580,49 @@ class MiningFarm:
 				http_request.end_headers()
 				statistics = self.get_statistics(miner.miner_id)
 				http_request.wfile.write(bytes(json.dumps(statistics, indent=4), "utf-8"))
+		elif url.path.upper() == "/STREAM":
+			miner_id = MiningFarm.__get_parameter(url.query, 'id')
+
+			if miner_id is not None and self.get_miner(miner_id) is None:
+				http_request.send_response(400)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes("{\"error\": \"Miner not found\"}", "utf-8"))
+			elif self.event_stream.is_full():
+				http_request.send_response(503)
+				http_request.end_headers()
+			else:
+				http_request.send_response(200)
+				http_request.send_header('Content-type', 'text/event-stream')
+				http_request.send_header('Cache-Control', 'no-cache')
+				http_request.end_headers()
+				self.event_stream.add_client(http_request.detach_connection(), lambda: self.__get_initial_events(miner_id), miner_id)
+		elif url.path.upper() == "/HISTORY":
+			miner_id = MiningFarm.__get_parameter(url.query, 'id')
+			history = None
+			if self.get_miner(miner_id) is not None:
+				try:
+					end = float(MiningFarm.__get_parameter(url.query, 'to') or time.time())
+					start = float(MiningFarm.__get_parameter(url.query, 'from') or end - 3600)
+					step = MiningFarm.__get_parameter(url.query, 'step')
+					history = self.get_history(miner_id, start, end, None if step is None else float(step))
+				except ValueError:
+					http_request.send_response(400)
+					http_request.send_header('Content-type', 'application/json')
+					http_request.end_headers()
+					http_request.wfile.write(bytes("{\"error\": \"Invalid parameter\"}", "utf-8"))
+					return
+
+			if history is None:
+				http_request.send_response(400)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes("{\"error\": \"History not found\"}", "utf-8"))
+			else:
+				http_request.send_response(200)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps(history, separators=(',', ':')), "utf-8"))
 		elif url.path.upper() == "/COMMAND":
 			miner_id = MiningFarm.__get_parameter(url.query, 'id')
 			miner = self.get_miner(miner_id)
@@ -209,45 +634,136 @@ class MiningFarm:
 				http_request.wfile.write(bytes("{\"error\": \"Miner not found\"}", "utf-8"))
 			else:
 				command = MiningFarm.__get_parameter(url.query, 'cmd')
-				if command is None:
+				if command is None or command.lower() not in command_jobs.COMMANDS:
 					http_request.send_response(400)
 					http_request.send_header('Content-type', 'application/json')
 					http_request.end_headers()
 					http_request.wfile.write(bytes("{\"error\": \"Command not found\"}", "utf-8"))
-				elif command.upper() == "START":
-					if miner.start():
-						http_request.send_response(200)
-						self.clear_statistics(miner.miner_id)
-					else:
-						http_request.send_response(500)
-				elif command.upper() == "STOP":
-					if miner.stop():
-						http_request.send_response(200)
-						self.clear_statistics(miner.miner_id)
-					else:
-						http_request.send_response(500)
-				elif command.upper() == "REBOOT":
-					if miner.reboot():
-						http_request.send_response(200)
-						self.clear_statistics(miner.miner_id)
 				else:
-					http_request.send_response(400)
-					http_request.send_header('Content-type', 'application/json')
-					http_request.end_headers()
-					http_request.wfile.write(bytes("{\"error\": \"Command not found\"}", "utf-8"))
+					job = self.command_jobs.submit(command.lower(), [miner.miner_id], 1)
+					self.__send_job_accepted(http_request, job)
+		elif url.path.upper() == "/BULK":
+			command = MiningFarm.__get_parameter(url.query, 'cmd')
+			ids = MiningFarm.__get_parameter(url.query, 'ids')
+			tag = MiningFarm.__get_parameter(url.query, 'tag')
+			error = None
+			try:
+				concurrency = int(MiningFarm.__get_parameter(url.query, 'concurrency') or 10)
+				rolling = int(MiningFarm.__get_parameter(url.query, 'rolling') or 0)
+				rolling_timeout = int(MiningFarm.__get_parameter(url.query, 'timeout') or 900)
+			except ValueError:
+				error = "Invalid parameter"
+
+			if error is None:
+				if command is None or command.lower() not in command_jobs.COMMANDS:
+					error = "Command not found"
+				elif ids is None and tag is None and MiningFarm.__get_parameter(url.query, 'all') != "true":
+					error = "Select the miners with ids, tag or all=true"
+				elif rolling > 0 and command.lower() == "stop":
+					error = "Rolling mode requires start, restart or reboot"
+
+			miners = []
+			if error is None:
+				miners = self.select_miners(None if ids is None else ids.split(','), tag)
+				if len(miners) == 0:
+					error = "Miner not found"
+
+			if error is not None:
+				http_request.send_response(400)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps({"error": error}), "utf-8"))
+			else:
+				job = self.command_jobs.submit(command.lower(), [miner.miner_id for miner in miners], concurrency, rolling, rolling_timeout)
+				self.__send_job_accepted(http_request, job)
+		elif url.path.upper() == "/JOB":
+			job_id = MiningFarm.__get_parameter(url.query, 'id')
+			job = self.command_jobs.get_jobs() if job_id is None else self.command_jobs.get_job(job_id)
+
+			if job is None:
+				http_request.send_response(404)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.end_headers()
+				http_request.wfile.write(bytes("{\"error\": \"Job not found\"}", "utf-8"))
+			else:
+				http_request.send_response(200)
+				http_request.send_header('Content-type', 'application/json')
+				http_request.send_header('Cache-Control', 'no-cache')
+				http_request.end_headers()
+				http_request.wfile.write(bytes(json.dumps(job, indent=4), "utf-8"))
 		else:
 			http_request.send_response(404)
 
+	def __send_job_accepted(self, http_request, job):
+		http_request.send_response(202)
+		http_request.send_header('Content-type', 'application/json')
+		http_request.send_header('Location', "/job?id=" + job.job_id)
+		http_request.end_headers()
+		http_request.wfile.write(bytes(json.dumps(self.command_jobs.get_job(job.job_id), indent=4), "utf-8"))
+
+	def __job_updated(self, job, miner_progress):
+		"""CommandJobManager listener, streams the progress of the jobs to the /stream clients"""
+		if self.event_stream.client_count > 0:
+			event = {"jobId": job.job_id, "command": job.command, "state": job.state}
+			if miner_progress is not None:
+				event["miner"] = miner_progress
+			self.event_stream.publish("job", event)
+
+	def __get_initial_events(self, miner_id):
+		"""First events of a /stream connection: the whole farm status, or the statistics of miner_id"""
+		initial_events = b"retry: 5000\n\n"
+		if miner_id is None:
+			return initial_events + event_stream.format_event("status", self.get_statistics())
+
+		statistics = self.get_statistics(miner_id)
+		if statistics is not None:
+			initial_events += event_stream.format_event("miner", statistics)
+		return initial_events
+
 	@staticmethod
 	def __get_parameter(query, parameter_id):
-		params = parse_qs(query)[parameter_id]
+		params = parse_qs(query).get(parameter_id, [])
 
 		if len(params) != 1:  # params is a list
 			return None
 		else:
 			return params[0]
 
-	def __parse_sensitive_field(self, miner_config, field_name, password):
+	def __load_miner_configs(self, password=None, interactive=True):
+		"""Parse the farm file into a list of MinerConfig, in file order"""
+		config_file = open(self.farm_config_path, 'r')
+		config = json.load(config_file)
+		config_file.close()
+		configs = []
+		miner_ids = set()
+
+		for miner_config in config["miners"]:
+			if miner_config["id"] in miner_ids:
+				raise Exception("Miner id "+miner_config["id"]+" already exists")
+			miner_ids.add(miner_config["id"])
+
+			if self.shard is not None and get_shard(miner_config, self.shard[1]) != self.shard[0]:
+				continue  # managed by another instance
+
+			config = MinerConfig(miner_id=miner_config["id"], host=self.__parse_sensitive_field(miner_config, "host", password, interactive), user=self.__parse_sensitive_field(miner_config, "user", password, interactive))
+
+			config.password = self.__parse_sensitive_field(miner_config, "password", password, interactive)
+			config.private_key_path = self.__parse_sensitive_field(miner_config, "privateKeyPath", password, interactive)
+			config.start_command = self.__parse_sensitive_field(miner_config, "startCommand", password, interactive)
+			config.stop_command = self.__parse_sensitive_field(miner_config, "stopCommand", password, interactive)
+			config.version_command = self.__parse_sensitive_field(miner_config, "versionCommand", password, interactive)
+			config.reboot_command = self.__parse_sensitive_field(miner_config, "rebootCommand", password, interactive)
+			config.log_command = self.__parse_sensitive_field(miner_config, "logCommand", password, interactive)
+			config.log_file = self.__parse_sensitive_field(miner_config, "logFile", password, interactive)
+			config.batch_probe = bool(miner_config.get("batchProbe", self.batch_probe))
+			config.heartbeat = miner_config.get("heartbeat")
+			config.tags = miner_config.get("tags", [])
+			config.agent_key = self.__parse_sensitive_field(miner_config, "agentKey", password, interactive)
+			configs.append(config)
+
+		return configs
+
+	def __parse_sensitive_field(self, miner_config, field_name, password, interactive=True):
 
 		if field_name in miner_config and miner_config[field_name] is not None:
 			return miner_config[field_name]
@@ -257,8 +773,10 @@ class MiningFarm:
 
 				if self.cipher is None:  # check cipher
 					if password is None:
+						if not interactive:
+							raise Exception("Encrypted field " + field_name + " but the farm was started without password")
 						password = getpass.getpass("Farm configuration file password:")
-						self.cipher = AESCipher(password)
+					self.cipher = AESCipher(password)
 
 				return self.cipher.decrypt_as_string(miner_config[encrypted_field_name])  # decrypt field
 
@@ -273,8 +791,23 @@ if __name__ == '__main__':
 	parser.add_argument('-pwd', dest="password", default=None, help="Farm configuration file password")
 	parser.add_argument('-b', dest="bind", default="127.0.0.1:80", help="Host to bind")
 	parser.add_argument('-hp', dest="http_parallelism", type=int, default=5, help="Number of http handlers")
+	parser.add_argument('-hs', dest="http_server", default="thread", choices=["thread", "async"], help="HTTP server: one blocking thread per connection, or a selector with HTTP/1.1 keep-alive and -hp worker threads")
 	parser.add_argument('-sp', dest="stat_parallelism", type=int, default=3,  help="Number of process for statistics computing")
 	parser.add_argument('-sh', dest="stat_heartbeat", type=int, default=30, help="Delay between statistic computation in seconds")
+	parser.add_argument('-shh', dest="stat_healthy_heartbeat", type=int, default=None, help="Delay between statistic computation of the miners running in cycle (defaults to -sh)")
+	parser.add_argument('-shu', dest="stat_unhealthy_heartbeat", type=int, default=None, help="Delay between statistic computation of the miners stopped or out of cycle (defaults to -sh)")
+	parser.add_argument('-se', dest="stat_engine", default="process", choices=["process", "thread", "asyncio"], help="Statistics engine: process pool, or thread pool of the manager process reusing the ssh connections (asyncio is the former name of thread)")
+	parser.add_argument('-sc', dest="stat_concurrency", type=int, default=32, help="Number of probe threads, hence of concurrent probes, of the thread statistics engine")
+	parser.add_argument('-hr', dest="history_retention", type=int, default=86400, help="Seconds of statistics history kept in memory per miner (0 to disable)")
+	parser.add_argument('-hf', dest="history_file", default=None, help="Statistics history file, kept across restarts")
+	parser.add_argument('-hfr', dest="history_file_retention", type=int, default=30, help="Days of statistics history kept in the history file")
+	parser.add_argument('-pc', dest="ssh_pool_size", type=int, default=64, help="Maximum number of pooled ssh connections per process")
+	parser.add_argument('-pi', dest="ssh_idle_timeout", type=int, default=300, help="Delay in seconds before an idle ssh connection is closed")
+	parser.add_argument('-st', dest="ssh_timeout", type=int, default=10, help="Timeout in seconds of the ssh connection and authentication")
+	parser.add_argument('-bp', dest="batch_probe", action="store_true", help="Collect statistics with a single remote script per miner (can be overridden by batchProbe in the farm file)")
+	parser.add_argument('-cp', dest="command_parallelism", type=int, default=16, help="Maximum number of miner commands (start, stop, reboot) running at the same time")
+	parser.add_argument('-cw', dest="config_watch_interval", type=int, default=10, help="Seconds between two checks of the farm file, reloaded when modified (0 to disable). SIGHUP and /reload also reload it")
+	parser.add_argument('-sd', dest="shard", default=None, help="Only manage one shard of the farm file, as index/count (example: 0/3). Miners are assigned by their shard field or a hash of their id")
 	parser.add_argument('-ll', dest="log_level", type=str, default="INFO", help="Log level (DEBUG, INFO, WARNING, WARN, ERROR)")
 
 	args = parser.parse_args(sys.argv[1:])
@@ -296,7 +829,9 @@ if __name__ == '__main__':
 
 	log = logging.getLogger("farm")
 	try:
-		MINING_FARM = MiningFarm(args.html_repository, args.farm_file, args.password, args.bind, http_parallelism=args.http_parallelism, stat_parallelism=args.stat_parallelism, stat_heartbeat=args.stat_heartbeat, log=log)
+		MINING_FARM = MiningFarm(args.html_repository, args.farm_file, args.password, args.bind, http_parallelism=args.http_parallelism, http_server=args.http_server, stat_parallelism=args.stat_parallelism, stat_heartbeat=args.stat_heartbeat, stat_healthy_heartbeat=args.stat_healthy_heartbeat, stat_unhealthy_heartbeat=args.stat_unhealthy_heartbeat, ssh_pool_size=args.ssh_pool_size, ssh_idle_timeout=args.ssh_idle_timeout, ssh_timeout=args.ssh_timeout, batch_probe=args.batch_probe, stat_engine=args.stat_engine, stat_concurrency=args.stat_concurrency, history_retention=args.history_retention, history_file=args.history_file, history_file_retention=args.history_file_retention, command_parallelism=args.command_parallelism, config_watch_interval=args.config_watch_interval, shard=None if args.shard is None else parse_shard(args.shard), log=log)
+		if hasattr(signal, "SIGHUP"):
+			signal.signal(signal.SIGHUP, lambda signum, frame: MINING_FARM.request_reload())
 		MINING_FARM.start()
 	except KeyboardInterrupt:
 		MINING_FARM.stop()
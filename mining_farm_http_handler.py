@@ -24,6 +24,7 @@ SOFTWARE.
 """
 
 
+import socket
 from http.server import BaseHTTPRequestHandler
 
 
@@ -36,3 +37,57 @@ class MiningFarmHTTPHandler(BaseHTTPRequestHandler):
 	def do_GET(self):
 		"""Use handler_method from mining farm"""
 		self.server.request_callback(self)
+
+	# Handler for the POST requests (agent reports)
+	def do_POST(self):
+		self.server.request_callback(self)
+
+	BODY_TIMEOUT = 10  # seconds a client has to send the request body
+
+	def read_body(self, max_size):
+		"""
+		Return (body, None), or (None, (http status, error)) if the Content-Length is missing, invalid or larger than
+		max_size bytes, or if the body is not received within BODY_TIMEOUT seconds
+		"""
+		length = self.headers.get('Content-Length')
+		error = None
+		if length is None:
+			error = (411, "Content-Length required")
+		elif not length.strip().isdigit():
+			error = (400, "Invalid Content-Length")
+		elif int(length) > max_size:
+			error = (413, "Request body too large")
+		if error is not None:
+			self.close_connection = True  # the body is not read
+			return None, error
+
+		# a slow or stalled client must not hold a server thread, a socket with a shorter timeout (or non-blocking) is kept as is
+		timeout = self.connection.gettimeout()
+		if timeout is None or timeout > MiningFarmHTTPHandler.BODY_TIMEOUT:
+			self.connection.settimeout(MiningFarmHTTPHandler.BODY_TIMEOUT)
+		try:
+			body = self.rfile.read(int(length))
+		except socket.timeout:
+			body = None
+		finally:
+			self.connection.settimeout(timeout)
+
+		if body is None or len(body) < int(length):
+			self.close_connection = True
+			return None, (408, "Request body not received")
+		return body, None
+
+	def detach_connection(self):
+		"""
+		Take the connection away from the server once the headers are sent: it is neither closed nor reused when the
+		request handling returns. The caller becomes responsible for closing it.
+		"""
+		self.wfile.flush()
+		self.close_connection = True
+		self.server.detach_request(self.connection)
+		return self.connection
+
+	def send_file(self, file, count):
+		"""Send count bytes of the open file after the headers, without copying them in user space when possible"""
+		self.wfile.flush()
+		self.connection.sendfile(file, 0, count)
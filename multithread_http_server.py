@@ -70,6 +70,7 @@ class ConnectionHandler(threading.Thread, HTTPServer):
 		self.server_bind = self.server_close = lambda self: None
 		self.HTTPHandler = HTTPHandler
 		self.request_callback = request_callback
+		self.detached_requests = set()  # only accessed by this thread
 
 		threading.Thread.__init__(self)
 		self.daemon = True
@@ -77,3 +78,12 @@ class ConnectionHandler(threading.Thread, HTTPServer):
 	def run(self):
 		self.serve_forever()  # each thread process request forever
 
+	def detach_request(self, request):
+		self.detached_requests.add(request)
+
+	def shutdown_request(self, request):
+		if request in self.detached_requests:
+			self.detached_requests.discard(request)  # now owned by whoever detached it
+			return
+		HTTPServer.shutdown_request(self, request)
+
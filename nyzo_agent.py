@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+# Agent running next to nyzoVerifier: collects the statistics of the verifier locally and pushes them to the manager,
+# which then only connects over ssh for the commands or when the agent stops reporting.
+# Requires verifier_report.py, verifier_log_parser.py and agent_reports.py next to it (no third party module).
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+import urllib.request
+import urllib.error
+import agent_reports
+import verifier_report
+
+
+CMD_TIMEOUT = 20  # timeout in seconds of the local commands
+
+
+def run(command):
+	"""Return (stdout, stderr) of a shell command, like the ssh probes"""
+	try:
+		result = subprocess.run(command, shell=True, stdin=subprocess.DEVNULL, capture_output=True, timeout=CMD_TIMEOUT)
+		return result.stdout.decode("utf-8", errors="replace"), result.stderr.decode("utf-8", errors="replace")
+	except subprocess.TimeoutExpired:
+		return "", "Timed out: " + command
+
+
+def read_log_tail(log_file, cursor):
+	"""
+	Return (stdout, stderr) in the format of the log tail command of the ssh probes: "inode start size" followed by the
+	bytes appended since the cursor, from the start if the log was rotated or truncated, at most LOG_TAIL_MAX_BYTES
+	"""
+	try:
+		with open(log_file, 'rb') as f:
+			stat = os.fstat(f.fileno())
+			inode = str(stat.st_ino)
+			size = stat.st_size
+			offset = 0
+			if cursor is not None and cursor["inode"] == inode and size >= cursor["offset"]:
+				offset = cursor["offset"]
+			offset = max(offset, size - verifier_report.LOG_TAIL_MAX_BYTES)
+			f.seek(offset)
+			data = f.read(size - offset)
+	except OSError as e:
+		return "", str(e)
+
+	return inode + " " + str(offset) + " " + str(size) + "\n" + data.decode("utf-8", errors="replace"), ""
+
+
+def collect(args, cursor, log):
+	"""Return the report of the verifier and the new log cursor"""
+	outputs = {"cpu": run(verifier_report.CPU_COMMAND),
+			   "version": run(args.version_command),
+			   "processes": run(verifier_report.PROCESSES_COMMAND)}
+	if args.log_file is None and args.log_command is not None:
+		outputs["log"] = run(args.log_command)
+
+	report = verifier_report.build_report(outputs, log)
+
+	if args.log_file is not None:
+		stdout_str, stderr_str = read_log_tail(args.log_file, cursor)
+		if len(stderr_str) > 0:
+			report["error_logs"] = stderr_str
+			log.warning("Error while reading logs: " + stderr_str)
+		else:
+			cursor = verifier_report.parse_log_tail(stdout_str, cursor, report, log)
+
+	return report, cursor
+
+
+def push(url, key, body, timeout):
+	request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": "application/json", agent_reports.SIGNATURE_HEADER: agent_reports.sign(key, body)})
+	with urllib.request.urlopen(request, timeout=timeout) as response:
+		response.read()
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Nyzo manager agent, pushes the statistics of the local verifier to the manager')
+	parser.add_argument('manager', help="Url of the manager (example: http://192.168.1.1:80)")
+	parser.add_argument('miner_id', help="Id of this miner in the farm file")
+	parser.add_argument('-kf', dest="key_file", default=None, help="File holding the agentKey of the miner (default: NYZO_AGENT_KEY environment variable)")
+	parser.add_argument('-i', dest="interval", type=float, default=30, help="Seconds between two reports")
+	parser.add_argument('-vc', dest="version_command", default="grep final /home/ubuntu/nyzoVerifier/src/main/java/co/nyzo/verifier/Version.java", help="Command printing the verifier version")
+	parser.add_argument('-lf', dest="log_file", default=None, help="Verifier log, only the lines appended since the previous report are parsed")
+	parser.add_argument('-lc', dest="log_command", default=None, help="Command printing the end of the verifier log, if -lf is not set")
+	parser.add_argument('-t', dest="timeout", type=float, default=10, help="Timeout in seconds of the requests to the manager")
+	parser.add_argument('-ll', dest="log_level", type=str, default="INFO", help="Log level (DEBUG, INFO, WARNING, WARN, ERROR)")
+
+	args = parser.parse_args(sys.argv[1:])
+	logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO))
+	log = logging.getLogger("agent")
+
+	if args.key_file is not None:
+		with open(args.key_file) as f:
+			key = f.read().strip()
+	else:
+		key = os.environ.get("NYZO_AGENT_KEY")
+	if not key:
+		log.error("No agent key, set it with -kf or NYZO_AGENT_KEY")
+		sys.exit(-1)
+
+	url = args.manager.rstrip("/") + "/report"
+	cursor = None
+	failing = False
+	log.info("Reporting the statistics of " + args.miner_id + " to " + url + " every " + str(args.interval) + " sec")
+
+	next_report = time.time()
+	while True:
+		start = time.time()
+		try:
+			stat, cursor = collect(args, cursor, log)
+			body = json.dumps({"minerId": args.miner_id, "timestamp": time.time(), "interval": args.interval, "duration": time.time() - start, "stat": stat}, separators=(',', ':')).encode("utf-8")
+			push(url, key, body, args.timeout)
+			if failing:
+				log.info("Reports accepted again")
+			failing = False
+		except urllib.error.HTTPError as e:
+			log.error("Report rejected: " + str(e.code) + " " + e.read().decode("utf-8", errors="replace"))
+			failing = True
+		except Exception as e:
+			log.error("Report failed: " + type(e).__name__ + ": " + str(e))
+			failing = True
+
+		next_report = max(next_report + args.interval, time.time())  # no burst of reports after a pause
+		time.sleep(max(0, next_report - time.time()))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import bisect
+import threading
+
+
+# upper bounds in seconds of the histogram buckets, the last bucket is unbounded
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# phases of a probe, in order:
+# queue: submitted to the statistics engine -> probe started
+# lease: connection taken from the ssh pool (includes connect and auth when the pool has no idle connection)
+# connect, auth: TCP connection and ssh handshake with authentication, only on new connections
+# cpu, version, processes, log, logTail, batch: remote commands (batch replaces them with -bp)
+# parse: parsing of the outputs
+# total: whole probe, queue excluded
+PHASES = ("queue", "lease", "connect", "auth", "cpu", "version", "processes", "log", "logTail", "batch", "parse", "total")
+
+
+class LatencyHistogram:
+
+	def __init__(self):
+		self.counts = [0] * (len(BUCKETS) + 1)
+		self.count = 0
+		self.sum = 0
+		self.max = 0
+
+	def record(self, seconds):
+		self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+		self.count += 1
+		self.sum += seconds
+		self.max = max(self.max, seconds)
+
+	def percentile(self, q):
+		"""Estimate of the q quantile (0 < q <= 1), interpolated within its bucket"""
+		if self.count == 0:
+			return None
+
+		rank = q * self.count
+		cumulative = 0
+		for i, count in enumerate(self.counts):
+			if count > 0 and cumulative + count >= rank:
+				lower = BUCKETS[i - 1] if i > 0 else 0
+				upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+				return min(self.max, lower + (upper - lower) * (rank - cumulative) / count)
+			cumulative += count
+		return self.max
+
+	def to_json(self, buckets=False):
+		summary = {"count": self.count, "mean": self.sum / self.count if self.count > 0 else None, "max": self.max,
+					"p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99)}
+		if buckets:
+			summary["buckets"] = {str(bound): count for bound, count in zip(BUCKETS + ("+Inf",), self.counts)}
+		return summary
+
+
+class ProbeInstrumentation:
+	"""Latency histograms of the phases of the probes, farm-wide and per miner, fed by the statistics engine"""
+
+	def __init__(self):
+		self.phases = {}  # phase -> LatencyHistogram
+		self.miners = {}  # miner id -> phase -> LatencyHistogram
+		self.probes = 0
+		self.failures = 0
+		self.lock = threading.Lock()
+
+	def record(self, miner_id, timings, failed=False):
+		"""Record the phases timed during a probe of miner_id, timings being a dict phase -> seconds"""
+		self.lock.acquire()
+		try:
+			self.probes += 1
+			if failed:
+				self.failures += 1
+
+			miner_phases = self.miners.get(miner_id)
+			if miner_phases is None:
+				miner_phases = {}
+				self.miners[miner_id] = miner_phases
+
+			for phase, seconds in timings.items():
+				if phase not in PHASES:
+					continue
+				histogram = self.phases.get(phase)
+				if histogram is None:
+					histogram = LatencyHistogram()
+					self.phases[phase] = histogram
+				histogram.record(seconds)
+
+				histogram = miner_phases.get(phase)
+				if histogram is None:
+					histogram = LatencyHistogram()
+					miner_phases[phase] = histogram
+				histogram.record(seconds)
+		finally:
+			self.lock.release()
+
+	def remove(self, miner_id):
+		self.lock.acquire()
+		try:
+			self.miners.pop(miner_id, None)
+		finally:
+			self.lock.release()
+
+	def get_phases(self):
+		"""Farm-wide histograms, phase -> summary with the bucket counts"""
+		self.lock.acquire()
+		try:
+			return {phase: self.phases[phase].to_json(buckets=True) for phase in PHASES if phase in self.phases}
+		finally:
+			self.lock.release()
+
+	def get_miner_phases(self, miner_id):
+		"""Histograms of a miner, phase -> summary, or None if the miner was never probed"""
+		self.lock.acquire()
+		try:
+			miner_phases = self.miners.get(miner_id)
+			if miner_phases is None:
+				return None
+			return {phase: miner_phases[phase].to_json(buckets=True) for phase in PHASES if phase in miner_phases}
+		finally:
+			self.lock.release()
+
+	def get_slowest_miners(self, count=20, phase="total"):
+		"""The count miners with the highest 90th percentile of phase, as (miner id, summary)"""
+		self.lock.acquire()
+		try:
+			histograms = [(miner_id, miner_phases[phase]) for miner_id, miner_phases in self.miners.items() if phase in miner_phases]
+			histograms.sort(key=lambda item: item[1].percentile(0.9), reverse=True)
+			return [(miner_id, histogram.to_json()) for miner_id, histogram in histograms[:count]]
+		finally:
+			self.lock.release()
+
+	def get_counters(self):
+		self.lock.acquire()
+		try:
+			return {"probes": self.probes, "failedProbes": self.failures}
+		finally:
+			self.lock.release()
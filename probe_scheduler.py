@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class ProbeScheduler:
+	"""
+	Priority queue of the miners keyed by the time their next probe is due.
+	Rescheduling a miner pushes a new entry and leaves the previous one in the heap: stale entries are recognized by
+	their sequence number and skipped when they reach the top, so every operation is O(log n).
+	"""
+
+	LATENESS_SMOOTHING = 0.1  # weight of the latest sample in the average lateness
+
+	def __init__(self, jitter=0.1):
+		"""
+		:param jitter: fraction of the interval randomly added or removed so the probes of miners scheduled together drift apart
+		"""
+		self.jitter = jitter
+		self.heap = []  # (due time, sequence number, miner id)
+		self.entries = {}  # miner id -> sequence number of its live heap entry
+		self.due_times = {}  # miner id -> due time of its live heap entry
+		self.sequence = itertools.count()
+		self.condition = threading.Condition()
+
+		self.dispatched = 0
+		self.last_lateness = 0
+		self.max_lateness = 0
+		self.average_lateness = 0
+
+	def schedule(self, miner_id, delay, jitter=True):
+		"""(Re)schedule the next probe of miner_id in delay seconds, replacing the one already scheduled"""
+		if jitter and self.jitter > 0:
+			delay += random.uniform(-self.jitter, self.jitter) * delay
+		self.schedule_at(miner_id, time.time() + max(0, delay))
+
+	def schedule_at(self, miner_id, due_time):
+		self.condition.acquire()
+		try:
+			sequence = next(self.sequence)
+			self.entries[miner_id] = sequence
+			self.due_times[miner_id] = due_time
+			heapq.heappush(self.heap, (due_time, sequence, miner_id))
+			self.__compact()
+			if self.heap[0][1] == sequence:
+				self.condition.notify()  # the waiting thread must wake up earlier
+		finally:
+			self.condition.release()
+
+	def stagger(self, miner_ids, window):
+		"""Schedule miner_ids evenly over the next window seconds instead of all at once"""
+		miner_ids = list(miner_ids)
+		random.shuffle(miner_ids)
+		now = time.time()
+		for position, miner_id in enumerate(miner_ids):
+			self.schedule_at(miner_id, now + window * position / len(miner_ids))
+
+	def remove(self, miner_id):
+		self.condition.acquire()
+		try:
+			self.entries.pop(miner_id, None)
+			self.due_times.pop(miner_id, None)
+		finally:
+			self.condition.release()
+
+	def is_scheduled(self, miner_id):
+		return miner_id in self.entries
+
+	def get_scheduled_ids(self):
+		self.condition.acquire()
+		try:
+			return list(self.entries)
+		finally:
+			self.condition.release()
+
+	def wait_due(self, timeout):
+		"""
+		Block until probes are due, timeout expires or wakeup is called, then return the ids of the miners due (possibly
+		none). The returned miners are unscheduled: the caller must schedule them again
+		"""
+		self.condition.acquire()
+		try:
+			self.__discard_stale()
+			now = time.time()
+			if len(self.heap) == 0 or self.heap[0][0] > now:
+				wait = timeout
+				if len(self.heap) > 0:
+					wait = min(wait, self.heap[0][0] - now)
+				if wait > 0:
+					self.condition.wait(wait)
+				self.__discard_stale()
+				now = time.time()
+
+			return self.__pop_due(now)
+		finally:
+			self.condition.release()
+
+	def wakeup(self):
+		self.condition.acquire()
+		try:
+			self.condition.notify_all()
+		finally:
+			self.condition.release()
+
+	def get_counters(self):
+		"""Queue depth and lateness (seconds between the due time and the dispatch of a probe)"""
+		self.condition.acquire()
+		try:
+			now = time.time()
+			overdue = 0
+			if len(self.heap) > 0 and self.heap[0][0] <= now:
+				overdue = sum(1 for due_time in self.due_times.values() if due_time <= now)
+
+			return {"scheduled": len(self.entries), "overdue": overdue, "heapSize": len(self.heap), "dispatched": self.dispatched,
+					"lastLateness": self.last_lateness, "averageLateness": self.average_lateness, "maxLateness": self.max_lateness}
+		finally:
+			self.condition.release()
+
+	def __pop_due(self, now):
+		due = []
+		while len(self.heap) > 0 and self.heap[0][0] <= now:
+			due_time, sequence, miner_id = heapq.heappop(self.heap)
+			if self.entries.get(miner_id) != sequence:
+				continue
+
+			del self.entries[miner_id]
+			del self.due_times[miner_id]
+			due.append(miner_id)
+			self.__record_lateness(now - due_time)
+
+		return due
+
+	def __discard_stale(self):
+		while len(self.heap) > 0 and self.entries.get(self.heap[0][2]) != self.heap[0][1]:
+			heapq.heappop(self.heap)
+
+	def __compact(self):
+		# rescheduling leaves stale entries behind, rebuild once they outnumber the live ones
+		if len(self.heap) > 2 * len(self.entries) + 64:
+			self.heap = [(self.due_times[miner_id], sequence, miner_id) for miner_id, sequence in self.entries.items()]
+			heapq.heapify(self.heap)
+
+	def __record_lateness(self, lateness):
+		self.dispatched += 1
+		self.last_lateness = lateness
+		self.max_lateness = max(self.max_lateness, lateness)
+		self.average_lateness += ProbeScheduler.LATENESS_SMOOTHING * (lateness - self.average_lateness)
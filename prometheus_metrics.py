@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import threading
+import time
+import http_cache
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name, help, function of the statistic returning the value or None if unknown
+MINER_METRICS = [
+	("nyzo_miner_info", "Host and verifier version of the miner",
+		lambda stat: 1 if "host" in stat else None),
+	("nyzo_miner_cpu_load_percent", "Load average of the miner host over 1 minute, in percent",
+		lambda stat: _to_float(stat.get("cpu"))),
+	("nyzo_miner_frozen_block_height", "Height of the last block frozen by the verifier",
+		lambda stat: _to_float(stat.get("hps"))),
+	("nyzo_miner_for_height", "Height of the block the verifier is fetching or voting on (last \"for height\" log line)",
+		lambda stat: _to_float(stat.get("forHeight"))),
+	("nyzo_miner_log_frozen_blocks", "Blocks frozen in the verifier log read by the last probe",
+		lambda stat: stat.get("frozenBlocks")),
+	("nyzo_miner_log_lines", "Verifier log lines read by the last probe",
+		lambda stat: stat.get("logLines")),
+	("nyzo_miner_in_cycle", "1 if the verifier is in cycle",
+		lambda stat: _to_bool(stat.get("in_cycle"))),
+	("nyzo_miner_verifier_running", "1 if the verifier process is running",
+		lambda stat: _to_bool(stat.get("nyzoVerifier"))),
+	("nyzo_miner_last_probe_timestamp_seconds", "Time of the last successful probe (its age is time() - value)",
+		lambda stat: stat.get("timestamp") or None),
+	("nyzo_miner_probe_duration_seconds", "Duration of the last successful probe",
+		lambda stat: stat.get("probeDuration")),
+	("nyzo_miner_probe_failures", "Consecutive failed probes of the miner host",
+		lambda stat: stat.get("failures", 0) if "error" in stat else 0),
+]
+
+
+def _to_float(value):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return None
+
+
+def _to_bool(value):
+	if value is None or value == "None":
+		return None
+	return 1 if value == 'True' or value is True else 0
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+	if isinstance(value, bool):
+		return "1" if value else "0"
+	if isinstance(value, int):
+		return str(value)
+	return repr(float(value))
+
+
+class PrometheusMetrics:
+	"""
+	Prometheus text exposition of the miner statistics, maintained by a statistics listener: an update only
+	re-renders the lines of the updated miner, and a scrape joins the lines of the metrics that changed since the
+	previous scrape. The response is rendered at most once per update.
+	"""
+
+	def __init__(self):
+		self.lines = {name: {} for name, help_text, value in MINER_METRICS}  # metric name -> miner id -> sample line
+		self.headers = {name: "# HELP " + name + " " + help_text + "\n# TYPE " + name + " gauge\n" for name, help_text, value in MINER_METRICS}
+		self.blocks = {}  # metric name -> rendered block, dropped when a line of the metric changes
+		self.states = {}  # miner id -> (in cycle, running, failing)
+		self.counts = [0, 0, 0]
+		self.generation = 0
+		self.instance = format(int(time.time() * 1000), 'x')  # keeps the etags of a restarted farm distinct
+		self.response = (-1, None)
+		self.lock = threading.Lock()
+
+	def statistics_updated(self, previous_stat, stat):
+		"""StatisticsProcessingPool listener. stat is None when the miner is removed"""
+		self.lock.acquire()
+		try:
+			if stat is None:
+				miner_id = previous_stat["minerId"]
+				for name, help_text, value in MINER_METRICS:
+					if self.lines[name].pop(miner_id, None) is not None:
+						self.blocks.pop(name, None)
+				self.__update_state(miner_id, None)
+			else:
+				miner_id = stat["minerId"]
+				labels = "{miner=\"" + _escape(miner_id) + "\"} "
+				info_labels = "{miner=\"" + _escape(miner_id) + "\",host=\"" + _escape(stat.get("host", "")) + "\",version=\"" + _escape(stat.get("version", "")) + "\"} "
+				for name, help_text, value in MINER_METRICS:
+					sample = value(stat)
+					line = None if sample is None else name + (info_labels if name == "nyzo_miner_info" else labels) + _format_value(sample) + "\n"
+					if self.lines[name].get(miner_id) != line:
+						if line is None:
+							del self.lines[name][miner_id]
+						else:
+							self.lines[name][miner_id] = line
+						self.blocks.pop(name, None)
+				self.__update_state(miner_id, (stat.get("in_cycle") == 'True', stat.get("nyzoVerifier") == 'True', "error" in stat))
+			self.generation += 1
+		finally:
+			self.lock.release()
+
+	def get_response(self):
+		"""Return the /metrics response as an http_cache.CachedResponse"""
+		self.lock.acquire()
+		try:
+			if self.response[0] == self.generation:
+				return self.response[1]
+
+			chunks = []
+			for name, help_text, value in MINER_METRICS:
+				block = self.blocks.get(name)
+				if block is None:
+					block = self.headers[name] + "".join(self.lines[name].values())
+					self.blocks[name] = block
+				chunks.append(block)
+
+			chunks.append(PrometheusMetrics.__farm_gauge("nyzo_farm_miners", "Miners with statistics", len(self.states)))
+			chunks.append(PrometheusMetrics.__farm_gauge("nyzo_farm_miners_in_cycle", "Miners in cycle", self.counts[0]))
+			chunks.append(PrometheusMetrics.__farm_gauge("nyzo_farm_miners_running", "Miners running the verifier", self.counts[1]))
+			chunks.append(PrometheusMetrics.__farm_gauge("nyzo_farm_miners_failing", "Miners whose last probe failed", self.counts[2]))
+
+			# the body changes on nearly every probe: skip hashing it and favor compression speed
+			etag = '"' + self.instance + "-" + str(self.generation) + '"'
+			response = http_cache.CachedResponse(bytes("".join(chunks), "utf-8"), CONTENT_TYPE, etag=etag, compresslevel=1)
+			self.response = (self.generation, response)
+			return response
+		finally:
+			self.lock.release()
+
+	def __update_state(self, miner_id, state):
+		previous_state = self.states.pop(miner_id, None)
+		if previous_state is not None:
+			for i in range(3):
+				self.counts[i] -= previous_state[i]
+		if state is not None:
+			self.states[miner_id] = state
+			for i in range(3):
+				self.counts[i] += state[i]
+
+	@staticmethod
+	def __farm_gauge(name, help_text, value):
+		return "# HELP " + name + " " + help_text + "\n# TYPE " + name + " gauge\n" + name + " " + str(value) + "\n"
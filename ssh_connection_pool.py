@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import time
+import socket
+import logging
+import threading
+import contextlib
+import paramiko
+
+
+class SSHConnectionPool:
+
+	def __init__(self, max_connections=64, idle_timeout=300, keepalive_interval=15, connect_timeout=10, log=None):
+		"""
+		:param max_connections: maximum number of open ssh connections (leased + idle)
+		:param idle_timeout: idle connections older than this delay (in seconds) are closed
+		:param keepalive_interval: delay in seconds between keepalive packets sent on pooled transports
+		:param connect_timeout: timeout in seconds of each step of a new connection (TCP connect, ssh banner, authentication)
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("SSHConnectionPool")
+		else:
+			self.log = log
+
+		self.max_connections = max_connections
+		self.idle_timeout = idle_timeout
+		self.keepalive_interval = keepalive_interval
+		self.connect_timeout = connect_timeout
+
+		self.idle_connections = {}  # key -> list of (ssh_session, release time)
+		self.leased_connections = {}  # ssh_session -> key
+		self.open_connections = 0
+		self.private_keys = {}  # private key path -> parsed key
+		self.lock = threading.Condition(threading.RLock())
+
+		self.hits = 0
+		self.misses = 0
+		self.reconnects = 0
+		self.evictions = 0
+
+	@contextlib.contextmanager
+	def connection(self, host, username, password=None, prv_key_file=None, log=None, timings=None):
+		"""Lease a connection for the duration of the with block. The connection is discarded if the block raises"""
+		ssh_session = self.lease(host, username, password=password, prv_key_file=prv_key_file, log=log, timings=timings)
+		try:
+			yield ssh_session
+		except BaseException:
+			self.release(ssh_session, discard=True)
+			raise
+		else:
+			self.release(ssh_session)
+
+	def lease(self, host, username, password=None, prv_key_file=None, log=None, timings=None):
+		"""
+		Return an open connection to host, reusing an idle one if possible.
+		If timings is a dict, the time spent is recorded in seconds under "lease", and for a new connection under
+		"connect" (TCP) and "auth" (ssh handshake and authentication)
+		"""
+		start = time.time()
+		hostname, port = SSHConnectionPool.__parse_host(host)
+		key = (hostname, port, username)
+
+		self.lock.acquire()
+		try:
+			self.__evict_expired()
+
+			while True:
+				idle = self.idle_connections.get(key)
+				if idle:
+					ssh_session, released = idle.pop()
+					if len(idle) == 0:
+						del self.idle_connections[key]
+
+					if SSHConnectionPool.__is_alive(ssh_session):
+						self.hits += 1
+						self.leased_connections[ssh_session] = key
+						if timings is not None:
+							timings["lease"] = time.time() - start
+						return ssh_session
+
+					# the transport died while idle (remote restart, network failure...)
+					self.reconnects += 1
+					self.__close(ssh_session)
+					continue
+
+				if self.open_connections < self.max_connections:
+					self.open_connections += 1
+					self.misses += 1
+					break
+
+				if not self.__evict_oldest_idle():
+					self.lock.wait()
+		finally:
+			self.lock.release()
+
+		try:
+			ssh_session = self.__connect(hostname, port, username, password, prv_key_file, log, timings)
+		except BaseException:
+			self.lock.acquire()
+			try:
+				self.open_connections -= 1
+				self.lock.notify()
+			finally:
+				self.lock.release()
+			raise
+
+		self.lock.acquire()
+		try:
+			self.leased_connections[ssh_session] = key
+		finally:
+			self.lock.release()
+
+		if timings is not None:
+			timings["lease"] = time.time() - start
+		return ssh_session
+
+	def release(self, ssh_session, discard=False):
+		self.lock.acquire()
+		try:
+			key = self.leased_connections.pop(ssh_session, None)
+			if key is None:
+				self.log.warning("Releasing a connection that was not leased from the pool")
+				ssh_session.close()
+				return
+
+			if discard or not SSHConnectionPool.__is_alive(ssh_session):
+				self.__close(ssh_session)
+			else:
+				self.idle_connections.setdefault(key, []).append((ssh_session, time.time()))
+
+			self.lock.notify()
+		finally:
+			self.lock.release()
+
+	def evict_idle(self):
+		"""Close the idle connections that exceeded the idle timeout"""
+		self.lock.acquire()
+		try:
+			self.__evict_expired()
+		finally:
+			self.lock.release()
+
+	def close(self, host=None, username=None):
+		"""Close the idle connections of host/username, or every idle connection if host is None"""
+		self.lock.acquire()
+		try:
+			for key in list(self.idle_connections.keys()):
+				if host is not None and (key[0], key[1]) != SSHConnectionPool.__parse_host(host):
+					continue
+				if username is not None and key[2] != username:
+					continue
+
+				for ssh_session, released in self.idle_connections.pop(key):
+					self.__close(ssh_session)
+		finally:
+			self.lock.release()
+
+	def get_counters(self):
+		self.lock.acquire()
+		try:
+			idle = 0
+			for connections in self.idle_connections.values():
+				idle += len(connections)
+
+			return {"hits": self.hits, "misses": self.misses, "reconnects": self.reconnects, "evictions": self.evictions,
+					"open": self.open_connections, "idle": idle, "leased": len(self.leased_connections)}
+		finally:
+			self.lock.release()
+
+	def __evict_expired(self):
+		if self.idle_timeout is None:
+			return
+
+		limit = time.time() - self.idle_timeout
+		for key in list(self.idle_connections.keys()):
+			connections = self.idle_connections[key]
+			kept = []
+			for ssh_session, released in connections:
+				if released < limit:
+					self.evictions += 1
+					self.__close(ssh_session)
+				else:
+					kept.append((ssh_session, released))
+
+			if len(kept) > 0:
+				self.idle_connections[key] = kept
+			else:
+				del self.idle_connections[key]
+
+	def __evict_oldest_idle(self):
+		oldest_key = None
+		oldest_index = None
+		oldest_release = None
+		for key, connections in self.idle_connections.items():
+			for index, (ssh_session, released) in enumerate(connections):
+				if oldest_release is None or released < oldest_release:
+					oldest_key, oldest_index, oldest_release = key, index, released
+
+		if oldest_key is None:
+			return False
+
+		connections = self.idle_connections[oldest_key]
+		ssh_session, released = connections.pop(oldest_index)
+		if len(connections) == 0:
+			del self.idle_connections[oldest_key]
+
+		self.evictions += 1
+		self.__close(ssh_session)
+		return True
+
+	def __close(self, ssh_session):
+		self.open_connections -= 1
+		try:
+			ssh_session.close()
+		except Exception as e:
+			self.log.debug("Error while closing connection: " + str(e))
+
+	def __connect(self, host, port, username, password, prv_key_file, log, timings=None):
+		ssh_session = paramiko.SSHClient()
+		ssh_session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+		# open the socket here so the TCP connection and the ssh handshake can be timed separately
+		start = time.time()
+		sock = socket.create_connection((host, port), timeout=self.connect_timeout)
+		connected = time.time()
+		# a probe is a sequence of small request/response exchanges, don't let Nagle hold them back waiting for ACKs
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		try:
+			if prv_key_file is None:
+				if log is not None:
+					log.debug("Connecting to " + host + ":" + str(port) + " using password...")
+
+				ssh_session.connect(hostname=host, port=port, username=username, password=password, sock=sock, timeout=self.connect_timeout, banner_timeout=self.connect_timeout, auth_timeout=self.connect_timeout)
+			else:
+				if log is not None:
+					log.debug("Connecting to " + host + ":" + str(port) + " using private key...")
+
+				ssh_session.connect(hostname=host, port=port, username=username, pkey=self.__get_private_key(prv_key_file), sock=sock, timeout=self.connect_timeout, banner_timeout=self.connect_timeout, auth_timeout=self.connect_timeout)
+		except BaseException:
+			ssh_session.close()
+			sock.close()
+			raise
+
+		if timings is not None:
+			timings["connect"] = connected - start
+			timings["auth"] = time.time() - connected
+
+		if self.keepalive_interval is not None and self.keepalive_interval > 0:
+			ssh_session.get_transport().set_keepalive(self.keepalive_interval)
+
+		if log is not None:
+			log.debug("Connected")
+
+		return ssh_session
+
+	def __get_private_key(self, prv_key_file):
+		self.lock.acquire()
+		try:
+			pk = self.private_keys.get(prv_key_file)
+			if pk is None:
+				pk = paramiko.RSAKey.from_private_key_file(prv_key_file)
+				self.private_keys[prv_key_file] = pk
+			return pk
+		finally:
+			self.lock.release()
+
+	@staticmethod
+	def __is_alive(ssh_session):
+		transport = ssh_session.get_transport()
+		return transport is not None and transport.is_active()
+
+	@staticmethod
+	def __parse_host(host):
+		port = 22
+		if ":" in host:
+			buffer = host.split(':')
+			host = buffer[0]
+			port = int(buffer[1])
+		return host, port
+
+
+DEFAULT_POOL_SETTINGS = {}
+_DEFAULT_POOL = None
+_DEFAULT_POOL_PID = None
+_DEFAULT_POOL_LOCK = threading.Lock()
+
+
+def configure_default_pool(settings):
+	"""Set the SSHConnectionPool parameters (dict of keyword arguments) used by get_default_pool(). Can be used as a process pool initializer"""
+	global _DEFAULT_POOL
+	DEFAULT_POOL_SETTINGS.clear()
+	DEFAULT_POOL_SETTINGS.update(settings)
+	_DEFAULT_POOL = None
+
+
+def get_default_pool():
+	"""Return the connection pool of the current process. Transports are not inherited across a fork"""
+	global _DEFAULT_POOL, _DEFAULT_POOL_PID
+
+	_DEFAULT_POOL_LOCK.acquire()
+	try:
+		if _DEFAULT_POOL is None or _DEFAULT_POOL_PID != os.getpid():
+			_DEFAULT_POOL = SSHConnectionPool(**DEFAULT_POOL_SETTINGS)
+			_DEFAULT_POOL_PID = os.getpid()
+		return _DEFAULT_POOL
+	finally:
+		_DEFAULT_POOL_LOCK.release()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import gzip
+import time
+import logging
+import threading
+import http_cache
+from urllib.parse import unquote
+
+
+CONTENT_TYPES = {
+	".html": "text/html; charset=utf-8",
+	".js": "application/javascript; charset=utf-8",
+	".css": "text/css; charset=utf-8",
+	".svg": "image/svg+xml",
+	".png": "image/png",
+	".jpg": "image/jpeg",
+	".jpeg": "image/jpeg",
+	".gif": "image/gif",
+	".ico": "image/x-icon",
+	".woff2": "font/woff2",
+}
+
+COMPRESSIBLE_TYPES = (".html", ".js", ".css", ".svg")
+
+
+class StaticAsset:
+
+	def __init__(self, path, extension, stat):
+		self.path = path
+		self.content_type = CONTENT_TYPES[extension]
+		self.mtime = stat.st_mtime
+		self.size = stat.st_size
+		self.last_modified = stat.st_mtime
+		self.etag = '"' + format(int(stat.st_mtime * 1000), 'x') + "-" + format(stat.st_size, 'x') + '"'
+		self.checked = time.time()  # last time the file was compared with the disk
+
+		self.body = None  # None if the file is sent from disk
+		self.gzip_body = None
+		self.gzip_path = None  # pre-compressed variant sent from disk
+		self.gzip_size = None
+
+	def is_stale(self, stat):
+		return stat.st_mtime != self.mtime or stat.st_size != self.size
+
+
+class StaticAssetCache:
+	"""
+	Files of the html repository, loaded at startup and kept in memory with their gzip variant. A file is compared with
+	the disk at most every revalidate_interval seconds and reloaded when its mtime or size changed. Files larger than
+	max_memory_size are not kept in memory and are sent with sendfile. A file.gz next to a file is used as its gzip
+	variant instead of compressing it.
+	"""
+
+	def __init__(self, repository, max_memory_size=262144, revalidate_interval=2, max_age=300, log=None):
+		"""
+		:param max_memory_size: size in bytes above which a file is sent from disk
+		:param revalidate_interval: seconds between two checks of the modification time of a file
+		:param max_age: seconds the browsers can reuse the assets (except html pages, always revalidated)
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("StaticAssetCache")
+		else:
+			self.log = log
+
+		self.repository = os.path.realpath(repository)
+		self.max_memory_size = max_memory_size
+		self.revalidate_interval = revalidate_interval
+		self.max_age = max_age
+		self.assets = {}  # url path -> StaticAsset
+		self.lock = threading.Lock()
+
+		self.load()
+
+	@staticmethod
+	def is_static(url_path):
+		return os.path.splitext(url_path)[1].lower() in CONTENT_TYPES
+
+	def load(self):
+		"""Load every asset of the repository"""
+		count = 0
+		for directory, directories, files in os.walk(self.repository):
+			for name in files:
+				path = os.path.join(directory, name)
+				url_path = "/" + os.path.relpath(path, self.repository).replace(os.sep, "/")
+				if StaticAssetCache.is_static(url_path) and self.__reload(url_path, path) is not None:
+					count += 1
+		self.log.info("Loaded " + str(count) + " static assets from " + self.repository)
+
+	def get(self, url_path):
+		"""Return the up to date StaticAsset of url_path, or None if there is no such file"""
+		self.lock.acquire()
+		try:
+			asset = self.assets.get(url_path)
+		finally:
+			self.lock.release()
+
+		if asset is not None and time.time() - asset.checked < self.revalidate_interval:
+			return asset
+
+		path = self.__resolve(url_path)
+		if path is None:
+			return None
+
+		try:
+			stat = os.stat(path)
+		except OSError:
+			stat = None
+
+		if asset is not None and stat is not None and not asset.is_stale(stat):
+			asset.checked = time.time()
+			return asset
+
+		return self.__reload(url_path, path)
+
+	def get_cached(self, url_path):
+		"""Return the StaticAsset of url_path if it is in memory and was compared with the disk recently, None otherwise. No I/O"""
+		self.lock.acquire()
+		try:
+			asset = self.assets.get(url_path)
+		finally:
+			self.lock.release()
+
+		if asset is None or asset.body is None or time.time() - asset.checked >= self.revalidate_interval:
+			return None
+		return asset
+
+	def get_cache_control(self, asset):
+		return "no-cache" if asset.content_type.startswith("text/html") else "max-age=" + str(self.max_age)
+
+	def send(self, http_request, asset):
+		"""Send asset, or 304 if the client copy is still valid"""
+		cache_control = self.get_cache_control(asset)
+
+		if asset.body is not None:
+			http_cache.send_cached_response(http_request, asset, cache_control)
+			return
+
+		if http_cache.is_not_modified(http_request, asset):
+			http_request.send_response(304)
+			http_cache.send_validators(http_request, asset, cache_control)
+			http_request.end_headers()
+			return
+
+		path = asset.path
+		size = asset.size
+		http_request.send_response(200)
+		http_request.send_header('Content-type', asset.content_type)
+		http_cache.send_validators(http_request, asset, cache_control)
+		if asset.gzip_path is not None:
+			http_request.send_header('Vary', 'Accept-Encoding')
+			if http_cache.accepts_gzip(http_request):
+				path = asset.gzip_path
+				size = asset.gzip_size
+				http_request.send_header('Content-Encoding', 'gzip')
+		http_request.send_header('Content-Length', str(size))
+		http_request.end_headers()
+
+		with open(path, 'rb') as f:
+			http_request.send_file(f, size)
+
+	def __resolve(self, url_path):
+		"""Path of url_path in the repository, None if it points outside"""
+		path = os.path.realpath(os.path.join(self.repository, unquote(url_path).lstrip("/")))
+		if not path.startswith(self.repository + os.sep):
+			return None
+		return path
+
+	def __reload(self, url_path, path):
+		try:
+			stat = os.stat(path)
+			extension = os.path.splitext(path)[1].lower()
+			asset = StaticAsset(path, extension, stat)
+
+			gzip_path = path + ".gz"
+			gzip_stat = None
+			if os.path.isfile(gzip_path):
+				gzip_stat = os.stat(gzip_path)
+				if gzip_stat.st_mtime < stat.st_mtime:
+					self.log.warning("Ignoring " + gzip_path + ", older than " + path)
+					gzip_stat = None
+
+			if stat.st_size <= self.max_memory_size:
+				with open(path, 'rb') as f:
+					asset.body = f.read()
+				if gzip_stat is not None:
+					with open(gzip_path, 'rb') as f:
+						asset.gzip_body = f.read()
+				elif extension in COMPRESSIBLE_TYPES and stat.st_size >= http_cache.CachedResponse.GZIP_MIN_SIZE:
+					asset.gzip_body = gzip.compress(asset.body, compresslevel=9, mtime=0)
+			elif gzip_stat is not None:
+				asset.gzip_path = gzip_path
+				asset.gzip_size = gzip_stat.st_size
+		except OSError:
+			asset = None
+
+		self.lock.acquire()
+		try:
+			if asset is None:
+				if self.assets.pop(url_path, None) is not None:
+					self.log.info("Static asset " + url_path + " removed")
+			else:
+				self.log.debug("Static asset " + url_path + " loaded (" + str(asset.size) + " bytes)")
+				self.assets[url_path] = asset
+		finally:
+			self.lock.release()
+
+		return asset
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import array
+import bisect
+import math
+import threading
+import logging
+
+
+FIELDS = ("cpu", "frozenBlock", "inCycle", "running")
+
+
+def get_history_sample(stat):
+	"""Return (timestamp, cpu, frozen block, in cycle, running) from a statistic, or None if it holds no new probe result"""
+
+	if stat is None or stat.get("timestamp", 0) <= 0 or "cpu" not in stat or "error" in stat:
+		return None
+
+	try:
+		frozen_block = int(stat.get("hps", 0))
+	except (TypeError, ValueError):
+		frozen_block = 0
+
+	return stat["timestamp"], float(stat["cpu"]), frozen_block, _to_flag(stat.get("in_cycle")), _to_flag(stat.get("nyzoVerifier"))
+
+
+def _to_flag(value):
+	if value is True or value == 'True':
+		return 1
+	if value is False or value == 'False':
+		return 0
+	return -1  # unknown
+
+
+class MinerHistory:
+	"""Fixed capacity ring buffer of samples, about 18 bytes per sample"""
+
+	def __init__(self, capacity):
+		self.capacity = capacity
+		self.start = 0
+		self.count = 0
+		self.timestamps = array.array('d', bytes(8 * capacity))
+		self.cpu = array.array('f', bytes(4 * capacity))
+		self.frozen_blocks = array.array('I', bytes(4 * capacity))  # 0 -> unknown
+		self.in_cycle = array.array('b', bytes(capacity))  # 1, 0 or -1 -> unknown
+		self.running = array.array('b', bytes(capacity))
+
+	def append(self, timestamp, cpu, frozen_block, in_cycle, running):
+		if self.count > 0 and timestamp <= self.timestamps[self.__index(self.count - 1)]:
+			return False  # samples are kept in time order
+
+		if self.count < self.capacity:
+			index = self.__index(self.count)
+			self.count += 1
+		else:
+			index = self.start
+			self.start = (self.start + 1) % self.capacity
+
+		self.timestamps[index] = timestamp
+		self.cpu[index] = cpu
+		self.frozen_blocks[index] = max(0, min(frozen_block, 0xFFFFFFFF))
+		self.in_cycle[index] = in_cycle
+		self.running[index] = running
+		return True
+
+	def range(self, start, end):
+		"""Return the positions (0 = oldest) of the samples with start <= timestamp < end"""
+		first = bisect.bisect_left(_RingView(self), start)
+		last = bisect.bisect_left(_RingView(self), end)
+		return first, last
+
+	def sample(self, position):
+		index = self.__index(position)
+		return self.timestamps[index], self.cpu[index], self.frozen_blocks[index], self.in_cycle[index], self.running[index]
+
+	def __index(self, position):
+		return (self.start + position) % self.capacity
+
+
+class _RingView:
+	"""Sequence of the timestamps of a MinerHistory in time order, for bisect"""
+
+	def __init__(self, history):
+		self.history = history
+
+	def __len__(self):
+		return self.history.count
+
+	def __getitem__(self, position):
+		return self.history.timestamps[(self.history.start + position) % self.history.capacity]
+
+
+class StatisticsHistory:
+
+	MAX_POINTS = 5000
+
+	def __init__(self, capacity, log=None):
+		"""
+		:param capacity: number of samples kept per miner
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("StatisticsHistory")
+		else:
+			self.log = log
+
+		self.capacity = capacity
+		self.histories = {}  # miner id -> MinerHistory
+		self.lock = threading.Lock()
+
+	def statistics_updated(self, previous_stat, stat):
+		"""StatisticsProcessingPool listener"""
+		if stat is None:
+			self.remove(previous_stat["minerId"])
+			return
+
+		sample = get_history_sample(stat)
+		if sample is None:
+			return
+
+		self.lock.acquire()
+		try:
+			history = self.histories.get(stat["minerId"])
+			if history is None:
+				history = MinerHistory(self.capacity)
+				self.histories[stat["minerId"]] = history
+			history.append(*sample)
+		finally:
+			self.lock.release()
+
+	def covers(self, miner_id, start):
+		"""Return True if the history of the miner goes back to start"""
+		self.lock.acquire()
+		try:
+			history = self.histories.get(miner_id)
+			return history is not None and history.count > 0 and history.sample(0)[0] <= start
+		finally:
+			self.lock.release()
+
+	def remove(self, miner_id):
+		self.lock.acquire()
+		try:
+			self.histories.pop(miner_id, None)
+		finally:
+			self.lock.release()
+
+	def query(self, miner_id, start, end, step=None):
+		"""
+		Return the samples of start <= timestamp < end downsampled to buckets of step seconds, or None if the miner has no history.
+		Each point is [bucket start, mean cpu, max frozen block, in cycle ratio, running ratio, number of samples]
+		"""
+
+		self.lock.acquire()
+		try:
+			history = self.histories.get(miner_id)
+			if history is None:
+				return None
+
+			first, last = history.range(start, end)
+			samples = [history.sample(position) for position in range(first, last)]
+		finally:
+			self.lock.release()
+
+		return downsample(miner_id, samples, start, end, step)
+
+
+def downsample(miner_id, samples, start, end, step=None):
+	"""Aggregate (timestamp, cpu, frozen block, in cycle, running) samples sorted by time into buckets of step seconds"""
+
+	if step is None or step <= 0:
+		step = (end - start) / 1000 if end > start else 1
+	step = max(step, (end - start) / StatisticsHistory.MAX_POINTS, 1e-3)
+
+	points = []
+	bucket = None
+	for timestamp, cpu, frozen_block, in_cycle, running in samples:
+		bucket_start = start + math.floor((timestamp - start) / step) * step
+		if bucket is None or bucket[0] != bucket_start:
+			if bucket is not None:
+				points.append(_close_bucket(bucket))
+			bucket = [bucket_start, 0.0, 0, 0, 0, 0, 0, 0]  # start, cpu sum, max block, in cycle sum/count, running sum/count, samples
+
+		bucket[1] += cpu
+		bucket[2] = max(bucket[2], frozen_block)
+		if in_cycle >= 0:
+			bucket[3] += in_cycle
+			bucket[4] += 1
+		if running >= 0:
+			bucket[5] += running
+			bucket[6] += 1
+		bucket[7] += 1
+
+	if bucket is not None:
+		points.append(_close_bucket(bucket))
+
+	return {"minerId": miner_id, "from": start, "to": end, "step": step,
+			"fields": ["timestamp"] + list(FIELDS) + ["samples"], "points": points}
+
+
+def _close_bucket(bucket):
+	bucket_start, cpu_sum, frozen_block, in_cycle_sum, in_cycle_count, running_sum, running_count, count = bucket
+	return [bucket_start,
+			round(cpu_sum / count, 3),
+			frozen_block if frozen_block > 0 else None,
+			round(in_cycle_sum / in_cycle_count, 3) if in_cycle_count > 0 else None,
+			round(running_sum / running_count, 3) if running_count > 0 else None,
+			count]
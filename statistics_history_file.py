@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+import os
+import io
+import mmap
+import json
+import time
+import struct
+import logging
+import threading
+import statistics_history
+
+
+MAGIC = b"NYZOHIST"
+VERSION = 1
+HEADER = struct.Struct("<8sII16x")
+RECORD = struct.Struct("<dIfIbb2x")
+INDEX = struct.Struct("<dd")
+BLOCK_RECORDS = 4096
+MINER_INDEX_OFFSET = 2  # position of the miner index in a record viewed as uint32
+LEGACY_SEGMENT = -1  # key of a single history file written before the segments, read until it expires
+
+
+class _Segment:
+	"""
+	Records of a period, appended by the writer thread only:
+
+		<path>.<period start>      header + records (timestamp, miner index, cpu, frozen block, in cycle, running)
+		<path>.<period start>.idx  (first timestamp, last timestamp) of every complete block of BLOCK_RECORDS records
+
+	Readers never touch the files: they use view, (mmap, (first, last) of each block), replaced as a whole under the
+	lock of the history file once the written records are mapped and indexed.
+	"""
+
+	def __init__(self, key, path, log):
+		self.key = key
+		self.path = path
+		self.index_path = path + ".idx"
+		self.log = log
+		self.blocks = []  # (first timestamp, last timestamp) of the complete blocks
+		self.tail = None  # (first timestamp, last timestamp) of the incomplete block
+		self.record_count = 0
+		self.data_file = None
+		self.index_file = None
+		self.view = (None, [])
+
+	def open(self):
+		new_file = not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size
+		self.data_file = open(self.path, "w+b" if new_file else "r+b")
+
+		if new_file:
+			self.data_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+			self.data_file.flush()
+		else:
+			magic, version, record_size = HEADER.unpack(self.data_file.read(HEADER.size))
+			if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+				raise Exception("Unsupported history file " + self.path)
+
+		# drop a partially written record
+		size = os.path.getsize(self.path) - HEADER.size
+		records = size // RECORD.size
+		if size % RECORD.size != 0:
+			self.data_file.truncate(HEADER.size + records * RECORD.size)
+
+		self.blocks = []
+		if os.path.exists(self.index_path):
+			with open(self.index_path, "rb") as index_file:
+				data = index_file.read((records // BLOCK_RECORDS) * INDEX.size)
+			self.blocks = [entry for entry in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size])]
+
+		# index the blocks written after the last index update (crash) and the incomplete block
+		self.index_file = open(self.index_path, "ab")
+		self.index_file.truncate(len(self.blocks) * INDEX.size)
+		self.record_count = len(self.blocks) * BLOCK_RECORDS
+		self.tail = None
+		mapped = self.map()
+		for position in range(self.record_count, records):
+			self.add_to_index(struct.unpack_from("<d", mapped, HEADER.size + position * RECORD.size)[0])
+		self.view = (mapped, self.get_ranges())
+
+	def close(self):
+		self.view = (None, [])  # the mapping is released once the queries holding it are done
+		if self.data_file is not None:
+			self.data_file.close()
+			self.data_file = None
+		if self.index_file is not None:
+			self.index_file.close()
+			self.index_file = None
+
+	def delete(self):
+		self.close()
+		for path in (self.path, self.index_path):
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+
+	def append(self, records):
+		"""Write (timestamp, packed record) records and return the new view"""
+		self.data_file.seek(0, io.SEEK_END)
+		self.data_file.write(b"".join(record for timestamp, record in records))
+		self.data_file.flush()
+		for timestamp, record in records:
+			self.add_to_index(timestamp)
+		return self.map(), self.get_ranges()
+
+	def map(self):
+		"""Map the records written so far. A mapping is never resized nor closed while readers may hold it, it is released with its last reference"""
+		records = (os.fstat(self.data_file.fileno()).st_size - HEADER.size) // RECORD.size
+		if records == 0:
+			return None
+		return mmap.mmap(self.data_file.fileno(), HEADER.size + records * RECORD.size, access=mmap.ACCESS_READ)
+
+	def get_ranges(self):
+		return self.blocks + ([self.tail] if self.tail is not None else [])
+
+	def add_to_index(self, timestamp):
+		if self.tail is None:
+			self.tail = (timestamp, timestamp)
+		else:
+			self.tail = (min(self.tail[0], timestamp), max(self.tail[1], timestamp))
+
+		self.record_count += 1
+		if self.record_count % BLOCK_RECORDS == 0:
+			self.blocks.append(self.tail)
+			self.index_file.write(INDEX.pack(*self.tail))
+			self.index_file.flush()
+			self.tail = None
+
+
+class StatisticsHistoryFile:
+	"""
+	Append-only statistics history of a farm, stored as one segment file of fixed size records per period (see
+	_Segment) and <path>.miners, the JSON list of the miner ids (the record miner index being the position in the list).
+
+	Records are buffered and written in batches by a writer thread, and read back through mmap. The retention is applied
+	by deleting the segments whose records all expired, so no file is ever rewritten. The lock only guards the buffer
+	and the swap of the segment views: the disk writes and the scans of the queries run outside of it, and never delay
+	the statistics listener. Reopening only reads the indexes and the records of the last incomplete blocks.
+	"""
+
+	def __init__(self, path, retention=30 * 86400, batch_size=512, flush_interval=5, segment_duration=86400, log=None):
+		"""
+		:param path: history file path, prefix of the segment files
+		:param retention: segments whose records are all older than this delay in seconds are deleted
+		:param batch_size: number of buffered records triggering a write
+		:param flush_interval: maximum delay in seconds before buffered records are written
+		:param segment_duration: period in seconds covered by a segment file
+		"""
+
+		if log is None:
+			self.log = logging.getLogger("StatisticsHistoryFile")
+		else:
+			self.log = log
+
+		self.path = path
+		self.miners_path = path + ".miners"
+		self.retention = retention
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.segment_duration = segment_duration
+
+		self.lock = threading.Lock()  # buffer, writing, miner ids and segment views
+		self.write_lock = threading.Lock()  # serializes the writers (writer thread and stop)
+		self.buffer = []  # (timestamp, packed record) waiting to be written
+		self.writing = []  # records being written, still read from memory by the queries
+		self.miner_ids = []
+		self.miner_indexes = {}  # miner id -> record miner index
+		self.saved_miners = 0  # number of miner ids written to the miners file
+		self.segments = {}  # period start -> _Segment
+		self.flush_requested = threading.Event()
+		self.stop_requested = False
+		self.closed = False
+		self.thread = None
+
+		self.__open()
+
+	def start(self):
+		self.thread = threading.Thread(target=self.__flush_loop, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.stop_requested = True
+		self.flush_requested.set()
+		if self.thread is not None:
+			self.thread.join()
+		self.flush()
+
+		self.write_lock.acquire()
+		try:
+			self.closed = True
+			for segment in self.segments.values():
+				segment.close()
+		finally:
+			self.write_lock.release()
+
+	def statistics_updated(self, previous_stat, stat):
+		"""StatisticsProcessingPool listener"""
+		sample = statistics_history.get_history_sample(stat)
+		if sample is None:
+			return
+
+		timestamp, cpu, frozen_block, in_cycle, running = sample
+		self.lock.acquire()
+		try:
+			miner_index = self.__get_miner_index(stat["minerId"])
+			self.buffer.append((timestamp, RECORD.pack(timestamp, miner_index, cpu, max(0, min(frozen_block, 0xFFFFFFFF)), in_cycle, running)))
+			if len(self.buffer) >= self.batch_size:
+				self.flush_requested.set()
+		finally:
+			self.lock.release()
+
+	def flush(self):
+		"""Write the buffered records to their segments"""
+		self.write_lock.acquire()
+		try:
+			self.lock.acquire()
+			try:
+				if self.closed:
+					return
+				records = self.buffer
+				self.buffer = []
+				self.writing = records
+				miner_ids = list(self.miner_ids) if len(self.miner_ids) > self.saved_miners else None
+			finally:
+				self.lock.release()
+
+			if miner_ids is not None:
+				self.__save_miners(miner_ids)
+
+			views = {}
+			try:
+				limit = time.time() - self.retention
+				periods = {}
+				for timestamp, record in sorted(records, key=lambda record: record[0]):
+					key = int(timestamp // self.segment_duration) * self.segment_duration
+					if key + self.segment_duration > limit:  # records of an expired period are dropped
+						periods.setdefault(key, []).append((timestamp, record))
+
+				for key, period_records in periods.items():
+					segment = self.segments.get(key)
+					if segment is not None:
+						views[segment] = segment.append(period_records)
+						continue
+
+					# a new segment is only registered once written, it must not leak its files if the write fails
+					segment = _Segment(key, self.path + "." + str(key), self.log)
+					try:
+						segment.open()
+						views[segment] = segment.append(period_records)
+					except Exception:
+						segment.close()
+						raise
+			finally:
+				self.lock.acquire()
+				try:
+					for segment, view in views.items():
+						segment.view = view
+						self.segments[segment.key] = segment
+					self.writing = []
+				finally:
+					self.lock.release()
+		finally:
+			self.write_lock.release()
+
+	def expire(self, now=None):
+		"""Delete the segments whose records are all older than the retention, return the number of deleted segments"""
+
+		if now is None:
+			now = time.time()
+		limit = now - self.retention
+
+		self.write_lock.acquire()
+		try:
+			self.lock.acquire()
+			try:
+				expired = [segment for segment in self.segments.values() if StatisticsHistoryFile.__get_end(segment, self.segment_duration) <= limit]
+				for segment in expired:
+					del self.segments[segment.key]
+			finally:
+				self.lock.release()
+
+			# the mappings held by running queries stay readable after the files are deleted
+			for segment in expired:
+				self.log.info("Deleting expired history segment " + segment.path)
+				segment.delete()
+			return len(expired)
+		finally:
+			self.write_lock.release()
+
+	def query(self, miner_id, start, end, step=None):
+		"""Same as StatisticsHistory.query, read from the segments and the pending records"""
+
+		self.lock.acquire()
+		try:
+			miner_index = self.miner_indexes.get(miner_id)
+			if miner_index is None:
+				return None
+			views = [segment.view for segment in self.segments.values()]
+			pending = self.writing + self.buffer
+		finally:
+			self.lock.release()
+
+		samples = []
+		for mapped, ranges in views:
+			for block, (first, last) in enumerate(ranges):
+				if last < start or first >= end:
+					continue
+
+				begin = block * BLOCK_RECORDS
+				StatisticsHistoryFile.__scan(mapped, miner_index, begin, min(begin + BLOCK_RECORDS, (len(mapped) - HEADER.size) // RECORD.size), start, end, samples)
+
+		for timestamp, record in pending:
+			values = RECORD.unpack(record)
+			if values[1] == miner_index and start <= timestamp < end:
+				samples.append((timestamp,) + values[2:])
+
+		samples.sort(key=lambda sample: sample[0])
+		return statistics_history.downsample(miner_id, samples, start, end, step)
+
+	def __flush_loop(self):
+		while not self.stop_requested:
+			self.flush_requested.wait(self.flush_interval)
+			self.flush_requested.clear()
+			if self.stop_requested:
+				break
+			try:
+				self.flush()
+				self.expire()
+			except Exception as e:
+				self.log.error("Error while writing history: " + str(e))
+
+	def __open(self):
+		if os.path.exists(self.miners_path):
+			with open(self.miners_path, "r") as miners_file:
+				self.miner_ids = json.load(miners_file)
+		self.miner_indexes = {miner_id: index for index, miner_id in enumerate(self.miner_ids)}
+		self.saved_miners = len(self.miner_ids)
+
+		directory, prefix = os.path.split(os.path.abspath(self.path))
+		keys = [int(name[len(prefix) + 1:]) for name in os.listdir(directory) if name.startswith(prefix + ".") and name[len(prefix) + 1:].isdigit()]
+		if os.path.isfile(self.path):
+			keys.append(LEGACY_SEGMENT)
+
+		records = 0
+		for key in sorted(keys):
+			segment = _Segment(key, self.path if key == LEGACY_SEGMENT else self.path + "." + str(key), self.log)
+			segment.open()
+			self.segments[key] = segment
+			records += segment.record_count
+
+		self.log.info("Opened " + self.path + " (" + str(len(self.segments)) + " segments, " + str(records) + " records, " + str(len(self.miner_ids)) + " miners)")
+
+	def __save_miners(self, miner_ids):
+		"""Write the miner ids before the records referencing them"""
+		temporary_path = self.miners_path + ".tmp"
+		with open(temporary_path, "w") as miners_file:
+			json.dump(miner_ids, miners_file)
+		os.replace(temporary_path, self.miners_path)
+		self.saved_miners = len(miner_ids)
+
+	@staticmethod
+	def __get_end(segment, segment_duration):
+		"""End of the period of a segment, or its last record for the legacy file"""
+		if segment.key != LEGACY_SEGMENT:
+			return segment.key + segment_duration
+		ranges = segment.view[1]
+		return max(last for first, last in ranges) if len(ranges) > 0 else 0
+
+	@staticmethod
+	def __scan(mapped, miner_index, begin, end, start, stop, samples):
+		"""Append the samples of miner_index between the records begin and end (excluded)"""
+
+		if end <= begin:
+			return
+
+		offset = HEADER.size + begin * RECORD.size
+		words = RECORD.size // 4
+		with memoryview(mapped) as view:
+			with view[offset:offset + (end - begin) * RECORD.size] as records:
+				with records.cast('I') as as_uint32:
+					# the miner indexes of the block as contiguous bytes, searched at C speed
+					miner_indexes = as_uint32[MINER_INDEX_OFFSET::words].tobytes()
+
+		needle = struct.pack("<I", miner_index)
+		position = miner_indexes.find(needle)
+		while position >= 0:
+			if position % 4 == 0:
+				values = RECORD.unpack_from(mapped, offset + (position // 4) * RECORD.size)
+				if start <= values[0] < stop:
+					samples.append((values[0],) + values[2:])
+				position = miner_indexes.find(needle, position + 4)
+			else:
+				position = miner_indexes.find(needle, position + 4 - position % 4)
+
+	def __get_miner_index(self, miner_id):
+		miner_index = self.miner_indexes.get(miner_id)
+		if miner_index is None:
+			miner_index = len(self.miner_ids)
+			self.miner_ids.append(miner_id)
+			self.miner_indexes[miner_id] = miner_index
+
+		return miner_index
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import threading
+import time
+import unittest
+
+from command_jobs import CommandJob, CommandJobManager, MinerProgress
+
+
+class FakeFarm:
+	"""Farm whose commands succeed unless the miner is in failing, and whose verifiers are back in cycle right after"""
+
+	def __init__(self, failing=()):
+		self.failing = set(failing)
+		self.executed = []
+		self.lock = threading.Lock()
+
+	def get_miner(self, miner_id):
+		return miner_id
+
+	def execute_command(self, miner, command):
+		with self.lock:
+			self.executed.append(miner)
+		return miner not in self.failing
+
+	def get_statistics(self, miner_id):
+		return {"timestamp": time.time() + 1, "in_cycle": 'True'}
+
+
+class CommandJobManagerTest(unittest.TestCase):
+
+	def run_job(self, farm, miner_ids, concurrency, rolling):
+		manager = CommandJobManager(farm, parallelism=4)
+		finished = threading.Event()
+		manager.add_listener(lambda job, miner_progress: miner_progress is None and finished.set())
+		try:
+			job = manager.submit("restart", miner_ids, concurrency=concurrency, rolling=rolling, rolling_timeout=2)
+			self.assertTrue(finished.wait(10), "job not finished")
+			return job
+		finally:
+			manager.stop()
+
+	def test_rolling(self):
+		farm = FakeFarm()
+		job = self.run_job(farm, ["m1", "m2", "m3", "m4"], concurrency=2, rolling=2)
+
+		self.assertEqual(CommandJob.DONE, job.state)
+		self.assertIsNone(job.error)
+		self.assertEqual(["m1", "m2", "m3", "m4"], sorted(farm.executed))
+		self.assertTrue(all(progress.state == MinerProgress.DONE for progress in job.progress.values()))
+
+	def test_rolling_wave_failed(self):
+		farm = FakeFarm(failing=["m1", "m2"])
+		start = time.time()
+		job = self.run_job(farm, ["m1", "m2", "m3", "m4"], concurrency=2, rolling=1)
+
+		self.assertEqual(CommandJob.FAILED, job.state)
+		self.assertIsNotNone(job.error)
+		self.assertLess(time.time() - start, 2, "waited for the rolling timeout")
+		self.assertEqual(["m1", "m2"], sorted(farm.executed))
+		self.assertEqual([MinerProgress.FAILED, MinerProgress.FAILED, MinerProgress.SKIPPED, MinerProgress.SKIPPED],
+						 [progress.state for progress in job.progress.values()])
+
+	def test_rolling_wave_partially_failed(self):
+		farm = FakeFarm(failing=["m1"])
+		job = self.run_job(farm, ["m1", "m2", "m3", "m4"], concurrency=2, rolling=2)
+
+		self.assertEqual(CommandJob.FAILED, job.state)
+		self.assertEqual(["m1", "m2"], sorted(farm.executed))
+		self.assertEqual([MinerProgress.SKIPPED, MinerProgress.SKIPPED], [job.progress[miner_id].state for miner_id in ("m3", "m4")])
+
+
+if __name__ == '__main__':
+	unittest.main()
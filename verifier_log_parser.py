@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import re
+
+
+FREEZING_BLOCK = "freezing block ["
+FOR_HEIGHT = "for height "
+CONSECUTIVE_SPACES = re.compile(' +')
+
+
+class VerifierLogParser:
+	"""
+	Streaming parser of the nyzoVerifier stdout log. Text is fed as complete lines and only the last event of each kind
+	is decoded, so the cost of a chunk is mostly a few substring searches done at C speed.
+
+	Extracted events:
+		frozen_block   height of the last "freezing block [" line (same value as the former Miner parsing)
+		in_cycle       'False' if that line is a v=0 block, 'True' otherwise
+		for_height     height of the last "for height <height>" line: the block the verifier is fetching or voting on
+		frozen_blocks  number of "freezing block [" lines fed
+		line_count     number of lines fed
+	"""
+
+	def __init__(self):
+		self.frozen_block = None
+		self.in_cycle = None
+		self.for_height = None
+		self.frozen_blocks = 0
+		self.line_count = 0
+
+	def feed(self, text):
+		"""Parse complete lines. A trailing line without end of line is parsed as complete"""
+		if len(text) == 0:
+			return
+
+		self.line_count += text.count("\n") + (0 if text.endswith("\n") else 1)
+		self.frozen_blocks += text.count(FREEZING_BLOCK)
+
+		end = len(text)
+		while True:
+			# "freezing" is searched rather than FREEZING_BLOCK as consecutive spaces are collapsed before matching
+			position = text.rfind("freezing", 0, end)
+			if position < 0:
+				break
+
+			line_start, line_end = _line_bounds(text, position)
+			if self.__parse_freezing_line(text[line_start:line_end]):
+				break
+			end = line_start
+
+		end = len(text)
+		while True:
+			position = text.rfind(FOR_HEIGHT, 0, end)
+			if position < 0:
+				break
+
+			# "threshold for height 123 is 45", "requesting block with votes for height 123"
+			fields = text[position + len(FOR_HEIGHT):_line_bounds(text, position)[1]].split(None, 1)
+			if len(fields) > 0 and fields[0].isdigit():
+				self.for_height = fields[0]
+				break
+			end = position
+
+	def feed_lines(self, lines):
+		for line in lines:
+			self.feed(line + "\n")
+
+	def update_report(self, report):
+		"""Set the Miner report fields found so far. The counts are those of the text fed to this parser"""
+		if self.frozen_block is not None:
+			report["frozenblock"] = self.frozen_block
+			report["in_cycle"] = self.in_cycle
+		if self.for_height is not None:
+			report["for_height"] = self.for_height
+		report["frozen_blocks"] = self.frozen_blocks
+		report["log_lines"] = self.line_count
+
+	def __parse_freezing_line(self, log):
+		log = CONSECUTIVE_SPACES.sub(' ', log)
+		if FREEZING_BLOCK not in log:
+			return False
+
+		# "freezing block [Block: height=123, ..." or "freezing block [Block:v=0,height=123,hash..." out of cycle
+		if "v=0" in log:
+			pos, posx, posy = 2, 2, 5
+		else:
+			pos, posx, posy = 3, 1, 1
+
+		try:
+			frozen_block = log.split(" ")[pos].split('=')[posx][:-posy]
+		except IndexError:
+			return False  # malformed line, keep looking for a previous one
+
+		self.frozen_block = frozen_block
+		self.in_cycle = 'False' if "v=0" in log else 'True'
+		return True
+
+
+def _line_bounds(text, position):
+	"""Start and end of the line containing position. Lines end with \\n or \\r like str.splitlines"""
+	line_start = max(text.rfind("\n", 0, position), text.rfind("\r", 0, position)) + 1
+	line_end = len(text)
+	for separator in ("\n", "\r"):
+		end = text.find(separator, position)
+		if 0 <= end < line_end:
+			line_end = end
+	return line_start, line_end
+
+
+def parse_log(text, report):
+	"""Parse a log extract and set the Miner report fields"""
+	parser = VerifierLogParser()
+	parser.feed(text)
+	parser.update_report(report)
+	return parser
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+MIT License
+
+Copyright (c) 2018 Ortis (cao.ortis.org@gmail.com)
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import verifier_log_parser
+
+
+# Report of a verifier built from the outputs of the statistics commands. Shared by the ssh probes (Miner) and the
+# push agent (nyzo_agent.py) so both produce the same fields: it must not depend on paramiko.
+
+CPU_COMMAND = "cat /proc/loadavg"
+PROCESSES_COMMAND = "ps faux | grep nyzoVerifier"  # parse process with ps faux because top have different behavior across plateform
+LOG_TAIL_MAX_BYTES = 65536  # maximum number of log bytes read per probe
+
+
+def build_report(outputs, log):
+	"""
+	Return the report from outputs, a dict section -> (stdout, stderr) of the sections cpu, version, processes and
+	optionally log. The log_tail section is parsed by parse_log_tail as it needs the cursor of the previous probe.
+	"""
+	report = {}
+
+	# parse cpu load
+	stdout_str, stderr_str = outputs["cpu"]
+
+	if len(stderr_str) > 0:
+		report["error_cpu_load"] = stderr_str
+		log.warning("Error while parsing cpu load: " + report["error_cpu_load"])
+	else:
+		stdout_list = stdout_str.split(' ')
+		report["cpu"] = float(stdout_list[1])*100
+
+	stdout_str, stderr_str = outputs["version"]
+	if len(stderr_str) > 0:
+		report["version"] = 'Unknown'
+		log.warning("Error while fetching version: " + report["version"])
+	else:
+		stdout_list = stdout_str.split(' ')
+		version = stdout_list[len(stdout_list)-1].rstrip()[:-1]
+		report["version"] = version
+
+	stdout_str, stderr_str = outputs["processes"]
+
+	if len(stderr_str) > 0:
+		report["error_processes"] = stderr_str
+		log.warning("Error while parsing processes: " + report["error_processes"])
+	else:
+		report["process"] = []
+		for process in stdout_str.splitlines():
+			if " grep " in process:
+				continue
+			elif "nyzoVerifier" in process:
+				report["process"].append("nyzoVerifier")
+			else:
+				buffer = process.split("nyzoVerifier ")
+				if len(buffer) > 1:
+					report["process"].append(str(buffer[1]).strip())
+
+	report["process"].sort()
+	report["nyzoVerifier"] = False
+	report["listen"] = False
+	report["solving"] = False
+
+	for process in report["process"]:
+		if process == "nyzoVerifier":
+			report["nyzoVerifier"] = 'True'
+		elif "listen" in process:
+			report["listen"] = True
+		elif "solving" in process:
+			report["solving"] = True
+
+	if "log" in outputs:
+		# parse log
+		stdout_str, stderr_str = outputs["log"]
+		if len(stderr_str) > 0:
+			report["error_logs"] = stderr_str
+			log.warning("Error while parsing logs: " + report["error_logs"])
+		else:
+			verifier_log_parser.parse_log(stdout_str, report)
+
+	return report
+
+
+def parse_log_tail(stdout_str, cursor, report, log):
+	"""
+	Feed the log lines appended since the previous probe to the log parser and return the new cursor.
+	stdout_str is "inode start size" followed by the bytes of the log in [start, size). The cursor (None on the first
+	probe) holds the position reached by the previous probe, its incomplete last line and the values parsed so far.
+	"""
+
+	header, separator, data = stdout_str.partition("\n")
+	buffer = header.split()
+	if len(buffer) != 3:
+		report["error_logs"] = "Invalid log tail header: " + header
+		log.warning("Error while parsing logs: " + report["error_logs"])
+		return cursor
+
+	inode, start, size = buffer[0], int(buffer[1]), int(buffer[2])
+	if cursor is None or cursor["inode"] != inode or cursor["offset"] != start:
+		if cursor is not None:
+			log.debug("Log rotated, truncated or skipped, reading from byte " + str(start))
+
+		# the values parsed before the discontinuity stay valid until the new lines override them
+		previous = {} if cursor is None else cursor["report"]
+		cursor = {"inode": inode, "offset": start, "partial": "", "report": dict(previous)}
+		if start > 0:
+			data = data.partition("\n")[2]  # started in the middle of a line
+
+	text = cursor["partial"] + data
+	complete = text.rfind("\n") + 1
+	partial = text[complete:]  # the last line is not complete yet
+
+	parsed = dict(cursor["report"])
+	verifier_log_parser.parse_log(text[:complete], parsed)
+	report.update(parsed)
+
+	return {"inode": inode, "offset": size, "partial": partial[-LOG_TAIL_MAX_BYTES:], "report": parsed}